@@ -0,0 +1,42 @@
+"""Per-call cost of producing BST timestamps on the message path.
+
+Usage: python benchmarks/bst_time.py [calls]
+
+Compares the previous get_bst_now() (ZoneInfo built on every call) with
+what handlers do now: store int(time.time()) and format with format_bst()
+only when rendering, which hits a per-second cache during bursts.
+"""
+import os
+import sys
+import time
+import timeit
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+os.environ.setdefault("GROUP_ID", "0")
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+
+import main  # noqa: E402
+
+
+def old_get_bst_now():
+    from zoneinfo import ZoneInfo
+    return datetime.now(ZoneInfo("Asia/Dhaka")).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def run():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    cases = [
+        ("old get_bst_now()          ", old_get_bst_now),
+        ("message path: int(time())  ", lambda: int(time.time())),
+        ("format_bst(now), cache hit ", lambda: main.format_bst(time.time())),
+        ("format_bst, cache miss     ", lambda: main._format_bst_second.__wrapped__(int(time.time()))),
+    ]
+    for label, fn in cases:
+        best = min(timeit.repeat(fn, number=calls, repeat=3))
+        print(f"{label}: {best / calls * 1e9:8.0f} ns/call")
+
+
+if __name__ == "__main__":
+    run()
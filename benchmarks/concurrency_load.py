@@ -0,0 +1,125 @@
+"""Throughput of sequential vs concurrent update processing.
+
+Usage: python benchmarks/concurrency_load.py [users] [api_latency_ms] [concurrency]
+
+Runs the real Application in-process against the stub Bot API, once with
+UPDATE_CONCURRENCY=1 and once with the given limit. Every user double-taps
+"Create Ticket" and then sends two messages into the new ticket, so the
+load mixes handlers that reply inline with ones that queue outbound sends.
+Reports updates/s until the stub has seen every expected send, and checks
+that no user ended up with two tickets.
+"""
+import asyncio
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, ".."))
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+os.environ.setdefault("GROUP_ID", "-100")
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+
+from telegram import Update  # noqa: E402
+
+from stub_bot_api import start_stub  # noqa: E402
+
+SENDS_PER_USER = 4  # created + "already have a ticket" + two messages to the group
+
+
+def user_payload(user_id):
+    return {"id": user_id, "is_bot": False, "first_name": "Load", "username": f"load{user_id}"}
+
+
+def tap_update(update_id, user_id):
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": user_payload(user_id),
+            "chat_instance": str(user_id),
+            "data": "create_ticket",
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+            },
+        },
+    }
+
+
+def text_update(update_id, user_id, text):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": user_payload(user_id),
+            "text": text,
+        },
+    }
+
+
+async def measure(main, stub, concurrency, first_user, users):
+    main.UPDATE_CONCURRENCY = concurrency
+    main.rate_limiter.limits["private"] = (1000, 60)
+    app = main.build_app()
+    await app.initialize()
+    await app.start()
+    await main.start_delivery(app)
+
+    payloads = []
+    update_id = first_user * 10
+    for user_id in range(first_user, first_user + users):
+        for _ in range(2):
+            update_id += 1
+            payloads.append(tap_update(update_id, user_id))
+    for text in ("first", "second"):
+        for user_id in range(first_user, first_user + users):
+            update_id += 1
+            payloads.append(text_update(update_id, user_id, text))
+
+    baseline = stub.sends()
+    started = time.perf_counter()
+    for payload in payloads:
+        await app.update_queue.put(Update.de_json(payload, app.bot))
+    while stub.sends() - baseline < users * SENDS_PER_USER:
+        await asyncio.sleep(0.005)
+    elapsed = time.perf_counter() - started
+
+    await app.stop()
+    await main.stop_delivery(app)
+    await app.shutdown()
+
+    doubles = sum(
+        1 for user_id in range(first_user, first_user + users)
+        if len(main.store.user_tickets(user_id)) != 1
+    )
+    print(
+        f"UPDATE_CONCURRENCY={concurrency:<4}: {len(payloads) / elapsed:8.0f} updates/s "
+        f"({elapsed:.2f}s for {len(payloads)} updates), users with != 1 ticket: {doubles}"
+    )
+    return elapsed
+
+
+async def run(users, latency, concurrency):
+    stub, runner, api_url = await start_stub(latency=latency)
+    os.environ["BOT_API_URL"] = api_url
+    import main
+    main.BOT_API_URL = api_url
+
+    print(f"users: {users}  stub latency: {latency * 1000:.0f} ms")
+    sequential = await measure(main, stub, 1, 10_000, users)
+    concurrent = await measure(main, stub, concurrency, 20_000, users)
+    print(f"speedup: {sequential / concurrent:.1f}x")
+    await runner.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(run(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 100,
+        float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.05,
+        int(sys.argv[3]) if len(sys.argv) > 3 else 64,
+    ))
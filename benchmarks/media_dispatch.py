@@ -0,0 +1,124 @@
+"""Per-update cost of picking the media type and dispatching the send.
+
+Usage: python benchmarks/media_dispatch.py [updates]
+
+Replays a mix of real telegram.Message objects (text, every media kind,
+unsupported) through the old per-handler elif chain and through
+resolve_media(), then through copy_media() against a bot that only
+counts calls, to show the dispatch overhead and Bot API calls per update,
+both for the first item of a ticket and once the ticket has a thread
+anchor that caption-less media can reply to.
+"""
+import asyncio
+import os
+import sys
+import time
+import timeit
+from collections import Counter
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+os.environ.setdefault("GROUP_ID", "0")
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+
+from telegram import (  # noqa: E402
+    Animation, Audio, Chat, Contact, Document, Message, PhotoSize, Sticker,
+    Video, VideoNote, Voice,
+)
+
+import main  # noqa: E402
+
+DATE = datetime(2024, 1, 1, tzinfo=timezone.utc)
+CHAT = Chat(1, Chat.PRIVATE)
+
+
+def sample_messages():
+    photo = [PhotoSize("p1", "u1", 90, 90), PhotoSize("p2", "u2", 800, 800)]
+    media = [
+        {"text": "hello"},
+        {"photo": photo, "caption": "look"},
+        {"voice": Voice("v", "uv", 3)},
+        {"video": Video("vd", "uvd", 640, 480, 5)},
+        {"document": Document("d", "ud")},
+        {"audio": Audio("a", "ua", 30)},
+        {"sticker": Sticker("s", "us", 512, 512, False, False, Sticker.REGULAR)},
+        {"animation": Animation("g", "ug", 320, 240, 2), "document": Document("g", "ug")},
+        {"video_note": VideoNote("n", "un", 240, 4)},
+        {"contact": Contact("+1", "Bob")},
+    ]
+    return [Message(i, DATE, CHAT, **kwargs) for i, kwargs in enumerate(media, 1)]
+
+
+def old_chain(message):
+    # The per-handler chain this replaced, minus the sends.
+    if message.text:
+        return "text"
+    elif message.photo:
+        return message.photo[-1].file_id
+    elif message.voice:
+        return message.voice.file_id
+    elif message.video:
+        return message.video.file_id
+    elif message.document:
+        return message.document.file_id
+    elif message.audio:
+        return message.audio.file_id
+    elif message.sticker:
+        return message.sticker.file_id
+    elif message.animation:
+        return message.animation.file_id
+    elif message.video_note:
+        return message.video_note.file_id
+    return None
+
+
+def new_dispatch(message):
+    if message.text:
+        return "text"
+    return main.resolve_media(message)
+
+
+class CountingBot:
+    def __init__(self):
+        self.calls = Counter()
+
+    def __getattr__(self, name):
+        async def call(**kwargs):
+            self.calls[name] += 1
+            return Message(0, DATE, CHAT)
+        return call
+
+
+async def dispatch_all(bot, messages, rounds, anchor):
+    for _ in range(rounds):
+        for message in messages:
+            kind = main.resolve_media(message)
+            if kind:
+                await main.copy_media(bot, 0, message, kind, "header", anchor)
+
+
+def run():
+    updates = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    messages = sample_messages()
+    rounds = max(1, updates // len(messages))
+    total = rounds * len(messages)
+
+    for label, fn in (("old elif chain ", old_chain), ("resolve_media()", new_dispatch)):
+        best = min(timeit.repeat(lambda: [fn(m) for m in messages], number=rounds, repeat=3))
+        print(f"{label}: {best / total * 1e9:8.0f} ns/update")
+
+    media_updates = rounds * sum(1 for m in messages if main.resolve_media(m))
+    for label, anchor in (("no anchor", None), ("threaded ", 1)):
+        bot = CountingBot()
+        started = time.perf_counter()
+        asyncio.run(dispatch_all(bot, messages, rounds, anchor))
+        elapsed = time.perf_counter() - started
+        print(
+            f"copy_media(), {label}: {elapsed / media_updates * 1e9:8.0f} ns/media update, "
+            f"{sum(bot.calls.values()) / media_updates:.2f} API calls/media update {dict(bot.calls)}"
+        )
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,258 @@
+"""Replay synthetic update streams through the real application, offline.
+
+Usage: python benchmarks/replay.py [--users N] [--tickets M] [--messages K]
+           [--media text=70,photo=10,...] [--albums A] [--album-size S]
+           [--replies R] [--lists L] [--broadcasts B]
+           [--latency MS] [--concurrency C] [--storage memory|sqlite]
+
+Builds the application with build_app() against the stub Bot API on
+127.0.0.1 (no network needed) and feeds it updates through update_queue,
+phase by phase:
+
+  tickets    M users tap "Create Ticket"
+  messages   K messages per ticket, drawn from the media mix
+  albums     A album bursts of S photos from ticket owners
+  replies    R staff replies in the support group
+  lists      L /list open calls
+  broadcast  B /send @all broadcasts to every user
+
+Each phase runs until its updates are handled and every queued send,
+album and broadcast has finished. It reports updates/s per phase, the
+p50/p99 latency of each handler, and peak RSS.
+
+The stub shares the event loop with the bot, so its CPU time shows up in
+the numbers; compare runs with each other rather than with production.
+"""
+import argparse
+import asyncio
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, ".."))
+
+from stub_bot_api import start_stub  # noqa: E402
+
+GROUP_ID = -100
+STAFF = {"id": 1, "is_bot": False, "first_name": "Staff", "username": "staff"}
+DEFAULT_MEDIA = "text=70,photo=10,sticker=5,voice=5,document=5,video=3,video_note=2"
+
+
+class LatencyRecorder:
+    """Stands in for main.handler_latency and keeps every sample."""
+
+    def __init__(self):
+        self.samples = defaultdict(list)
+
+    def observe(self, name, seconds):
+        self.samples[name].append(seconds)
+
+    def report(self):
+        for name, samples in sorted(self.samples.items()):
+            samples.sort()
+            p50 = samples[len(samples) // 2]
+            p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+            print(f"  {name:<16} n={len(samples):<7} p50={p50 * 1000:7.2f} ms  p99={p99 * 1000:7.2f} ms")
+
+
+class UpdateFactory:
+    def __init__(self):
+        self.update_id = 0
+        self.message_id = 10_000_000
+
+    def _next(self):
+        self.update_id += 1
+        self.message_id += 1
+        return self.update_id, self.message_id
+
+    @staticmethod
+    def user(user_id):
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"}
+
+    def private(self, user_id, **content):
+        update_id, message_id = self._next()
+        return {"update_id": update_id, "message": {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self.user(user_id),
+            **content,
+        }}
+
+    def group(self, **content):
+        update_id, message_id = self._next()
+        return {"update_id": update_id, "message": {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": GROUP_ID, "type": "supergroup"},
+            "from": STAFF,
+            **content,
+        }}
+
+    def command(self, text):
+        command = text.split()[0]
+        return self.group(text=text, entities=[{"type": "bot_command", "offset": 0, "length": len(command)}])
+
+    def tap(self, user_id, data):
+        update_id, message_id = self._next()
+        return {"update_id": update_id, "callback_query": {
+            "id": str(update_id),
+            "from": self.user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {"message_id": message_id, "date": int(time.time()), "chat": {"id": user_id, "type": "private"}},
+        }}
+
+
+def media_content(kind, n):
+    file = {"file_id": f"{kind}-{n}", "file_unique_id": f"u{kind}{n}"}
+    if kind == "text":
+        return {"text": f"synthetic message {n} " + "lorem ipsum " * random.randint(1, 20)}
+    if kind == "photo":
+        return {"photo": [dict(file, width=90, height=90), dict(file, width=1280, height=960)], "caption": f"photo {n}"}
+    if kind == "sticker":
+        return {"sticker": dict(file, width=512, height=512, is_animated=False, is_video=False, type="regular")}
+    if kind == "voice":
+        return {"voice": dict(file, duration=4)}
+    if kind == "document":
+        return {"document": dict(file, file_name=f"log{n}.txt"), "caption": "logs"}
+    if kind == "video":
+        return {"video": dict(file, width=640, height=480, duration=9)}
+    if kind == "video_note":
+        return {"video_note": dict(file, length=240, duration=5)}
+    raise ValueError(f"unknown media kind {kind!r}")
+
+
+def parse_mix(text):
+    kinds, weights = [], []
+    for part in text.split(","):
+        kind, weight = part.split("=")
+        kinds.append(kind.strip())
+        weights.append(float(weight))
+    return kinds, weights
+
+
+async def settle(main, app):
+    """Wait until updates, album windows, outbound sends and broadcasts are done."""
+    await app.update_queue.join()
+    while main.pending_albums or main.outbound.queues or main.broadcast_running:
+        await asyncio.sleep(0.005)
+
+
+async def run_phase(main, app, name, payloads, Update):
+    if not payloads:
+        return
+    started = time.perf_counter()
+    for payload in payloads:
+        await app.update_queue.put(Update.de_json(payload, app.bot))
+    await settle(main, app)
+    elapsed = time.perf_counter() - started
+    print(f"{name:<10} {len(payloads):>7} updates  {len(payloads) / elapsed:9.0f} updates/s  ({elapsed:.2f}s)")
+
+
+async def replay(args):
+    stub, runner, api_url = await start_stub(latency=args.latency / 1000)
+    workdir = tempfile.mkdtemp(prefix="blockveil-replay-")
+    os.environ.update(
+        BOT_TOKEN="0:replay",
+        GROUP_ID=str(GROUP_ID),
+        BOT_API_URL=api_url,
+        STORAGE_BACKEND=args.storage,
+        DATABASE_PATH=os.path.join(workdir, "replay.db"),
+        GROUP_MESSAGE_SPILL_PATH=os.path.join(workdir, "group_messages.db"),
+        UPDATE_CONCURRENCY=str(args.concurrency),
+        METRICS_PORT="0",
+        ALBUM_WINDOW="0.2",
+        BROADCAST_GLOBAL_RATE="100000",
+        BROADCAST_PER_CHAT_RATE="100000",
+        RATE_LIMITS=",".join(f"{scope}=1000000/60" for scope in
+                             ("private", "create_ticket", "profile", "status", "requestclose")),
+    )
+    import main
+    from telegram import Update
+
+    recorder = LatencyRecorder()
+    main.handler_latency = recorder
+    app = main.build_app()
+    await app.initialize()
+    await app.start()
+    await main.on_start(app)
+
+    random.seed(args.seed)
+    factory = UpdateFactory()
+    owners = list(range(100_000, 100_000 + args.users))
+    ticket_owners = owners[:args.tickets]
+    kinds, weights = parse_mix(args.media)
+
+    print(f"users={args.users} tickets={args.tickets} storage={args.storage} "
+          f"latency={args.latency:g}ms concurrency={args.concurrency}")
+
+    await run_phase(main, app, "tickets", [factory.tap(uid, "create_ticket") for uid in ticket_owners], Update)
+
+    messages = []
+    for n in range(args.messages * len(ticket_owners)):
+        uid = ticket_owners[n % len(ticket_owners)]
+        kind = random.choices(kinds, weights)[0]
+        messages.append(factory.private(uid, **media_content(kind, n)))
+    await run_phase(main, app, "messages", messages, Update)
+
+    albums = []
+    for n in range(args.albums):
+        uid = random.choice(ticket_owners)
+        group_id = f"album-{n}"
+        for i in range(args.album_size):
+            albums.append(factory.private(uid, media_group_id=group_id, **media_content("photo", n * 100 + i)))
+    await run_phase(main, app, "albums", albums, Update)
+
+    targets = list(main.store.group_messages)
+    replies = []
+    for n in range(args.replies if targets else 0):
+        reply_to = {"message_id": random.choice(targets), "date": int(time.time()),
+                    "chat": {"id": GROUP_ID, "type": "supergroup"}}
+        kind = random.choices(kinds, weights)[0]
+        replies.append(factory.group(reply_to_message=reply_to, **media_content(kind, n)))
+    await run_phase(main, app, "replies", replies, Update)
+
+    await run_phase(main, app, "lists", [factory.command("/list open") for _ in range(args.lists)], Update)
+    await run_phase(main, app, "broadcast",
+                    [factory.command("/send @all synthetic announcement") for _ in range(args.broadcasts)], Update)
+
+    await app.stop()
+    await main.on_stop(app)
+    await app.shutdown()
+    await runner.cleanup()
+
+    print("handler latency:")
+    recorder.report()
+    print(f"Bot API calls: {sum(stub.calls.values())} {dict(stub.calls.most_common())}")
+    print(f"peak RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MiB")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--tickets", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=5, help="messages per ticket")
+    parser.add_argument("--media", default=DEFAULT_MEDIA, help="kind=weight list")
+    parser.add_argument("--albums", type=int, default=100)
+    parser.add_argument("--album-size", type=int, default=5)
+    parser.add_argument("--replies", type=int, default=2000)
+    parser.add_argument("--lists", type=int, default=50)
+    parser.add_argument("--broadcasts", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.0, help="stub API latency in ms")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--storage", choices=("memory", "sqlite"), default="memory")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    args.tickets = min(args.tickets, args.users)
+    return args
+
+
+if __name__ == "__main__":
+    asyncio.run(replay(parse_args()))
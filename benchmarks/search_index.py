@@ -0,0 +1,71 @@
+"""Indexing cost and /search latency on both storage backends.
+
+Usage: python benchmarks/search_index.py [messages] [tickets] [memory|sqlite|both]
+
+Logs `messages` synthetic messages across `tickets` tickets through the
+storage API, drawing words from a Zipf-like vocabulary so a few words are
+everywhere and most are rare. Reports the handler-path cost per logged
+message (SQLite only queues the index rows; the writer thread upserts
+them), then the latency of the first /search page for rare, common and
+two-word queries.
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+os.environ.setdefault("GROUP_ID", "0")
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+
+import main  # noqa: E402
+
+VOCABULARY = [f"word{n}" for n in range(50_000)]
+WEIGHTS = [1 / (rank + 1) for rank in range(len(VOCABULARY))]
+QUERIES = {
+    "rare": ["word40000"],
+    "mid": ["word500"],
+    "common": ["word0"],
+    "two words": ["word3", "word700"],
+    "no match": ["nosuchword"],
+}
+
+
+def open_store(backend, workdir):
+    if backend == "memory":
+        return main.MemoryStorage()
+    return main.SQLiteStorage(os.path.join(workdir, "search.db"), batch_size=main.STORAGE_BATCH_SIZE)
+
+
+def run(backend, messages, tickets):
+    random.seed(1)
+    store = open_store(backend, tempfile.mkdtemp(prefix="blockveil-search-"))
+    ids = [f"BV-{n:07d}" for n in range(tickets)]
+    for n, tid in enumerate(ids):
+        store.create_ticket(tid, 1_000_000 + n, f"user{n}", 0)
+    words = random.choices(VOCABULARY, WEIGHTS, k=messages * 8)
+
+    started = time.perf_counter()
+    for n in range(messages):
+        store.add_ticket_message(ids[n % tickets], "user", " ".join(words[n * 8:n * 8 + 8]), n)
+    store.flush()
+    elapsed = time.perf_counter() - started
+    print(f"[{backend}] logged {messages} messages: {elapsed / messages * 1e6:.2f} us/message on the handler path")
+
+    store.search_tickets(["warmup"], 0, 1)  # SQLite: waits for the writer to finish indexing
+    for label, terms in QUERIES.items():
+        started = time.perf_counter()
+        total, page = store.search_tickets(terms, 0, main.SEARCH_PAGE_SIZE)
+        elapsed = time.perf_counter() - started
+        print(f"[{backend}] {label:<10} {' '.join(terms):<20} {total:>7} tickets  {elapsed * 1000:8.2f} ms")
+    store.close()
+
+
+if __name__ == "__main__":
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    tickets = int(sys.argv[2]) if len(sys.argv) > 2 else 20_000
+    backend = sys.argv[3] if len(sys.argv) > 3 else "both"
+    for name in (("memory", "sqlite") if backend == "both" else (backend,)):
+        run(name, messages, tickets)
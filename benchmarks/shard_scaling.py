@@ -0,0 +1,155 @@
+"""Throughput of sharded mode with 1, 2, 4... worker processes.
+
+Usage: python benchmarks/shard_scaling.py [users] [messages_per_user] [api_latency_ms]
+           [workers,...] [--kill]
+
+Starts `python main.py` as a sharded leader against the stub Bot API, which
+serves the synthetic updates through getUpdates. Every user taps
+"Create Ticket" and then sends `messages_per_user` numbered messages.
+Reports updates/s until the stub has seen every expected send, then checks
+the shared database: one ticket per user, and every message logged in the
+order it was sent.
+
+With --kill, worker 0 is SIGKILLed halfway through each run. The leader
+restarts it and redelivers its unacknowledged updates. Delivery is at
+least once, so the check tolerates duplicated log lines but not missing or
+reordered ones.
+
+Scaling is bounded by the cores of the machine. The stub runs in this
+process and uses CPU too.
+"""
+import asyncio
+import os
+import signal
+import sqlite3
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+from stub_bot_api import start_stub  # noqa: E402
+
+MAIN = os.path.join(HERE, "..", "main.py")
+
+
+def user_payload(user_id):
+    return {"id": user_id, "is_bot": False, "first_name": "Load", "username": f"load{user_id}"}
+
+
+def updates(users, messages):
+    update_id = 0
+    chat = lambda user_id: {"id": user_id, "type": "private"}  # noqa: E731
+    for user_id in range(1000, 1000 + users):
+        update_id += 1
+        yield {"update_id": update_id, "callback_query": {
+            "id": str(update_id), "from": user_payload(user_id), "chat_instance": str(user_id),
+            "data": "create_ticket",
+            "message": {"message_id": update_id, "date": int(time.time()), "chat": chat(user_id)},
+        }}
+    for n in range(messages):
+        for user_id in range(1000, 1000 + users):
+            update_id += 1
+            yield {"update_id": update_id, "message": {
+                "message_id": update_id, "date": int(time.time()), "chat": chat(user_id),
+                "from": user_payload(user_id), "text": f"m{n}",
+            }}
+
+
+def worker_pids(leader_pid):
+    with open(f"/proc/{leader_pid}/task/{leader_pid}/children") as f:
+        return [int(pid) for pid in f.read().split()]
+
+
+def check(db_path, users, messages):
+    db = sqlite3.connect(db_path)
+    tickets = dict(db.execute("SELECT user_id, COUNT(*) FROM tickets GROUP BY user_id"))
+    bad_tickets = sum(1 for uid in range(1000, 1000 + users) if tickets.get(uid) != 1)
+    bad_order = 0
+    expected = [f"m{n}" for n in range(messages)]
+    logs = {}
+    for ticket_id, message in db.execute("SELECT ticket_id, message FROM messages ORDER BY id"):
+        logs.setdefault(ticket_id, []).append(message)
+    for log in logs.values():
+        deduped = list(dict.fromkeys(log))  # redelivered updates may log twice
+        if deduped != expected:
+            bad_order += 1
+    duplicates = sum(len(log) - len(set(log)) for log in logs.values())
+    bad_order += users - len(logs)
+    return bad_tickets, bad_order, duplicates
+
+
+async def measure(stub, api_url, workers, users, messages, kill):
+    workdir = tempfile.mkdtemp(prefix="blockveil-shards-")
+    db_path = os.path.join(workdir, "shards.db")
+    env = dict(
+        os.environ,
+        BOT_TOKEN="0:shards",
+        GROUP_ID="-100",
+        BOT_API_URL=api_url,
+        STORAGE_BACKEND="sqlite",
+        DATABASE_PATH=db_path,
+        SHARD_WORKERS=str(workers),
+        SHARD_LOCK_PATH=os.path.join(workdir, "leader.lock"),
+        SHARD_SOCKET=os.path.join(workdir, "shards.sock"),
+        SHARD_POLL_TIMEOUT="1",
+        SHARD_RESTART_DELAY="0.2",
+        METRICS_PORT="0",
+        RATE_LIMITS="private=1000000/60,create_ticket=1000000/60",
+    )
+    get_me = stub.calls["getMe"]
+    leader = await asyncio.create_subprocess_exec(sys.executable, MAIN, env=env)
+    while stub.calls["getMe"] - get_me < workers:
+        await asyncio.sleep(0.05)
+
+    expected = users * (1 + messages)
+    baseline = stub.sends()
+    started = time.perf_counter()
+    for data in updates(users, messages):
+        stub.updates.put_nowait(data)
+    killed = False
+    while stub.sends() - baseline < expected:
+        if kill and not killed and stub.sends() - baseline >= expected // 2:
+            os.kill(worker_pids(leader.pid)[0], signal.SIGKILL)
+            killed = True
+        await asyncio.sleep(0.005)
+    elapsed = time.perf_counter() - started
+    if kill:
+        # Redelivered updates can push the count past `expected` early; wait until it settles
+        settled = -1
+        while settled != stub.sends():
+            settled = stub.sends()
+            await asyncio.sleep(1)
+
+    leader.send_signal(signal.SIGTERM)
+    await leader.wait()
+    bad_tickets, bad_order, duplicates = check(db_path, users, messages)
+    print(
+        f"workers={workers:<3} {expected / elapsed:8.0f} updates/s ({elapsed:.2f}s)  "
+        f"users without exactly one ticket: {bad_tickets}  logs missing/out of order: {bad_order}  "
+        f"redelivered duplicates: {duplicates}" + ("  [worker 0 killed mid-run]" if kill else "")
+    )
+    return elapsed
+
+
+async def run(users, messages, latency, worker_counts, kill):
+    stub, runner, api_url = await start_stub(latency=latency)
+    print(f"users: {users}  messages/user: {messages}  stub latency: {latency * 1000:.0f} ms  cpus: {os.cpu_count()}")
+    baseline = None
+    for workers in worker_counts:
+        elapsed = await measure(stub, api_url, workers, users, messages, kill)
+        baseline = baseline or elapsed
+        print(f"  speedup vs {worker_counts[0]} worker(s): {baseline / elapsed:.2f}x")
+    await runner.cleanup()
+
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if a != "--kill"]
+    asyncio.run(run(
+        int(args[0]) if len(args) > 0 else 200,
+        int(args[1]) if len(args) > 1 else 5,
+        float(args[2]) / 1000 if len(args) > 2 else 0.0,
+        [int(n) for n in args[3].split(",")] if len(args) > 3 else [1, 2, 4],
+        "--kill" in sys.argv,
+    ))
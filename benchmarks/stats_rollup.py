@@ -0,0 +1,77 @@
+"""/stats latency against the length of the history, on both storage backends.
+
+Usage: python benchmarks/stats_rollup.py [events_per_day] [history_days,...] [memory|sqlite|both]
+
+Records `events_per_day` synthetic events per day (ticket opens and closes,
+user messages of mixed media types, staff replies with first-response
+times) through record_stats(), going back `history_days` days. Reports the
+write-path cost per event, then how long each /stats period takes to build.
+The period cost should not grow with the history.
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+os.environ.setdefault("GROUP_ID", "0")
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+
+import main  # noqa: E402
+
+MEDIA = ["text"] * 14 + ["photo", "photo", "sticker", "voice", "document", "video"]
+PERIODS = ("24h", "7d", "30d", "all")
+
+
+def open_store(backend):
+    if backend == "memory":
+        return main.MemoryStorage()
+    path = os.path.join(tempfile.mkdtemp(prefix="blockveil-stats-"), "stats.db")
+    return main.SQLiteStorage(path, batch_size=main.STORAGE_BATCH_SIZE)
+
+
+def event(timestamp):
+    roll = random.random()
+    if roll < 0.05:
+        return {"opened": 1}
+    if roll < 0.10:
+        return {"closed": 1}
+    if roll < 0.30:
+        return {"replies": 1, main.first_response_metric(random.expovariate(1 / 1800)): 1}
+    return {f"media:{random.choice(MEDIA)}": 1}
+
+
+def run(backend, per_day, days):
+    random.seed(1)
+    main.store = open_store(backend)
+    now = int(time.time())
+    events = per_day * days
+    started = time.perf_counter()
+    for n in range(events):
+        timestamp = now - days * 86400 + n * 86400 // per_day
+        main.record_stats(timestamp, event(timestamp))
+        if n % main.STORAGE_BATCH_SIZE == 0:
+            main.store.flush()
+    main.store.flush()
+    elapsed = time.perf_counter() - started
+    print(f"[{backend}] {days} days of history, {events} events: {elapsed / events * 1e6:.2f} us/event on the write path")
+    for text in PERIODS:
+        label, first, last = main.parse_stats_period(text, now)
+        main.render_stats(label, main.store.stats_between(first, last))  # warm up (SQLite: waits for the writer)
+        started = time.perf_counter()
+        runs = 20
+        for _ in range(runs):
+            main.render_stats(label, main.store.stats_between(first, last))
+        print(f"[{backend}]   /stats {text:<4} {(time.perf_counter() - started) / runs * 1000:8.2f} ms")
+    main.store.close()
+
+
+if __name__ == "__main__":
+    per_day = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    histories = [int(d) for d in sys.argv[2].split(",")] if len(sys.argv) > 2 else [30, 365]
+    backend = sys.argv[3] if len(sys.argv) > 3 else "both"
+    for name in (("memory", "sqlite") if backend == "both" else (backend,)):
+        for days in histories:
+            run(name, per_day, days)
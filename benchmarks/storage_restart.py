@@ -0,0 +1,73 @@
+"""Write-path cost and restart time of the SQLite store.
+
+Usage: python benchmarks/storage_restart.py [messages] [tickets] [db_path]
+
+Logs `messages` messages across `tickets` tickets through the SQLiteStorage
+API (flushing every STORAGE_BATCH_SIZE writes, like the bot does), then
+reports the cost of a write on the handler path, how long close() takes to
+drain the writer, how long reopening the database takes, and how long the
+first read of one ticket's history takes after the restart.
+
+Pass a db_path to keep the database between runs.
+"""
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+os.environ.setdefault("GROUP_ID", "0")
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+
+import main  # noqa: E402
+
+
+def open_store(path):
+    return main.SQLiteStorage(
+        path,
+        batch_size=main.STORAGE_BATCH_SIZE,
+        sync_interval=main.STORAGE_SYNC_INTERVAL,
+        checkpoint_interval=main.STORAGE_CHECKPOINT_INTERVAL,
+    )
+
+
+def run(messages, tickets, path):
+    store = open_store(path)
+    now = int(time.time())
+    ids = [f"BV-{n:07d}" for n in range(tickets)]
+    started = time.perf_counter()
+    for n, tid in enumerate(ids):
+        store.create_ticket(tid, 1_000_000 + n, f"user{n}", now)
+    for n in range(messages):
+        store.add_ticket_message(ids[n % tickets], "user", f"synthetic message {n}", now + n)
+    store.flush()
+    handler_path = time.perf_counter() - started
+    writes = tickets + messages
+    print(f"handler path: {writes} writes in {handler_path:.2f}s ({handler_path / writes * 1e6:.2f} us/write)")
+
+    started = time.perf_counter()
+    store.close()
+    print(f"close (drain writer + checkpoint): {time.perf_counter() - started:.2f}s")
+    print(f"database: {os.path.getsize(path) / 2**20:.1f} MiB, "
+          f"wal: {os.path.getsize(path + '-wal') / 2**20 if os.path.exists(path + '-wal') else 0:.1f} MiB")
+
+    started = time.perf_counter()
+    store = open_store(path)
+    print(f"reopen: {(time.perf_counter() - started) * 1000:.1f} ms "
+          f"({len(store.tickets)} open tickets cached)")
+
+    started = time.perf_counter()
+    history = store.ticket_messages(ids[tickets // 2])
+    print(f"first history read: {(time.perf_counter() - started) * 1000:.1f} ms ({len(history)} messages)")
+    store.close()
+
+
+if __name__ == "__main__":
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    tickets = int(sys.argv[2]) if len(sys.argv) > 2 else 10_000
+    if len(sys.argv) > 3:
+        path = sys.argv[3]
+    else:
+        path = os.path.join(tempfile.mkdtemp(prefix="blockveil-storage-"), "bench.db")
+    run(messages, tickets, path)
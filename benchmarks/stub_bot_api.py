@@ -0,0 +1,79 @@
+"""Minimal stand-in for the Telegram Bot API, for offline benchmarks.
+
+Answers every method the bot uses with a plausible result and counts calls
+per method. Start it with start_stub() and point the bot at it through
+BOT_API_URL=http://127.0.0.1:<port>/bot.
+"""
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter
+
+from aiohttp import web
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Stub", "username": "stub_bot"}
+
+
+class StubBotAPI:
+    def __init__(self, latency=0.0):
+        self.latency = latency  # simulated Telegram response time in seconds
+        self.calls = Counter()
+        self.message_ids = itertools.count(1)
+        self.updates = asyncio.Queue()  # served to getUpdates (polling mode)
+
+    def message(self, chat_id):
+        return {
+            "message_id": next(self.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": int(chat_id), "type": "private" if int(chat_id) > 0 else "supergroup"},
+        }
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        params = dict(await request.post()) if request.can_read_body else {}
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if method == "getMe":
+            result = BOT_USER
+        elif method == "getUpdates":
+            result = await self.pending_updates(float(params.get("timeout") or 0))
+        elif method.startswith("send") or method in ("copyMessage", "forwardMessage"):
+            if method == "sendMediaGroup":
+                items = len(json.loads(params.get("media") or "[]")) or 1
+                result = [self.message(params.get("chat_id", 0)) for _ in range(items)]
+            else:
+                result = self.message(params.get("chat_id", 0))
+        elif method == "editMessageText":
+            result = self.message(params.get("chat_id", 0))
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    async def pending_updates(self, timeout):
+        batch = []
+        try:
+            batch.append(await asyncio.wait_for(self.updates.get(), timeout=max(timeout, 0.01)))
+        except asyncio.TimeoutError:
+            return batch
+        while not self.updates.empty() and len(batch) < 100:
+            batch.append(self.updates.get_nowait())
+        return batch
+
+    def sends(self):
+        return sum(n for method, n in self.calls.items() if method.startswith("send") or method == "copyMessage")
+
+
+async def start_stub(port=0, latency=0.0):
+    """Start the stub on 127.0.0.1; returns (stub, runner, base_url)."""
+    stub = StubBotAPI(latency)
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", stub.handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return stub, runner, f"http://127.0.0.1:{port}/bot"
@@ -0,0 +1,79 @@
+"""Memory per ticket: the old parallel dicts vs Ticket records.
+
+Usage: python benchmarks/ticket_memory.py [tickets] [messages_per_ticket]
+
+Builds the same synthetic tickets twice and reports the bytes allocated per
+ticket (tracemalloc) for each layout. Defaults to 1,000,000 tickets with
+two log entries each.
+"""
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("BOT_TOKEN", "0:benchmark")
+os.environ.setdefault("GROUP_ID", "0")
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+
+import main  # noqa: E402
+
+
+def measure(build):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    state = build()
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return state, used
+
+
+def build_parallel_dicts(n, per_ticket):
+    """Layout used before Ticket records: five dicts keyed by ticket ID, BST strings."""
+    ticket_status, ticket_user, ticket_username, ticket_created_at, ticket_messages = {}, {}, {}, {}, {}
+    base = int(time.time())
+    for i in range(n):
+        tid = f"BV-{i:08d}"
+        ticket_status[tid] = "Processing"
+        ticket_user[tid] = 100000 + i
+        ticket_username[tid] = f"user{i}"
+        ticket_created_at[tid] = main.format_bst(base + i)
+        ticket_messages[tid] = [
+            (f"@user{i}", "[Photo]", main.format_bst(base + i + j)) for j in range(per_ticket)
+        ]
+    return ticket_status, ticket_user, ticket_username, ticket_created_at, ticket_messages
+
+
+def build_ticket_records(n, per_ticket):
+    tickets = {}
+    base = int(time.time())
+    for i in range(n):
+        tid = f"BV-{i:08d}"
+        sender = sys.intern(f"@user{i}")
+        tickets[tid] = main.Ticket(
+            tid, 100000 + i, f"user{i}", main.TicketStatus.PROCESSING, base + i,
+            [main.TicketMessage(sender, "[Photo]", base + i + j) for j in range(per_ticket)],
+        )
+    return tickets
+
+
+def run():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    per_ticket = int(sys.argv[2]) if len(sys.argv) > 2 else 2
+
+    state, old = measure(lambda: build_parallel_dicts(n, per_ticket))
+    del state
+    state, new = measure(lambda: build_ticket_records(n, per_ticket))
+    del state
+
+    print(f"tickets: {n:,}  messages/ticket: {per_ticket}")
+    print(f"parallel dicts : {old / n:8.1f} bytes/ticket  ({old / 2**20:8.1f} MiB)")
+    print(f"Ticket records : {new / n:8.1f} bytes/ticket  ({new / 2**20:8.1f} MiB)")
+    print(f"saved          : {(old - new) / n:8.1f} bytes/ticket  ({100 * (old - new) / old:.0f}%)")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,122 @@
+"""Webhook ingestion benchmark against the stub Bot API.
+
+Usage: python benchmarks/webhook_load.py [updates] [concurrency] [api_latency_ms]
+
+Starts the stub Bot API, runs main.py in webhook mode as a subprocess and
+posts synthetic private text messages over keep-alive connections. Each
+update makes the bot send one reply, so the run finishes when the stub
+has seen one send per update. Reports request latency, end-to-end
+throughput and whether the bot shut down cleanly on SIGTERM.
+"""
+import asyncio
+import os
+import signal
+import socket
+import statistics
+import sys
+import time
+
+import aiohttp
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+
+from stub_bot_api import start_stub  # noqa: E402
+
+SECRET = "benchmark-secret"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def text_update(update_id, user_id):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Load", "username": f"load{user_id}"},
+            "text": "hello",
+        },
+    }
+
+
+async def wait_healthy(session, url, timeout=20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            async with session.get(url) as resp:
+                if resp.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("bot did not become healthy")
+
+
+async def run(updates, concurrency, latency):
+    stub, stub_runner, api_url = await start_stub(latency=latency)
+    port = free_port()
+    env = dict(
+        os.environ,
+        BOT_TOKEN="123:benchmark",
+        GROUP_ID="-100",
+        BOT_API_URL=api_url,
+        WEBHOOK_URL=f"http://127.0.0.1:{port}",
+        WEBHOOK_PORT=str(port),
+        WEBHOOK_LISTEN="127.0.0.1",
+        WEBHOOK_SECRET=SECRET,
+        STORAGE_BACKEND="memory",
+    )
+    bot = await asyncio.create_subprocess_exec(
+        sys.executable, os.path.join(HERE, "..", "main.py"), env=env
+    )
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await wait_healthy(session, f"http://127.0.0.1:{port}/healthz")
+        baseline = stub.sends()
+        latencies = []
+        gate = asyncio.Semaphore(concurrency)
+
+        async def post(i):
+            async with gate:
+                t0 = time.perf_counter()
+                async with session.post(
+                    f"http://127.0.0.1:{port}/telegram",
+                    json=text_update(i, 1000 + i),
+                    headers={"X-Telegram-Bot-Api-Secret-Token": SECRET},
+                ) as resp:
+                    await resp.read()
+                    assert resp.status == 200, resp.status
+                latencies.append(time.perf_counter() - t0)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(post(i) for i in range(1, updates + 1)))
+        accepted = time.perf_counter() - start
+        while stub.sends() - baseline < updates:
+            await asyncio.sleep(0.01)
+        handled = time.perf_counter() - start
+
+    bot.send_signal(signal.SIGTERM)
+    exit_code = await asyncio.wait_for(bot.wait(), timeout=30)
+    await stub_runner.cleanup()
+
+    latencies.sort()
+    print(f"updates: {updates}  concurrency: {concurrency}  stub latency: {latency * 1000:.0f} ms")
+    print(f"accepted : {updates / accepted:8.0f} updates/s")
+    print(f"handled  : {updates / handled:8.0f} updates/s (end to end)")
+    print(f"POST p50 : {statistics.median(latencies) * 1000:8.2f} ms")
+    print(f"POST p99 : {latencies[int(len(latencies) * 0.99) - 1] * 1000:8.2f} ms")
+    print(f"shutdown : exit code {exit_code}")
+
+
+if __name__ == "__main__":
+    asyncio.run(run(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 2000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 40,
+        float(sys.argv[3]) / 1000 if len(sys.argv) > 3 else 0.0,
+    ))
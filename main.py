@@ -2,61 +2,1178 @@ from telegram import (
     Update,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
+    InputFile,
+    InputMediaAudio,
+    InputMediaDocument,
+    InputMediaPhoto,
+    InputMediaVideo,
 )
 from telegram.ext import (
     ApplicationBuilder,
     MessageHandler,
     CommandHandler,
     CallbackQueryHandler,
+    TypeHandler,
     filters,
 )
+from telegram.request import HTTPXRequest
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TimedOut
+import httpx
+import asyncio
+import contextvars
+import fcntl
+import calendar
+import csv
+import gzip
+import hashlib
+import json
 import os
-import random
-import string
+import re
+import queue
+import secrets
+import shutil
+import signal
+import sqlite3
+import tempfile
+import threading
+import zipfile
 import html
-from io import BytesIO
+import heapq
+import itertools
+import math
+from io import BytesIO, StringIO
+from collections import Counter, OrderedDict, deque
 from datetime import datetime
+from enum import StrEnum
+from bisect import bisect_left
+from contextlib import asynccontextmanager
+from functools import lru_cache, partial, wraps
+from typing import NamedTuple
+import sys
 import time
 
 # ================= TIMEZONE (BST: UTC+6) =================
-def get_bst_now():
-    """Return current time in Bangladesh Standard Time (BST) as formatted string."""
-    try:
-        from zoneinfo import ZoneInfo
-        return datetime.now(ZoneInfo("Asia/Dhaka")).strftime("%Y-%m-%d %H:%M:%S")
-    except ImportError:
-        import pytz
-        tz = pytz.timezone('Asia/Dhaka')
-        return datetime.now(tz).strftime("%Y-%m-%d %H:%M:%S")
+# Asia/Dhaka has had a fixed UTC+6 offset since 2009, so it is resolved once
+# here instead of building a ZoneInfo on every call. Times are kept as epoch
+# seconds and only formatted when rendered.
+BST_OFFSET = 6 * 3600
+BST_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+@lru_cache(maxsize=4096)
+def _format_bst_second(second):
+    return time.strftime(BST_FORMAT, time.gmtime(second + BST_OFFSET))
+
+def format_bst(epoch):
+    """Render epoch seconds as a BST "YYYY-MM-DD HH:MM:SS" string (cached per second)."""
+    return _format_bst_second(int(epoch))
+
+def parse_bst(text):
+    """Parse a BST "YYYY-MM-DD HH:MM:SS" string into epoch seconds."""
+    return calendar.timegm(time.strptime(text, BST_FORMAT)) - BST_OFFSET
 
 # ================= ENV =================
 TOKEN = os.environ.get("BOT_TOKEN")
 GROUP_ID = int(os.environ.get("GROUP_ID"))
+BOT_API_URL = os.environ.get("BOT_API_URL")  # e.g. a local Bot API server or test stub: http://127.0.0.1:8081/bot
+# Outgoing Bot API calls share one pool; getUpdates has its own connection
+BOT_API_POOL_SIZE = int(os.environ.get("BOT_API_POOL_SIZE", "256"))  # max concurrent connections
+BOT_API_KEEPALIVE_CONNECTIONS = int(os.environ.get("BOT_API_KEEPALIVE_CONNECTIONS", "64"))  # idle connections kept open
+BOT_API_KEEPALIVE_EXPIRY = float(os.environ.get("BOT_API_KEEPALIVE_EXPIRY", "60"))  # seconds an idle connection is kept
+BOT_API_HTTP_VERSION = os.environ.get("BOT_API_HTTP_VERSION", "1.1")  # 1.1 | 2 (needs the http2 extra)
+BOT_API_CONNECT_TIMEOUT = float(os.environ.get("BOT_API_CONNECT_TIMEOUT", "5"))  # seconds
+BOT_API_READ_TIMEOUT = float(os.environ.get("BOT_API_READ_TIMEOUT", "10"))
+BOT_API_WRITE_TIMEOUT = float(os.environ.get("BOT_API_WRITE_TIMEOUT", "30"))  # uploads, e.g. /export files
+BOT_API_POOL_TIMEOUT = float(os.environ.get("BOT_API_POOL_TIMEOUT", "5"))  # wait for a free connection
+# Webhook mode is used when WEBHOOK_URL is set (needs a web process that receives traffic on PORT)
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL")  # public base URL, e.g. https://example.herokuapp.com
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/telegram")
+WEBHOOK_LISTEN = os.environ.get("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", os.environ.get("PORT", "8443")))
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET")  # random per start if unset
+WEBHOOK_MAX_CONNECTIONS = int(os.environ.get("WEBHOOK_MAX_CONNECTIONS", "40"))  # parallel deliveries from Telegram
+WEBHOOK_KEEPALIVE = float(os.environ.get("WEBHOOK_KEEPALIVE", "75"))  # seconds
+WEBHOOK_MAX_BODY = 1024 * 1024
+BROADCAST_WORKERS = int(os.environ.get("BROADCAST_WORKERS", "16"))
+BROADCAST_GLOBAL_RATE = float(os.environ.get("BROADCAST_GLOBAL_RATE", "28"))  # msgs/sec across all chats
+BROADCAST_PER_CHAT_RATE = float(os.environ.get("BROADCAST_PER_CHAT_RATE", "1"))  # msgs/sec per chat
+BROADCAST_MAX_RETRIES = int(os.environ.get("BROADCAST_MAX_RETRIES", "3"))
+BROADCAST_PROGRESS_INTERVAL = float(os.environ.get("BROADCAST_PROGRESS_INTERVAL", "10"))  # seconds
+LIST_PAGE_SIZE = int(os.environ.get("LIST_PAGE_SIZE", "40"))  # tickets per /list page (keeps replies < 4096 chars)
+DASHBOARD_PAGE_SIZE = int(os.environ.get("DASHBOARD_PAGE_SIZE", "20"))  # tickets per /profile, /which, /history page
+SEARCH_PAGE_SIZE = int(os.environ.get("SEARCH_PAGE_SIZE", "10"))  # tickets per /search page
+DASHBOARD_CACHE_SIZE = int(os.environ.get("DASHBOARD_CACHE_SIZE", "10000"))  # cached per-user ticket listings
+RATE_LIMITS = os.environ.get("RATE_LIMITS", "")  # e.g. "private=2/60,profile=5/60" (see DEFAULT_RATE_LIMITS)
+RATE_LIMIT_CLEANUP_INTERVAL = float(os.environ.get("RATE_LIMIT_CLEANUP_INTERVAL", "300"))  # seconds
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "sqlite")  # sqlite | memory
+DATABASE_PATH = os.environ.get("DATABASE_PATH", "blockveil.db")
+STORAGE_BATCH_SIZE = int(os.environ.get("STORAGE_BATCH_SIZE", "200"))  # queued writes per commit
+STORAGE_FLUSH_INTERVAL = float(os.environ.get("STORAGE_FLUSH_INTERVAL", "2"))  # seconds between commits
+STORAGE_SYNC_INTERVAL = float(os.environ.get("STORAGE_SYNC_INTERVAL", "1"))  # fsync window for committed writes
+STORAGE_CHECKPOINT_INTERVAL = float(os.environ.get("STORAGE_CHECKPOINT_INTERVAL", "300"))  # seconds between WAL compactions
+TICKET_ID_BLOCK = int(os.environ.get("TICKET_ID_BLOCK", "256"))  # ticket numbers reserved from storage at a time
+# SLA deadlines in seconds; 0 disables each one
+TICKET_IDLE_TIMEOUT = float(os.environ.get("TICKET_IDLE_TIMEOUT", str(7 * 86400)))  # no messages this long: auto-close
+SLA_FIRST_RESPONSE = float(os.environ.get("SLA_FIRST_RESPONSE", str(4 * 3600)))  # alert if no staff reply by then
+SLA_RESOLUTION = float(os.environ.get("SLA_RESOLUTION", str(3 * 86400)))  # alert if still open by then
+SLA_CHECK_INTERVAL = float(os.environ.get("SLA_CHECK_INTERVAL", "60"))  # seconds between deadline checks
+EXPORT_SPOOL_SIZE = int(os.environ.get("EXPORT_SPOOL_SIZE", str(1024 * 1024)))  # bytes kept in RAM before spilling to disk
+EXPORT_GZIP_THRESHOLD = int(os.environ.get("EXPORT_GZIP_THRESHOLD", str(1024 * 1024)))  # gzip single exports above this size
+EXPORT_CHUNK_SIZE = 64 * 1024
+GROUP_MESSAGE_CACHE_SIZE = int(os.environ.get("GROUP_MESSAGE_CACHE_SIZE", "50000"))  # group message -> ticket LRU entries
+GROUP_MESSAGE_SPILL_PATH = os.environ.get("GROUP_MESSAGE_SPILL_PATH", "group_messages.db")  # memory backend only
+ALBUM_WINDOW = float(os.environ.get("ALBUM_WINDOW", "1.0"))  # seconds to wait for the rest of an album
+OUTBOUND_WORKERS = int(os.environ.get("OUTBOUND_WORKERS", "8"))  # tickets delivered in parallel
+OUTBOUND_MAX_RETRIES = int(os.environ.get("OUTBOUND_MAX_RETRIES", "5"))
+UPDATE_CONCURRENCY = int(os.environ.get("UPDATE_CONCURRENCY", "64"))  # updates handled at once; 1 = sequential
+METRICS_LISTEN = os.environ.get("METRICS_LISTEN", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9464"))  # Prometheus /metrics; 0 disables it
+# Sharded mode is used when SHARD_WORKERS > 0 (needs STORAGE_BACKEND=sqlite; all processes share DATABASE_PATH)
+SHARD_WORKERS = int(os.environ.get("SHARD_WORKERS", "0"))  # worker processes started by the leader
+SHARD_INDEX = os.environ.get("SHARD_INDEX")  # set by the leader on each worker it starts
+SHARD_LOCK_PATH = os.environ.get("SHARD_LOCK_PATH", "blockveil.leader.lock")  # flock held by the leader
+SHARD_SOCKET = os.environ.get("SHARD_SOCKET", "blockveil.shards.sock")  # leader <-> worker Unix socket
+SHARD_POLL_TIMEOUT = int(os.environ.get("SHARD_POLL_TIMEOUT", "30"))  # getUpdates long-poll seconds
+SHARD_RESTART_DELAY = float(os.environ.get("SHARD_RESTART_DELAY", "1"))  # seconds before restarting a dead worker
+if SHARD_INDEX is not None and METRICS_PORT:
+    METRICS_PORT += 1 + int(SHARD_INDEX)  # one /metrics port per worker
 
 # ================= STORAGE =================
-user_active_ticket = {}
-ticket_status = {}
-ticket_user = {}
-ticket_username = {}  # username at ticket creation (kept for history)
-ticket_messages = {}  # (sender, message, timestamp)
-user_tickets = {}
-group_message_map = {}
-ticket_created_at = {}
-user_latest_username = {}  # current username per user (all users who ever interacted)
-user_message_timestamps = {}  # rate limiting
+class TicketStatus(StrEnum):
+    PENDING = "Pending"
+    PROCESSING = "Processing"
+    CLOSED = "Closed"
+
+
+class TicketMessage(NamedTuple):
+    sender: str  # interned: the same few labels repeat across every log
+    text: str
+    timestamp: int  # epoch seconds
+
+
+class Ticket:
+    """One support ticket. Times are epoch seconds; BST text is only built when rendering."""
+
+    __slots__ = ("ticket_id", "user_id", "username", "status", "created_at", "messages")
+
+    def __init__(self, ticket_id, user_id, username, status, created_at, messages=None):
+        self.ticket_id = ticket_id
+        self.user_id = user_id
+        self.username = username  # username at ticket creation (kept for history)
+        self.status = status
+        self.created_at = created_at
+        self.messages = messages  # list of TicketMessage, or None while not loaded
+
+
+STATS_TOTALS = -1  # /stats bucket with the all-time counters (other buckets are epoch hours)
+
+
+def search_terms(text):
+    """Lowercase word tokens of a (possibly HTML-escaped) log entry or query."""
+    return re.findall(r"\w+", html.unescape(text).lower())
+
+
+class MemoryStorage:
+    """Repository used by every handler.
+
+    Keeps all state in process memory. It also defines the interface that
+    persistent backends implement (see SQLiteStorage).
+    """
+
+    def __init__(self, group_cache_size=50000, spill_path=None):
+        self.tickets = {}  # ticket_id -> Ticket
+        self.active_ticket = {}
+        self.tickets_by_user = {}
+        self.group_messages = OrderedDict()  # LRU of support group message_id -> ticket_id
+        self.group_cache_size = group_cache_size
+        self.spill_path = spill_path  # SQLite file that receives mappings evicted from the LRU
+        self.spill = None
+        self.usernames = {}  # current username per user (all users who ever interacted)
+        self.blocked = set()  # users who blocked the bot (skipped by broadcasts until they return)
+        self.username_index = {}  # lowercase current username -> user_id
+        # status -> ticket IDs in that status (dicts keep creation order, values unused)
+        self.tickets_by_status = {status: {} for status in TicketStatus}
+        self.alias_index = {}  # lowercase earlier username (ticket creation, renames) -> user_id
+        self.user_versions = {}  # user_id -> bumped whenever one of their tickets is created or changes status
+        self.search_index = {}  # term -> {ticket_id: occurrences in its log}
+        self.ticket_counter = 0  # next unreserved ticket number
+        self.id_key = secrets.token_bytes(16)
+        self.sla_times = {}  # ticket_id -> [first response, resolution] in seconds, None until known
+        self.rollups = {}  # epoch hour (or STATS_TOTALS) -> Counter of /stats metrics
+
+    # ----- users -----
+    def register_user(self, user_id, username):
+        old = self.usernames.get(user_id)
+        if old != username:
+            if old:
+                old_key = old.lower()
+                if self.username_index.get(old_key) == user_id:
+                    del self.username_index[old_key]
+                self.add_alias(old, user_id)
+            if username:
+                self.username_index[username.lower()] = user_id
+        self.usernames[user_id] = username
+        self.blocked.discard(user_id)
+
+    def add_alias(self, username, user_id):
+        """Remember an earlier username; the first user seen with it keeps it."""
+        key = username.lower()
+        if not key or key in self.alias_index:
+            return False
+        self.alias_index[key] = user_id
+        return True
+
+    def user_latest_username(self, user_id, default=None):
+        return self.usernames.get(user_id, default)
+
+    def user_ids(self):
+        return list(self.usernames)
+
+    def users(self):
+        return list(self.usernames.items())
+
+    def find_user_id(self, username):
+        """Resolve a current username (case-insensitive) to a user ID."""
+        return self.username_index.get(username.lower())
+
+    def find_alias_user_id(self, username):
+        """Resolve an earlier username (old ticket or rename) to a user ID."""
+        return self.alias_index.get(username.lower())
+
+    def block_user(self, user_id):
+        self.blocked.add(user_id)
+
+    def broadcast_user_ids(self):
+        return [uid for uid in self.usernames if uid not in self.blocked]
+
+    # ----- tickets -----
+    def get_ticket(self, ticket_id):
+        return self.tickets.get(ticket_id)
+
+    def create_ticket(self, ticket_id, user_id, username, created_at):
+        self.tickets[ticket_id] = Ticket(ticket_id, user_id, username, TicketStatus.PENDING, created_at, [])
+        self.tickets_by_status[TicketStatus.PENDING][ticket_id] = None
+        self.active_ticket[user_id] = ticket_id
+        self.user_tickets(user_id).append(ticket_id)
+        self.add_alias(username, user_id)
+        self._bump_user_version(user_id)
+
+    def ticket_status(self, ticket_id):
+        ticket = self.get_ticket(ticket_id)
+        return ticket.status if ticket else None
+
+    def ticket_id_key(self):
+        """Secret that turns ticket numbers into ticket IDs; fixed for the life of the data."""
+        return self.id_key
+
+    def reserve_ticket_numbers(self, count):
+        """Reserve `count` consecutive ticket numbers that no one else will get; returns the first."""
+        start = self.ticket_counter
+        self.ticket_counter += count
+        return start
+
+    def set_ticket_status(self, ticket_id, status):
+        ticket = self.get_ticket(ticket_id)
+        self.tickets_by_status[ticket.status].pop(ticket_id, None)
+        self.tickets_by_status[status][ticket_id] = None
+        ticket.status = status
+        if status == TicketStatus.CLOSED:
+            self.active_ticket.pop(ticket.user_id, None)
+        else:
+            self.active_ticket[ticket.user_id] = ticket_id
+        self._bump_user_version(ticket.user_id)
+
+    def ticket_user(self, ticket_id):
+        ticket = self.get_ticket(ticket_id)
+        return ticket.user_id if ticket else None
+
+    def ticket_username(self, ticket_id, default=None):
+        ticket = self.get_ticket(ticket_id)
+        return ticket.username if ticket else default
+
+    def ticket_created_at(self, ticket_id, default=None):
+        """Creation time in epoch seconds."""
+        ticket = self.get_ticket(ticket_id)
+        return ticket.created_at if ticket else default
+
+    def ticket_messages(self, ticket_id):
+        ticket = self.get_ticket(ticket_id)
+        return ticket.messages if ticket and ticket.messages is not None else []
+
+    def record_first_response(self, ticket_id, seconds):
+        self.sla_times.setdefault(ticket_id, [None, None])[0] = seconds
+
+    def record_resolution(self, ticket_id, seconds):
+        """Seconds from creation to the latest close."""
+        self.sla_times.setdefault(ticket_id, [None, None])[1] = seconds
+
+    def ticket_sla(self, ticket_id):
+        """Return (first response, resolution) in seconds; None where not known yet."""
+        return tuple(self.sla_times.get(ticket_id, (None, None)))
+
+    # ----- /stats rollups -----
+    def add_stats(self, bucket, counts):
+        self.rollups.setdefault(bucket, Counter()).update(counts)
+
+    def stats_between(self, first, last):
+        """Sum the /stats counters of buckets `first` to `last` (inclusive)."""
+        total = Counter()
+        for bucket in range(first, last + 1):
+            counts = self.rollups.get(bucket)
+            if counts:
+                total.update(counts)
+        return total
+
+    def open_ticket_activity(self):
+        """Return (ticket_id, created_at, last message time, first response) for each open ticket."""
+        rows = []
+        for tid in itertools.chain.from_iterable(self._status_partitions(closed=False)):
+            ticket = self.tickets[tid]
+            last = ticket.messages[-1].timestamp if ticket.messages else ticket.created_at
+            rows.append((tid, ticket.created_at, last, self.ticket_sla(tid)[0]))
+        return rows
+
+    def iter_ticket_messages(self, ticket_id):
+        """Iterate a ticket's log without pulling it into the cache (used by /export)."""
+        return iter(self.ticket_messages(ticket_id))
+
+    def add_ticket_message(self, ticket_id, sender, message, timestamp):
+        self.get_ticket(ticket_id).messages.append(TicketMessage(sys.intern(sender), message, timestamp))
+        self._index_message(ticket_id, message)
+
+    def _index_message(self, ticket_id, message):
+        for term in search_terms(message):
+            postings = self.search_index.setdefault(term, {})
+            postings[ticket_id] = postings.get(ticket_id, 0) + 1
+
+    def search_tickets(self, terms, offset, limit):
+        """Rank tickets whose log contains every term.
+
+        Returns (number of matching tickets, [(ticket_id, score)] for the page),
+        best match first.
+        """
+        postings = sorted((self.search_index.get(term, {}) for term in set(terms)), key=len)
+        if not postings or not postings[0]:
+            return 0, []
+        matches = set(postings[0]).intersection(*postings[1:])
+        # tf-idf: terms that occur in fewer tickets weigh more
+        weights = [math.log(1 + len(self.tickets) / len(p)) for p in postings]
+        scored = [
+            (sum(p[tid] * w for p, w in zip(postings, weights)), tid) for tid in matches
+        ]
+        page = heapq.nlargest(offset + limit, scored)[offset:]
+        return len(matches), [(tid, score) for score, tid in page]
+
+    def tickets_created_between(self, start, end):
+        """Ticket IDs created between two epoch timestamps (inclusive)."""
+        return [tid for tid, ticket in self.tickets.items() if start <= ticket.created_at <= end]
+
+    def _status_partitions(self, closed):
+        if closed:
+            return (self.tickets_by_status[TicketStatus.CLOSED],)
+        return (self.tickets_by_status[TicketStatus.PENDING], self.tickets_by_status[TicketStatus.PROCESSING])
+
+    def count_tickets(self, closed):
+        return sum(len(part) for part in self._status_partitions(closed))
+
+    def tickets_page(self, closed, offset, limit):
+        """Return (ticket_id, user_id, username at creation) for one page of closed or open tickets."""
+        ids = itertools.islice(
+            itertools.chain.from_iterable(self._status_partitions(closed)), offset, offset + limit
+        )
+        tickets = self.tickets
+        return [(tid, tickets[tid].user_id, tickets[tid].username) for tid in ids]
+
+    def user_active_ticket(self, user_id):
+        return self.active_ticket.get(user_id)
+
+    def user_tickets(self, user_id):
+        return self.tickets_by_user.setdefault(user_id, [])
+
+    def user_ticket_summaries(self, user_id):
+        """Return (ticket_id, status, created_at) for each of a user's tickets, oldest first."""
+        tickets = self.tickets
+        return [
+            (tid, tickets[tid].status, tickets[tid].created_at)
+            for tid in self.user_tickets(user_id)
+        ]
+
+    def user_version(self, user_id):
+        """Changes whenever the user's ticket list or a ticket status changes."""
+        return self.user_versions.get(user_id, 0)
+
+    def _bump_user_version(self, user_id):
+        self.user_versions[user_id] = self.user_versions.get(user_id, 0) + 1
+
+    # ----- support group messages -----
+    def map_group_message(self, message_id, ticket_id):
+        self._cache_group_message(message_id, ticket_id)
+
+    def group_message_ticket(self, message_id):
+        ticket_id = self.group_messages.get(message_id)
+        if ticket_id is not None:
+            self.group_messages.move_to_end(message_id)
+            return ticket_id
+        ticket_id = self._load_group_message(message_id)
+        if ticket_id is not None:
+            self._cache_group_message(message_id, ticket_id)
+        return ticket_id
+
+    def _cache_group_message(self, message_id, ticket_id):
+        self.group_messages[message_id] = ticket_id
+        self.group_messages.move_to_end(message_id)
+        if len(self.group_messages) > self.group_cache_size:
+            self._spill_group_message(*self.group_messages.popitem(last=False))
+
+    def _spill_group_message(self, message_id, ticket_id):
+        if self.spill_path is None:
+            return
+        if self.spill is None:
+            # Scratch space: the memory backend starts empty, so nothing here needs to survive a crash
+            self.spill = sqlite3.connect(self.spill_path, isolation_level=None)
+            self.spill.execute("PRAGMA journal_mode=OFF")
+            self.spill.execute("PRAGMA synchronous=OFF")
+            self.spill.execute("DROP TABLE IF EXISTS group_messages")
+            self.spill.execute("CREATE TABLE group_messages (message_id INTEGER PRIMARY KEY, ticket_id TEXT NOT NULL)")
+        self.spill.execute(
+            "INSERT OR REPLACE INTO group_messages (message_id, ticket_id) VALUES (?, ?)", (message_id, ticket_id)
+        )
+
+    def _load_group_message(self, message_id):
+        if self.spill is None:
+            return None
+        row = self.spill.execute("SELECT ticket_id FROM group_messages WHERE message_id = ?", (message_id,)).fetchone()
+        return row[0] if row else None
+
+    # ----- lifecycle -----
+    def sizes(self):
+        """Entry counts of the in-memory structures, for metrics gauges."""
+        return {
+            "tickets": len(self.tickets),
+            "users": len(self.usernames),
+            "blocked_users": len(self.blocked),
+            "username_index": len(self.username_index),
+            "alias_index": len(self.alias_index),
+            "group_messages": len(self.group_messages),
+            "search_terms": len(self.search_index),
+        }
+
+    def flush(self):
+        pass
+
+    def wait_for_writes(self):
+        """Block until everything flushed so far is committed."""
+
+    def close(self):
+        if self.spill is not None:
+            self.spill.close()
+
+
+class SQLiteWriter:
+    """Commits write batches on its own thread and connection, in hand-over order.
+
+    Commits use synchronous=NORMAL, so the WAL reaches the disk at
+    checkpoints. A PASSIVE checkpoint every `sync_interval` bounds what an OS
+    crash can lose. A TRUNCATE checkpoint every `checkpoint_interval` folds
+    the WAL into the database file, so the WAL stays small and reopening the
+    database has little to recover.
+    """
+
+    def __init__(self, path, sync_interval, checkpoint_interval):
+        self.path = path
+        self.sync_interval = sync_interval
+        self.checkpoint_interval = checkpoint_interval
+        self.batches = queue.Queue()
+        self.committed = 0  # batches done so far; they are committed in submission order
+        self.thread = threading.Thread(target=self._run, name="sqlite-writer", daemon=True)
+        self.thread.start()
+
+    def submit(self, batch):
+        self.batches.put(batch)
+
+    def wait(self):
+        """Block until every submitted batch is committed."""
+        self.batches.join()
+
+    def close(self):
+        self.batches.put(None)
+        self.thread.join()
+
+    def _run(self):
+        db = sqlite3.connect(self.path, isolation_level=None, cached_statements=64)
+        db.execute("PRAGMA synchronous=NORMAL")
+        last_sync = last_checkpoint = time.monotonic()
+        unsynced = False
+        while True:
+            try:
+                batch = self.batches.get(timeout=self.sync_interval)
+            except queue.Empty:
+                batch = ()
+            if batch is None:
+                self.batches.task_done()
+                break
+            if batch:
+                self._commit(db, batch)
+                self.committed += 1
+                unsynced = True
+                self.batches.task_done()
+            now = time.monotonic()
+            if now - last_checkpoint >= self.checkpoint_interval:
+                db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                last_checkpoint = last_sync = now
+                unsynced = False
+            elif unsynced and now - last_sync >= self.sync_interval:
+                db.execute("PRAGMA wal_checkpoint(PASSIVE)")
+                last_sync = now
+                unsynced = False
+        db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        db.close()
+
+    @staticmethod
+    def _busy(error):
+        """Whether another connection holds the lock (worth retrying)."""
+        return isinstance(error, sqlite3.OperationalError) and (
+            error.sqlite_errorcode & 0xFF in (sqlite3.SQLITE_BUSY, sqlite3.SQLITE_LOCKED)
+        )
+
+    @classmethod
+    def _commit(cls, db, batch):
+        """Apply one batch in a single transaction, grouping runs of the same statement.
+
+        A busy database is retried until the lock is free. If the batch fails
+        for any other reason, it is replayed one statement at a time and the
+        statements that still fail are logged and dropped, so one bad row
+        cannot hold up every write queued behind it.
+        """
+        while True:
+            try:
+                with db:
+                    db.execute("BEGIN")
+                    i = 0
+                    while i < len(batch):
+                        sql = batch[i][0]
+                        j = i
+                        while j < len(batch) and batch[j][0] == sql:
+                            j += 1
+                        db.executemany(sql, [params for _, params in batch[i:j]])
+                        i = j
+                return
+            except sqlite3.Error as e:
+                if not cls._busy(e):
+                    print(f"SQLite batch failed, writing it row by row: {e}")
+                    break
+                print(f"SQLite busy, retrying: {e}")
+                time.sleep(1)
+        for sql, params in batch:
+            while True:
+                try:
+                    db.execute(sql, params)
+                    break
+                except sqlite3.Error as e:
+                    if not cls._busy(e):
+                        print(f"SQLite write dropped: {e}: {sql} {params!r}")
+                        break
+                    time.sleep(1)
+
+
+class SQLiteStorage(MemoryStorage):
+    """MemoryStorage backed by a SQLite database.
+
+    The in-memory dicts act as a cache. Users and open tickets are loaded on
+    start and are the only tickets kept resident: a ticket leaves the cache
+    (with its message log) once its close is committed, and closed tickets
+    are read from disk whenever they are needed. Message logs, per-user
+    ticket lists and old group message mappings are read from disk the first
+    time they are needed.
+    Handlers only queue writes; flush() hands each batch to a SQLiteWriter,
+    which commits it off the event loop. Reads on the event loop never wait
+    for the writer: anything it has not committed yet is still in the cache.
+    Queries that only disk can answer (search, /stats, closed ticket lists,
+    and in sharded mode open ticket lists and other processes' users) may
+    miss writes until the next flush (every STORAGE_FLUSH_INTERVAL or
+    STORAGE_BATCH_SIZE writes) is committed.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT NOT NULL DEFAULT '',
+            blocked INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS tickets (
+            ticket_id TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            username TEXT NOT NULL DEFAULT '',
+            status TEXT NOT NULL,
+            created_at INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS tickets_user_id ON tickets (user_id);
+        CREATE INDEX IF NOT EXISTS tickets_status ON tickets (status);
+        CREATE INDEX IF NOT EXISTS tickets_created_at ON tickets (created_at);
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY,
+            ticket_id TEXT NOT NULL,
+            sender TEXT NOT NULL,
+            message TEXT NOT NULL,
+            timestamp INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS messages_ticket_id ON messages (ticket_id);
+        CREATE TABLE IF NOT EXISTS group_messages (
+            message_id INTEGER PRIMARY KEY,
+            ticket_id TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS user_aliases (
+            alias TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS stats (
+            bucket INTEGER NOT NULL,
+            metric TEXT NOT NULL,
+            value INTEGER NOT NULL,
+            PRIMARY KEY (bucket, metric)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS ticket_sla (
+            ticket_id TEXT PRIMARY KEY,
+            first_response INTEGER,
+            resolution INTEGER
+        );
+        CREATE TABLE IF NOT EXISTS settings (
+            name TEXT PRIMARY KEY,
+            value NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS search_index (
+            term TEXT NOT NULL,
+            ticket_id TEXT NOT NULL,
+            hits INTEGER NOT NULL,
+            PRIMARY KEY (term, ticket_id)
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(
+        self, path, batch_size=200, group_cache_size=50000, sync_interval=1.0, checkpoint_interval=300.0,
+        shared=False, owns_user=None,
+    ):
+        super().__init__(group_cache_size)
+        self.shared = shared  # other processes write to the same database (sharded mode)
+        self.owns_user = owns_user  # sharded mode: user_id -> whether this process may cache their tickets
+        self.path = path
+        self.db = sqlite3.connect(path, isolation_level=None, cached_statements=64)
+        self.owner = threading.get_ident()  # the event loop's thread, which owns the caches and self.db
+        self.readers = threading.local()  # read connections of worker threads (/export)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        has_search = self.db.execute("SELECT 1 FROM sqlite_master WHERE name = 'search_index'").fetchone()
+        self.db.executescript(self.SCHEMA)
+        if not has_search:
+            self._build_search_index()
+        self.db.execute(
+            "INSERT OR IGNORE INTO settings (name, value) VALUES ('ticket_id_key', ?), ('ticket_counter', 0)",
+            (secrets.token_hex(16),),
+        )
+        self.id_key = bytes.fromhex(
+            self.db.execute("SELECT value FROM settings WHERE name = 'ticket_id_key'").fetchone()[0]
+        )
+        self.batch_size = batch_size
+        self.pending = []  # (sql, params) waiting for the next batched commit
+        self.submitted = 0  # batches handed to the writer so far
+        self.evicting = []  # tickets to drop from the cache once the writes in `pending` are committed
+        self.evictions = deque()  # (batch number, ticket IDs) waiting for that batch to commit
+        self.pending_stats = Counter()  # (bucket, metric) -> increment, one upsert each per commit
+
+        for uid, uname, blocked in self.db.execute("SELECT user_id, username, blocked FROM users"):
+            self.usernames[uid] = uname
+            if uname:
+                self.username_index[uname.lower()] = uid
+            if blocked:
+                self.blocked.add(uid)
+        if self.db.execute("SELECT 1 FROM user_aliases LIMIT 1").fetchone() is None:
+            # First start with the alias table: seed it from ticket usernames
+            self.db.execute(
+                "INSERT OR IGNORE INTO user_aliases (alias, user_id) "
+                "SELECT lower(username), user_id FROM tickets WHERE username != '' ORDER BY rowid"
+            )
+        self.alias_index.update(self.db.execute("SELECT alias, user_id FROM user_aliases"))
+        for row in self.db.execute(
+            "SELECT ticket_id, user_id, username, status, created_at FROM tickets WHERE status != 'Closed'"
+        ):
+            if owns_user is not None and not owns_user(row[1]):
+                continue
+            ticket = self._cache_ticket(*row)
+            self.active_ticket[ticket.user_id] = ticket.ticket_id
+        self.writer = SQLiteWriter(path, sync_interval, checkpoint_interval)
+
+    # ----- write queue -----
+    def _write(self, sql, params):
+        self.pending.append((sql, params))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def sizes(self):
+        sizes = super().sizes()
+        sizes["pending_writes"] = len(self.pending)
+        sizes["pending_stats"] = len(self.pending_stats)
+        return sizes
+
+    def flush(self):
+        if self.pending_stats:
+            stats, self.pending_stats = self.pending_stats, Counter()
+            self.pending.extend((self.ADD_STAT, (bucket, metric, value)) for (bucket, metric), value in stats.items())
+        if self.pending:
+            batch, self.pending = self.pending, []
+            self.writer.submit(batch)
+            self.submitted += 1
+            if self.evicting:
+                self.evictions.append((self.submitted, self.evicting))
+                self.evicting = []
+        while self.evictions and self.evictions[0][0] <= self.writer.committed:
+            for ticket_id in self.evictions.popleft()[1]:
+                ticket = self.tickets.get(ticket_id)
+                if ticket is not None and not self._resident(ticket):  # unless it was reopened meanwhile
+                    del self.tickets[ticket_id]
+                    self.tickets_by_status[ticket.status].pop(ticket_id, None)
+                    self.sla_times.pop(ticket_id, None)
+
+    def wait_for_writes(self):
+        self.writer.wait()
+
+    def _reader(self):
+        """Read connection of the calling thread."""
+        if threading.get_ident() == self.owner:
+            return self.db
+        db = getattr(self.readers, "db", None)
+        if db is None:
+            db = self.readers.db = sqlite3.connect(self.path, isolation_level=None, cached_statements=64)
+        return db
+
+    def _query(self, sql, params=()):
+        # On the event loop, the cache covers every write not committed yet, so
+        # reads neither flush (which would shrink batches) nor wait.
+        if threading.get_ident() != self.owner:
+            self.writer.wait()  # worker threads rely on the caller having flushed before handing off
+        return self._reader().execute(sql, params)
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+        self.db.close()
+        super().close()
+
+    # ----- lazy loading -----
+    def _resident(self, ticket):
+        """Open tickets of this process's users stay cached; closed ones are read fresh from disk."""
+        if ticket.status == TicketStatus.CLOSED:
+            return False
+        return self.owns_user is None or self.owns_user(ticket.user_id)  # else another worker changes it
+
+    def _cache_ticket(self, ticket_id, user_id, username, status, created_at):
+        ticket = Ticket(ticket_id, user_id, username, TicketStatus(status), int(created_at))
+        if self._resident(ticket):
+            self.tickets[ticket_id] = ticket
+            self.tickets_by_status[ticket.status][ticket_id] = None
+        return ticket
+
+    def get_ticket(self, ticket_id):
+        ticket = self.tickets.get(ticket_id)
+        if ticket is not None:
+            return ticket
+        row = self._query(
+            "SELECT ticket_id, user_id, username, status, created_at FROM tickets WHERE ticket_id = ?",
+            (ticket_id,),
+        ).fetchone()
+        return self._cache_ticket(*row) if row else None
+
+    def _message_rows(self, ticket_id):
+        for sender, message, timestamp in self._query(
+            "SELECT sender, message, timestamp FROM messages WHERE ticket_id = ? ORDER BY id",
+            (ticket_id,),
+        ):
+            yield TicketMessage(sys.intern(sender), message, timestamp)
+
+    # ----- users -----
+    def register_user(self, user_id, username):
+        if self.usernames.get(user_id) == username and user_id not in self.blocked:
+            return
+        super().register_user(user_id, username)
+        self._write(
+            "INSERT INTO users (user_id, username, blocked) VALUES (?, ?, 0) "
+            "ON CONFLICT(user_id) DO UPDATE SET username = excluded.username, blocked = 0",
+            (user_id, username),
+        )
+
+    def add_alias(self, username, user_id):
+        if not super().add_alias(username, user_id):
+            return False
+        self._write(
+            "INSERT OR IGNORE INTO user_aliases (alias, user_id) VALUES (?, ?)",
+            (username.lower(), user_id),
+        )
+        return True
+
+    def block_user(self, user_id):
+        super().block_user(user_id)
+        self._write("UPDATE users SET blocked = 1 WHERE user_id = ?", (user_id,))
+
+    # Users registered by other processes are only on disk.
+    def user_ids(self):
+        if not self.shared:
+            return super().user_ids()
+        return [row[0] for row in self._query("SELECT user_id FROM users")]
+
+    def users(self):
+        if not self.shared:
+            return super().users()
+        return [tuple(row) for row in self._query("SELECT user_id, username FROM users")]
+
+    def broadcast_user_ids(self):
+        if not self.shared:
+            return super().broadcast_user_ids()
+        return [row[0] for row in self._query("SELECT user_id FROM users WHERE blocked = 0")]
+
+    def find_user_id(self, username):
+        user_id = super().find_user_id(username)
+        if user_id is None and self.shared:
+            row = self._query("SELECT user_id FROM users WHERE username = ? COLLATE NOCASE", (username,)).fetchone()
+            user_id = row[0] if row else None
+        return user_id
+
+    def find_alias_user_id(self, username):
+        user_id = super().find_alias_user_id(username)
+        if user_id is None and self.shared:
+            row = self._query("SELECT user_id FROM user_aliases WHERE alias = ?", (username.lower(),)).fetchone()
+            user_id = row[0] if row else None
+        return user_id
+
+    # ----- tickets -----
+    def create_ticket(self, ticket_id, user_id, username, created_at):
+        self.user_tickets(user_id)  # make sure the list is loaded before appending
+        super().create_ticket(ticket_id, user_id, username, created_at)
+        self._write(
+            "INSERT INTO tickets (ticket_id, user_id, username, status, created_at) VALUES (?, ?, ?, ?, ?)",
+            (ticket_id, user_id, username, TicketStatus.PENDING.value, created_at),
+        )
+
+    def reserve_ticket_numbers(self, count):
+        # Atomic across every process that shares the database (sharded mode)
+        with self.db:
+            self.db.execute("BEGIN IMMEDIATE")
+            end = self.db.execute(
+                "UPDATE settings SET value = value + ? WHERE name = 'ticket_counter' RETURNING value", (count,)
+            ).fetchall()[0][0]
+        return end - count
+
+    def set_ticket_status(self, ticket_id, status):
+        ticket = self.tickets[ticket_id] = self.get_ticket(ticket_id)  # so the base class updates this object
+        super().set_ticket_status(ticket_id, status)
+        self._write("UPDATE tickets SET status = ? WHERE ticket_id = ?", (status.value, ticket_id))
+        if not self._resident(ticket):
+            self._evict_when_committed(ticket)
+
+    def _evict_when_committed(self, ticket):
+        """Keep a non-resident ticket cached until its queued writes are on disk."""
+        self.tickets[ticket.ticket_id] = ticket
+        self.tickets_by_status[ticket.status][ticket.ticket_id] = None
+        self.evicting.append(ticket.ticket_id)
+
+    def ticket_messages(self, ticket_id):
+        ticket = self.get_ticket(ticket_id)
+        if ticket is None:
+            return []
+        if ticket.messages is None:
+            messages = list(self._message_rows(ticket_id))
+            if ticket_id not in self.tickets:
+                return messages  # not resident: keep nothing
+            ticket.messages = messages
+        return ticket.messages
+
+    def iter_ticket_messages(self, ticket_id):
+        ticket = self.get_ticket(ticket_id)
+        if ticket is not None and ticket.messages is not None:
+            return super().iter_ticket_messages(ticket_id)
+        return self._message_rows(ticket_id)
+
+    # SLA times are read for one ticket at a time. Like the message log, a
+    # cached ticket's times stay in memory (so reads never need a write the
+    # writer has not committed), and a closed ticket stays cached until the
+    # write is committed.
+    def _sla_entry(self, ticket_id):
+        if ticket_id not in self.tickets:
+            self._evict_when_committed(self.get_ticket(ticket_id))
+        entry = self.sla_times.get(ticket_id)
+        if entry is None:
+            entry = self.sla_times[ticket_id] = list(self.ticket_sla(ticket_id))
+        return entry
+
+    def record_first_response(self, ticket_id, seconds):
+        self._sla_entry(ticket_id)[0] = seconds
+        self._write(
+            "INSERT INTO ticket_sla (ticket_id, first_response) VALUES (?, ?) "
+            "ON CONFLICT(ticket_id) DO UPDATE SET first_response = excluded.first_response",
+            (ticket_id, seconds),
+        )
+
+    def record_resolution(self, ticket_id, seconds):
+        self._sla_entry(ticket_id)[1] = seconds
+        self._write(
+            "INSERT INTO ticket_sla (ticket_id, resolution) VALUES (?, ?) "
+            "ON CONFLICT(ticket_id) DO UPDATE SET resolution = excluded.resolution",
+            (ticket_id, seconds),
+        )
+
+    def ticket_sla(self, ticket_id):
+        entry = self.sla_times.get(ticket_id)
+        if entry is not None:
+            return tuple(entry)
+        row = self._query(
+            "SELECT first_response, resolution FROM ticket_sla WHERE ticket_id = ?", (ticket_id,)
+        ).fetchone()
+        return tuple(row) if row else (None, None)
+
+    # ----- /stats rollups -----
+    # Counters are only on disk, where every process adds to the same rows.
+    ADD_STAT = (
+        "INSERT INTO stats (bucket, metric, value) VALUES (?, ?, ?) "
+        "ON CONFLICT(bucket, metric) DO UPDATE SET value = value + excluded.value"
+    )
+
+    def add_stats(self, bucket, counts):
+        for metric, value in counts.items():
+            self.pending_stats[bucket, metric] += value
+
+    def stats_between(self, first, last):
+        return Counter(dict(self._query(
+            "SELECT metric, SUM(value) FROM stats WHERE bucket BETWEEN ? AND ? GROUP BY metric", (first, last)
+        )))
+
+    def open_ticket_activity(self):
+        rows = []
+        for tid, user_id, created_at, last, first_response in self._query(
+            "SELECT t.ticket_id, t.user_id, t.created_at, "
+            "(SELECT timestamp FROM messages m WHERE m.ticket_id = t.ticket_id ORDER BY m.id DESC LIMIT 1), "
+            "s.first_response "
+            "FROM tickets t LEFT JOIN ticket_sla s USING (ticket_id) WHERE t.status != 'Closed'"
+        ):
+            if self.owns_user is not None and not self.owns_user(user_id):
+                continue
+            rows.append((tid, created_at, last if last is not None else created_at, first_response))
+        return rows
+
+    def tickets_created_between(self, start, end):
+        created = dict(self._query(
+            "SELECT ticket_id, created_at FROM tickets WHERE created_at BETWEEN ? AND ?", (start, end)
+        ))
+        # New tickets are cached, whether or not the writer has committed them yet
+        created.update((tid, self.tickets[tid].created_at) for tid in super().tickets_created_between(start, end))
+        return sorted(created, key=created.get)
+
+    def add_ticket_message(self, ticket_id, sender, message, timestamp):
+        # The log is loaded first, so reads never need the row before it is
+        # committed. A closed ticket stays cached until then.
+        ticket = self.get_ticket(ticket_id)
+        if ticket.messages is None:
+            ticket.messages = list(self._message_rows(ticket_id))
+        if ticket_id not in self.tickets:
+            self._evict_when_committed(ticket)
+        ticket.messages.append(TicketMessage(sys.intern(sender), message, timestamp))
+        self._index_message(ticket_id, message)
+        self._write(
+            "INSERT INTO messages (ticket_id, sender, message, timestamp) VALUES (?, ?, ?, ?)",
+            (ticket_id, sender, message, timestamp),
+        )
+
+    # ----- search -----
+    INDEX_TERM = (
+        "INSERT INTO search_index (term, ticket_id, hits) VALUES (?, ?, ?) "
+        "ON CONFLICT(term, ticket_id) DO UPDATE SET hits = hits + excluded.hits"
+    )
+
+    def _build_search_index(self):
+        """Index the messages logged before search existed (runs once)."""
+        postings = Counter()
+        for ticket_id, message in self.db.execute("SELECT ticket_id, message FROM messages"):
+            for term in search_terms(message):
+                postings[term, ticket_id] += 1
+        with self.db:
+            self.db.execute("BEGIN")
+            self.db.executemany(self.INDEX_TERM, ((term, tid, hits) for (term, tid), hits in postings.items()))
+
+    def _index_message(self, ticket_id, message):
+        for term, hits in Counter(search_terms(message)).items():
+            self._write(self.INDEX_TERM, (term, ticket_id, hits))
+
+    def search_tickets(self, terms, offset, limit):
+        terms = sorted(set(terms))
+        if not terms:
+            return 0, []
+        tickets = self._query("SELECT COUNT(*) FROM tickets").fetchone()[0]
+        weights = []
+        for term in terms:
+            df = self._query("SELECT COUNT(*) FROM search_index WHERE term = ?", (term,)).fetchone()[0]
+            if not df:
+                return 0, []
+            weights.append(math.log(1 + tickets / df))
+        marks = ", ".join("?" * len(terms))
+        matching = f"FROM search_index WHERE term IN ({marks}) GROUP BY ticket_id HAVING COUNT(*) = {len(terms)}"
+        if len(terms) == 1:
+            total = df
+        else:
+            total = self._query(f"SELECT COUNT(*) FROM (SELECT ticket_id {matching})", terms).fetchone()[0]
+        weight = "CASE term " + "WHEN ? THEN ? " * len(terms) + "END"
+        rows = self._query(
+            f"SELECT ticket_id, SUM(hits * {weight}) AS score {matching} "
+            "ORDER BY score DESC, ticket_id DESC LIMIT ? OFFSET ?",
+            (*itertools.chain.from_iterable(zip(terms, weights)), *terms, limit, offset),
+        )
+        return total, [tuple(row) for row in rows]
+
+    # Open tickets are always cached, so only closed ones are read from disk
+    # (or all of them when other processes create tickets too).
+    def count_tickets(self, closed):
+        if not closed and not self.shared:
+            return super().count_tickets(closed)
+        op = "=" if closed else "!="
+        return self._query(f"SELECT COUNT(*) FROM tickets WHERE status {op} 'Closed'").fetchone()[0]
+
+    def tickets_page(self, closed, offset, limit):
+        if not closed and not self.shared:
+            return super().tickets_page(closed, offset, limit)
+        op = "=" if closed else "!="
+        return [
+            tuple(row) for row in self._query(
+                f"SELECT ticket_id, user_id, username FROM tickets WHERE status {op} 'Closed' "
+                "ORDER BY rowid LIMIT ? OFFSET ?",
+                (limit, offset),
+            )
+        ]
+
+    def user_tickets(self, user_id):
+        if user_id not in self.tickets_by_user:
+            self.tickets_by_user[user_id] = [
+                row[0] for row in self._query(
+                    "SELECT ticket_id FROM tickets WHERE user_id = ? ORDER BY rowid", (user_id,)
+                )
+            ]
+        return super().user_tickets(user_id)
+
+    # One query instead of a lazy ticket load per closed ticket. Cached
+    # tickets may have changes the writer has not committed yet.
+    def user_ticket_summaries(self, user_id):
+        rows = {
+            tid: (TicketStatus(status), int(created_at)) for tid, status, created_at in self._query(
+                "SELECT ticket_id, status, created_at FROM tickets WHERE user_id = ?", (user_id,)
+            )
+        }
+        summaries = []
+        for tid in self.user_tickets(user_id):
+            ticket = self.tickets.get(tid)
+            if ticket is not None:
+                summaries.append((tid, ticket.status, ticket.created_at))
+            elif tid in rows:
+                summaries.append((tid, *rows[tid]))
+        return summaries
+
+    # ----- support group messages -----
+    def map_group_message(self, message_id, ticket_id):
+        super().map_group_message(message_id, ticket_id)
+        self._write(
+            "INSERT OR REPLACE INTO group_messages (message_id, ticket_id) VALUES (?, ?)",
+            (message_id, ticket_id),
+        )
+
+    # Every mapping is already on disk, so evicted entries need no spill.
+    def _spill_group_message(self, message_id, ticket_id):
+        pass
+
+    def _load_group_message(self, message_id):
+        row = self._query(
+            "SELECT ticket_id FROM group_messages WHERE message_id = ?", (message_id,)
+        ).fetchone()
+        return row[0] if row else None
+
+
+def shard_of(user_id):
+    """Worker that handles everything about this user in sharded mode."""
+    return user_id % SHARD_WORKERS
+
+
+def open_storage():
+    if STORAGE_BACKEND == "memory":
+        if SHARD_WORKERS:
+            raise ValueError("Sharded mode needs STORAGE_BACKEND=sqlite")
+        return MemoryStorage(GROUP_MESSAGE_CACHE_SIZE, GROUP_MESSAGE_SPILL_PATH)
+    if STORAGE_BACKEND == "sqlite":
+        return SQLiteStorage(
+            DATABASE_PATH,
+            batch_size=STORAGE_BATCH_SIZE,
+            group_cache_size=GROUP_MESSAGE_CACHE_SIZE,
+            sync_interval=STORAGE_SYNC_INTERVAL,
+            checkpoint_interval=STORAGE_CHECKPOINT_INTERVAL,
+            shared=SHARD_WORKERS > 0,
+            owns_user=None if SHARD_INDEX is None else lambda user_id: shard_of(user_id) == int(SHARD_INDEX),
+        )
+    raise ValueError(f"Unknown STORAGE_BACKEND: {STORAGE_BACKEND}")
+
+
+store = open_storage()
 
 # ================= HELPER: Register any user interaction =================
 def register_user(user):
     """Store or update user information when they interact with the bot."""
-    user_latest_username[user.id] = user.username or ""
+    store.register_user(user.id, user.username or "")
 
 # ================= HELPERS =================
-def generate_ticket_id(length=8):
-    chars = string.ascii_letters + string.digits + "*#@$&"
-    while True:
-        tid = "BV-" + "".join(random.choice(chars) for _ in range(length))
-        if tid not in ticket_status:
-            return tid
+class TicketIdGenerator:
+    """Ticket IDs from an encrypted counter: unique by construction, no lookups.
+
+    Ticket numbers are reserved from storage `block` at a time, so processes
+    sharing a database never get the same number. Each number goes through
+    a keyed Feistel permutation of the 50-bit space. Numbers that are
+    neighbours get unrelated IDs, and an ID says nothing about the next one.
+    IDs are 10 Crockford base32 characters, which are safe in URLs and
+    commands. The old random IDs had 8 characters, so the two never collide.
+    """
+
+    ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+    PAIRS = [a + b for a, b in itertools.product(ALPHABET, repeat=2)]  # 10 bits -> 2 characters
+    HALF = 25  # bits per Feistel half; 10 characters x 5 bits
+    ROUNDS = 3
+
+    def __init__(self, block):
+        self.block = block
+        self.next = self.end = 0
+        self.rounds = None  # keyed blake2s states, one per round
+
+    def _permute(self, n):
+        mask = (1 << self.HALF) - 1
+        left, right = n >> self.HALF, n & mask
+        for state in self.rounds:
+            h = state.copy()
+            h.update(right.to_bytes(4, "big"))
+            left, right = right, left ^ (int.from_bytes(h.digest(), "big") & mask)
+        return (left << self.HALF) | right
+
+    def _encode(self, n):
+        pairs = self.PAIRS
+        return "BV-" + pairs[n >> 40] + pairs[n >> 30 & 1023] + pairs[n >> 20 & 1023] + pairs[n >> 10 & 1023] + pairs[n & 1023]
+
+    def generate(self, count=1):
+        if self.rounds is None:
+            key = store.ticket_id_key()
+            self.rounds = [hashlib.blake2s(key=key + bytes([i]), digest_size=4) for i in range(self.ROUNDS)]
+        ids = []
+        while len(ids) < count:
+            if self.next == self.end:
+                size = max(self.block, count - len(ids))
+                self.next = store.reserve_ticket_numbers(size)
+                self.end = self.next + size
+            take = min(self.end - self.next, count - len(ids))
+            ids += [self._encode(self._permute(n)) for n in range(self.next, self.next + take)]
+            self.next += take
+        return ids
+
+
+ticket_ids = TicketIdGenerator(TICKET_ID_BLOCK)
+
+def generate_ticket_id():
+    return ticket_ids.generate()[0]
 
 def code(tid):
     return f"<code>{html.escape(tid)}</code>"
@@ -73,15 +1190,317 @@ def user_info_block(user):
         f"• Full Name : {safe_first_name}\n\n"
     )
 
-def check_rate_limit(user_id):
-    now = time.time()
-    if user_id not in user_message_timestamps:
-        user_message_timestamps[user_id] = []
-    user_message_timestamps[user_id] = [t for t in user_message_timestamps[user_id] if now - t < 60]
-    if len(user_message_timestamps[user_id]) >= 2:
-        return False
-    user_message_timestamps[user_id].append(now)
-    return True
+# ================= MEDIA DISPATCH =================
+class MediaKind(NamedTuple):
+    attr: str       # attribute on telegram.Message
+    method: str     # Bot method that re-sends it by file_id
+    kwarg: str      # file argument of that method
+    label: str      # placeholder logged when there is no caption
+    caption: bool   # whether the Bot API accepts a caption for this type
+
+# Order matters: an animation message also carries `document`, so it must
+# be matched first.
+MEDIA_KINDS = (
+    MediaKind("photo", "send_photo", "photo", "[Photo]", True),
+    MediaKind("voice", "send_voice", "voice", "[Voice Message]", True),
+    MediaKind("video", "send_video", "video", "[Video]", True),
+    MediaKind("animation", "send_animation", "animation", "[Animation/GIF]", True),
+    MediaKind("document", "send_document", "document", "[Document]", True),
+    MediaKind("audio", "send_audio", "audio", "[Audio]", True),
+    MediaKind("sticker", "send_sticker", "sticker", "[Sticker]", False),
+    MediaKind("video_note", "send_video_note", "video_note", "[Video Note]", False),
+)
+MEDIA_BY_ATTR = {kind.attr: kind for kind in MEDIA_KINDS}
+_MEDIA_LOOKUP = tuple((kind.attr, kind) for kind in MEDIA_KINDS)
+
+def resolve_media(message):
+    """Return the MediaKind of the message's attachment, or None."""
+    for attr, kind in _MEDIA_LOOKUP:
+        if getattr(message, attr):
+            return kind
+    return None
+
+def media_file_id(message, kind):
+    attachment = getattr(message, kind.attr)
+    if kind.attr == "photo":
+        attachment = attachment[-1]
+    return attachment.file_id
+
+# ticket_id -> {chat_id: message_id} of the latest message in that chat that
+# shows the ticket header. Caption-less media reply to it instead of
+# repeating the header in a separate message.
+ticket_threads = {}
+
+def thread_anchor(ticket_id, chat_id):
+    return ticket_threads.get(ticket_id, {}).get(chat_id)
+
+def set_thread_anchor(ticket_id, chat_id, message_id):
+    ticket_threads.setdefault(ticket_id, {})[chat_id] = message_id
+
+def remember_group_message(message_id, ticket_id):
+    """Map a support group message to its ticket, so staff can reply to it."""
+    store.map_group_message(message_id, ticket_id)
+    if shard_link is not None:
+        shard_link.route(message_id)  # the leader sends replies to it to this worker
+
+async def copy_media(bot, chat_id, message, kind, caption, anchor=None):
+    """Copy a media message to chat_id with `caption`, in one call where possible.
+
+    Stickers and video notes cannot carry a caption. They are sent as a reply
+    to `anchor`, an earlier message that already shows the header; without
+    one, the caption goes out first and the media replies to it. Returns
+    (media message, header message or None); only message_id is guaranteed.
+    """
+    header = None
+    if kind.caption:
+        extra = {"caption": caption, "parse_mode": "HTML"}
+    elif caption:
+        if not anchor:
+            header = await bot.send_message(chat_id=chat_id, text=caption, parse_mode="HTML")
+            anchor = header.message_id
+        extra = {"reply_to_message_id": anchor, "allow_sending_without_reply": True}
+    else:
+        extra = {}
+    try:
+        sent = await bot.copy_message(
+            chat_id=chat_id,
+            from_chat_id=message.chat_id,
+            message_id=message.message_id,
+            **extra
+        )
+    except BadRequest:
+        # The source can vanish before we copy it (deleted, protected chat);
+        # the file itself is still reachable by file_id.
+        sent = await getattr(bot, kind.method)(
+            chat_id=chat_id,
+            **{kind.kwarg: media_file_id(message, kind)},
+            **extra
+        )
+    return sent, header
+
+# ================= RATE LIMITING =================
+# scope -> (requests, period in seconds): a burst of `requests`, then one
+# request every period/requests seconds. "private" covers user messages in
+# private chat; the other scopes are commands and button callbacks.
+DEFAULT_RATE_LIMITS = {
+    "private": (2, 60),
+    "create_ticket": (3, 60),
+    "profile": (5, 60),
+    "status": (10, 60),
+    "requestclose": (3, 60),
+}
+
+def parse_rate_limits(spec):
+    """Apply a "scope=requests/seconds,..." override on top of the defaults (0 disables a scope).
+
+    Malformed items are reported and skipped, so their scope keeps its default.
+    """
+    limits = dict(DEFAULT_RATE_LIMITS)
+    for item in spec.split(","):
+        if not item.strip():
+            continue
+        scope, _, value = item.partition("=")
+        count, _, period = value.partition("/")
+        try:
+            count, period = int(count), float(period or 60)
+            if period <= 0:
+                raise ValueError("period must be positive")
+        except ValueError as e:
+            print(f"Ignoring RATE_LIMITS item {item.strip()!r}: {e}")
+            continue
+        if count <= 0:
+            limits.pop(scope.strip(), None)
+        else:
+            limits[scope.strip()] = (count, period)
+    return limits
+
+class RateLimiter:
+    """GCRA limiter: one float per user and scope, O(1) work per check.
+
+    Each entry holds the user's theoretical arrival time (TAT). A request is
+    allowed while the TAT stays within one period of now, which admits a
+    burst of `requests` and then one request every period/requests seconds.
+    """
+
+    def __init__(self, limits):
+        self.limits = limits
+        self.tat = {scope: {} for scope in limits}  # scope -> {user_id: TAT}
+
+    def allow(self, scope, user_id):
+        limit = self.limits.get(scope)
+        if limit is None:
+            return True
+        count, period = limit
+        entries = self.tat[scope]
+        now = time.monotonic()
+        tat = entries.get(user_id, now)
+        if tat < now:
+            tat = now
+        tat += period / count
+        if tat - now > period:
+            return False
+        entries[user_id] = tat
+        return True
+
+    def cleanup(self):
+        """Drop users whose TAT has passed; they are back to a full burst anyway."""
+        now = time.monotonic()
+        for entries in self.tat.values():
+            for user_id in [uid for uid, tat in entries.items() if tat <= now]:
+                del entries[user_id]
+
+rate_limiter = RateLimiter(parse_rate_limits(RATE_LIMITS))
+
+def check_rate_limit(user_id, scope="private"):
+    if rate_limiter.allow(scope, user_id):
+        return True
+    rate_limit_rejections[scope] += 1
+    return False
+
+# ================= OUTBOUND DELIVERY =================
+class OutboundJob(NamedTuple):
+    send: object    # async () -> None: Bot API calls plus bookkeeping
+    failed: object  # async (error) -> None: report that the send was given up
+    done: object    # asyncio.Future resolved once it is delivered or given up, or None
+
+
+# When set to a list, submit() appends each job's `done` future to it. Shard
+# workers use this to acknowledge an update only after its sends finished.
+outbound_watch = contextvars.ContextVar("outbound_watch", default=None)
+
+
+class OutboundDispatcher:
+    """Per-ticket FIFOs drained by a shared pool of workers.
+
+    A ticket is owned by at most one worker at a time, so its messages go out
+    in the order they were queued, while different tickets are delivered in
+    parallel. Flood control and network errors are retried with backoff;
+    anything else fails the job at once.
+    """
+
+    def __init__(self, workers, max_retries):
+        self.worker_count = workers
+        self.max_retries = max_retries
+        self.queues = {}  # ticket_id -> deque of OutboundJob
+        self.ready = asyncio.Queue()  # tickets with queued jobs and no worker yet
+        self.workers = []
+
+    def submit(self, ticket_id, send, failed):
+        watch = outbound_watch.get()
+        done = None
+        if watch is not None:
+            done = asyncio.get_running_loop().create_future()
+            watch.append(done)
+        job = OutboundJob(send, failed, done)
+        queue = self.queues.get(ticket_id)
+        if queue is None:
+            self.queues[ticket_id] = deque([job])
+            self.ready.put_nowait(ticket_id)
+        else:
+            queue.append(job)
+
+    def pending(self):
+        return sum(len(queue) for queue in self.queues.values())
+
+    def start(self):
+        self.workers = [asyncio.create_task(self._worker()) for _ in range(self.worker_count)]
+
+    async def stop(self):
+        """Deliver everything already queued, then stop the workers."""
+        await self.ready.join()
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+    async def _worker(self):
+        while True:
+            ticket_id = await self.ready.get()
+            queue = self.queues[ticket_id]
+            try:
+                while queue:
+                    await self._deliver(queue[0])
+                    job = queue.popleft()
+                    if job.done is not None:
+                        job.done.set_result(None)
+            finally:
+                del self.queues[ticket_id]
+                self.ready.task_done()
+
+    async def _deliver(self, job):
+        for attempt in range(self.max_retries + 1):
+            try:
+                await job.send()
+                return
+            except RetryAfter as e:
+                error, delay = e, e.retry_after
+            except (BadRequest, Forbidden) as e:
+                error = e
+                break
+            except NetworkError as e:
+                error, delay = e, 2 ** attempt
+            except Exception as e:
+                error = e
+                break
+            if attempt < self.max_retries:
+                await asyncio.sleep(delay)
+        try:
+            await job.failed(error)
+        except Exception as e:
+            print(f"Failed to report delivery failure: {e}")
+
+
+outbound = OutboundDispatcher(OUTBOUND_WORKERS, OUTBOUND_MAX_RETRIES)
+
+async def start_delivery(application):
+    outbound.start()
+
+async def stop_delivery(application):
+    """Queue pending albums and deliver everything before the bot shuts down."""
+    flush_albums(application.bot)
+    await outbound.stop()
+
+async def on_start(application):
+    await start_delivery(application)
+    await start_metrics_server()
+
+async def on_stop(application):
+    await stop_delivery(application)
+    await stop_metrics_server()
+
+# ================= CONCURRENCY =================
+# Updates are processed concurrently (UPDATE_CONCURRENCY), so handlers that
+# read and then change a user's tickets, or must keep that user's messages in
+# order, hold the user's lock for the whole update.
+class KeyedLocks:
+    """One asyncio.Lock per key, dropped as soon as nobody holds or waits for it."""
+
+    def __init__(self):
+        self.locks = {}  # key -> [lock, holders and waiters]
+
+    @asynccontextmanager
+    async def __call__(self, key):
+        entry = self.locks.get(key)
+        if entry is None:
+            entry = self.locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self.locks[key]
+
+user_locks = KeyedLocks()
+
+def locked_by_user(handler):
+    """Run `handler` while holding the lock of the user who sent the update."""
+    @wraps(handler)
+    async def wrapper(update: Update, context):
+        async with user_locks(update.effective_user.id):
+            return await handler(update, context)
+    return wrapper
 
 # ================= /start =================
 async def start(update: Update, context):
@@ -106,27 +1525,29 @@ async def start(update: Update, context):
     )
 
 # ================= CREATE TICKET =================
+@locked_by_user
 async def create_ticket(update: Update, context):
     query = update.callback_query
-    await query.answer()
     user = query.from_user
+    if not check_rate_limit(user.id, "create_ticket"):
+        await query.answer("⏱️ Too many requests. Please wait a moment.", show_alert=True)
+        return
+    await query.answer()
     register_user(user)  # Update user info
 
-    if user.id in user_active_ticket:
+    active_ticket = store.user_active_ticket(user.id)
+    if active_ticket:
         await query.message.reply_text(
-            f"🎫 You already have an active ticket:\n{code(user_active_ticket[user.id])}",
+            f"🎫 You already have an active ticket:\n{code(active_ticket)}",
             parse_mode="HTML"
         )
         return
 
     ticket_id = generate_ticket_id()
-    user_active_ticket[user.id] = ticket_id
-    ticket_status[ticket_id] = "Pending"
-    ticket_user[ticket_id] = user.id
-    ticket_username[ticket_id] = user.username or ""
-    ticket_messages[ticket_id] = []
-    ticket_created_at[ticket_id] = get_bst_now()
-    user_tickets.setdefault(user.id, []).append(ticket_id)
+    created_at = int(time.time())
+    store.create_ticket(ticket_id, user.id, user.username or "", created_at)
+    sla.opened(ticket_id, created_at)
+    record_stats(created_at, {"opened": 1})
 
     await query.message.reply_text(
         f"🎫 Ticket Created: {code(ticket_id)}\n"
@@ -137,18 +1558,29 @@ async def create_ticket(update: Update, context):
     )
 
 # ================= USER MESSAGE =================
+@locked_by_user
 async def user_message(update: Update, context):
     user = update.message.from_user
     register_user(user)  # Ensure user is known even if no ticket
 
+    # Later items of an album ride on the first one: no rate limit, no reply
+    if update.message.media_group_id and add_to_album(update.message):
+        return
+
+    kind = resolve_media(update.message)  # once per update; passed on below
     if not check_rate_limit(user.id):
+        start_album(context, update.message, kind)  # drop the rest of a refused album quietly
+        count, period = rate_limiter.limits["private"]
         await update.message.reply_text(
-            "⏱️ You can send at most 2 messages per minute. Please wait a moment.",
+            f"⏱️ You are sending messages too fast. You can send {count} in a row, "
+            f"then one every {period / count:.3g} seconds. Please wait a moment.",
             parse_mode="HTML"
         )
         return
 
-    if user.id not in user_active_ticket:
+    ticket_id = store.user_active_ticket(user.id)
+    if not ticket_id:
+        start_album(context, update.message, kind)
         keyboard = InlineKeyboardMarkup([
             [InlineKeyboardButton("🎟️ Create Ticket", callback_data="create_ticket")]
         ])
@@ -160,294 +1592,238 @@ async def user_message(update: Update, context):
         )
         return
 
-    ticket_id = user_active_ticket[user.id]
-    if ticket_status[ticket_id] == "Pending":
-        ticket_status[ticket_id] = "Processing"
+    status = store.ticket_status(ticket_id)
+    now = int(time.time())
+    if status == TicketStatus.PENDING:
+        status = TicketStatus.PROCESSING
+        store.set_ticket_status(ticket_id, status)
+        sla.asked(ticket_id, now)
+    sla.activity(ticket_id, now)
 
     # Update username again in case it changed
     register_user(user)
 
-    header = ticket_header(ticket_id, ticket_status[ticket_id]) + user_info_block(user) + "Message:\n"
-    caption_text = update.message.caption or ""
-    safe_caption = html.escape(caption_text) if caption_text else ""
-
-    sent = None
-    log_text = ""
-    timestamp = get_bst_now()
-
-    if update.message.text:
-        log_text = html.escape(update.message.text)
-        full_message = header + log_text
-        sent = await context.bot.send_message(
-            chat_id=GROUP_ID,
-            text=full_message,
-            parse_mode="HTML"
-        )
-
-    elif update.message.photo:
-        log_text = "[Photo]"
-        full_caption = header + (safe_caption if safe_caption else log_text)
-        sent = await context.bot.send_photo(
-            chat_id=GROUP_ID,
-            photo=update.message.photo[-1].file_id,
-            caption=full_caption,
-            parse_mode="HTML"
-        )
-
-    elif update.message.voice:
-        log_text = "[Voice Message]"
-        full_caption = header + (safe_caption if safe_caption else log_text)
-        sent = await context.bot.send_voice(
-            chat_id=GROUP_ID,
-            voice=update.message.voice.file_id,
-            caption=full_caption,
-            parse_mode="HTML"
-        )
-
-    elif update.message.video:
-        log_text = "[Video]"
-        full_caption = header + (safe_caption if safe_caption else log_text)
-        sent = await context.bot.send_video(
-            chat_id=GROUP_ID,
-            video=update.message.video.file_id,
-            caption=full_caption,
-            parse_mode="HTML"
-        )
+    header = ticket_header(ticket_id, status) + user_info_block(user) + "Message:\n"
+    if start_album(context, update.message, kind, ticket_id, header):
+        return
 
-    elif update.message.document:
-        log_text = "[Document]"
-        full_caption = header + (safe_caption if safe_caption else log_text)
-        sent = await context.bot.send_document(
-            chat_id=GROUP_ID,
-            document=update.message.document.file_id,
-            caption=full_caption,
+    if not update.message.text and not kind:
+        await update.message.reply_text(
+            "❌ This message type is not supported. Please send text, photo, video, document, audio, sticker, etc.",
             parse_mode="HTML"
         )
 
-    elif update.message.audio:
-        log_text = "[Audio]"
-        full_caption = header + (safe_caption if safe_caption else log_text)
-        sent = await context.bot.send_audio(
-            chat_id=GROUP_ID,
-            audio=update.message.audio.file_id,
-            caption=full_caption,
-            parse_mode="HTML"
-        )
+    sender_name = f"@{user.username}" if user.username else user.first_name or "User"
+    outbound.submit(
+        ticket_id,
+        partial(forward_to_group, context.bot, update.message, kind, ticket_id, header, sender_name, int(time.time())),
+        partial(report_forward_failure, update.message),
+    )
 
-    elif update.message.sticker:
-        log_text = "[Sticker]"
-        sent = await context.bot.send_sticker(
-            chat_id=GROUP_ID,
-            sticker=update.message.sticker.file_id
-        )
-        if safe_caption:
-            await context.bot.send_message(
-                chat_id=GROUP_ID,
-                text=header + safe_caption,
-                parse_mode="HTML"
-            )
-        else:
-            await context.bot.send_message(
-                chat_id=GROUP_ID,
-                text=header + log_text,
-                parse_mode="HTML"
-            )
-        if sent:
-            group_message_map[sent.message_id] = ticket_id
+async def forward_to_group(bot, message, kind, ticket_id, header, sender_name, timestamp):
+    """Deliver one user message (of media `kind`) to the support group (runs on the outbound queue)."""
+    safe_caption = html.escape(message.caption) if message.caption else ""
 
-    elif update.message.animation:
-        log_text = "[Animation/GIF]"
-        full_caption = header + (safe_caption if safe_caption else log_text)
-        sent = await context.bot.send_animation(
+    if message.text:
+        log_text = html.escape(message.text)
+        sent = await bot.send_message(
             chat_id=GROUP_ID,
-            animation=update.message.animation.file_id,
-            caption=full_caption,
+            text=header + log_text,
             parse_mode="HTML"
         )
-
-    elif update.message.video_note:
-        log_text = "[Video Note]"
-        sent = await context.bot.send_video_note(
-            chat_id=GROUP_ID,
-            video_note=update.message.video_note.file_id
+        set_thread_anchor(ticket_id, GROUP_ID, sent.message_id)
+
+    elif kind:
+        log_text = kind.label
+        sent, header_sent = await copy_media(
+            bot, GROUP_ID, message, kind,
+            header + (safe_caption if safe_caption else log_text),
+            anchor=thread_anchor(ticket_id, GROUP_ID)
         )
-        if safe_caption:
-            await context.bot.send_message(
-                chat_id=GROUP_ID,
-                text=header + safe_caption,
-                parse_mode="HTML"
-            )
-        else:
-            await context.bot.send_message(
-                chat_id=GROUP_ID,
-                text=header + log_text,
-                parse_mode="HTML"
-            )
+        if header_sent:
+            remember_group_message(header_sent.message_id, ticket_id)
+        if header_sent or kind.caption:
+            set_thread_anchor(ticket_id, GROUP_ID, (header_sent or sent).message_id)
 
     else:
         log_text = "[Unsupported message type]"
-        await update.message.reply_text(
-            "❌ This message type is not supported. Please send text, photo, video, document, audio, sticker, etc.",
-            parse_mode="HTML"
-        )
-        sent = await context.bot.send_message(
+        sent = await bot.send_message(
             chat_id=GROUP_ID,
             text=header + log_text,
             parse_mode="HTML"
         )
+        set_thread_anchor(ticket_id, GROUP_ID, sent.message_id)
 
-    if sent:
-        group_message_map[sent.message_id] = ticket_id
-        sender_name = f"@{user.username}" if user.username else user.first_name or "User"
-        ticket_messages[ticket_id].append((sender_name, log_text, timestamp))
+    remember_group_message(sent.message_id, ticket_id)
+    store.add_ticket_message(ticket_id, sender_name, log_text, timestamp)
+    record_stats(timestamp, {f"media:{'text' if message.text else kind.attr if kind else 'other'}": 1})
 
-# ================= GROUP REPLY =================
-async def group_reply(update: Update, context):
-    if not update.message.reply_to_message:
-        return
+async def report_forward_failure(message, error):
+    await message.reply_text(
+        "⚠️ Your message could not be delivered to support. Please send it again.",
+        parse_mode="HTML"
+    )
 
-    reply_id = update.message.reply_to_message.message_id
-    if reply_id not in group_message_map:
-        return
+# ================= ALBUMS =================
+# Album items arrive as separate updates sharing a media_group_id. They are
+# collected until ALBUM_WINDOW passes without a new item, then forwarded
+# with one send_media_group call under a single header.
+ALBUM_INPUT_MEDIA = {
+    "photo": InputMediaPhoto,
+    "video": InputMediaVideo,
+    "document": InputMediaDocument,
+    "audio": InputMediaAudio,
+}
+
+class Album:
+    __slots__ = ("ticket_id", "header", "messages", "timestamp", "deadline")
+
+    def __init__(self, ticket_id, header, message):
+        self.ticket_id = ticket_id  # None: album was refused, drop its items
+        self.header = header
+        self.messages = [message]
+        self.timestamp = int(time.time())
+        self.deadline = time.monotonic() + ALBUM_WINDOW
+
+pending_albums = {}  # media_group_id -> Album
+
+def start_album(context, message, kind, ticket_id=None, header=""):
+    """Start collecting the album `message` (of media `kind`) belongs to; False if it is not an album item."""
+    if not message.media_group_id or not kind or kind.attr not in ALBUM_INPUT_MEDIA:
+        return False
+    pending_albums[message.media_group_id] = Album(ticket_id, header, message)
+    context.job_queue.run_once(flush_album, ALBUM_WINDOW, data=message.media_group_id)
+    return True
 
-    ticket_id = group_message_map[reply_id]
-    user_id = ticket_user[ticket_id]
+def add_to_album(message):
+    album = pending_albums.get(message.media_group_id)
+    if album is None:
+        return False
+    album.messages.append(message)
+    album.deadline = time.monotonic() + ALBUM_WINDOW
+    return True
 
-    if ticket_status.get(ticket_id) == "Closed":
-        await update.message.reply_text(
-            f"⚠️ Ticket {code(ticket_id)} is already closed. Cannot send reply.",
-            parse_mode="HTML"
-        )
+async def flush_album(context):
+    key = context.job.data
+    album = pending_albums.get(key)
+    if album is None:
         return
+    remaining = album.deadline - time.monotonic()
+    if remaining > 0:
+        context.job_queue.run_once(flush_album, remaining, data=key)
+        return
+    del pending_albums[key]
+    if album.ticket_id:
+        submit_album(context.bot, album)
+
+def flush_albums(bot):
+    """Queue albums still waiting for their window (used on shutdown)."""
+    albums = [album for album in pending_albums.values() if album.ticket_id]
+    pending_albums.clear()
+    for album in albums:
+        submit_album(bot, album)
+
+def submit_album(bot, album):
+    outbound.submit(
+        album.ticket_id,
+        partial(send_album, bot, album),
+        partial(report_forward_failure, album.messages[0]),
+    )
 
-    prefix = f"🎫 Ticket ID: {code(ticket_id)}\n\n"
-    caption_text = update.message.caption or ""
-    safe_caption = html.escape(caption_text) if caption_text else ""
-    timestamp = get_bst_now()
-    log_text = ""
-
-    try:
-        if update.message.text:
-            log_text = html.escape(update.message.text)
-            await context.bot.send_message(
-                chat_id=user_id,
-                text=prefix + log_text,
-                parse_mode="HTML"
-            )
+async def send_album(bot, album):
+    messages = sorted(album.messages, key=lambda m: m.message_id)
+    captions = [html.escape(m.caption) for m in messages if m.caption]
+    log_text = "\n".join(captions) if captions else f"[Album: {len(messages)} items]"
+
+    kinds = [resolve_media(message) for message in messages]
+    media = []
+    for message, kind in zip(messages, kinds):
+        caption = html.escape(message.caption or "")
+        if not media:
+            caption = album.header + (caption if caption else f"[Album: {len(messages)} items]")
+        media.append(ALBUM_INPUT_MEDIA[kind.attr](
+            media_file_id(message, kind),
+            caption=caption or None,
+            parse_mode="HTML"
+        ))
 
-        elif update.message.photo:
-            log_text = "[Photo]"
-            full_caption = prefix + (safe_caption if safe_caption else log_text)
-            await context.bot.send_photo(
-                chat_id=user_id,
-                photo=update.message.photo[-1].file_id,
-                caption=full_caption,
-                parse_mode="HTML"
-            )
+    sent = await bot.send_media_group(chat_id=GROUP_ID, media=media)
+    for group_message in sent:
+        remember_group_message(group_message.message_id, album.ticket_id)
+    set_thread_anchor(album.ticket_id, GROUP_ID, sent[0].message_id)
 
-        elif update.message.voice:
-            log_text = "[Voice Message]"
-            full_caption = prefix + (safe_caption if safe_caption else log_text)
-            await context.bot.send_voice(
-                chat_id=user_id,
-                voice=update.message.voice.file_id,
-                caption=full_caption,
-                parse_mode="HTML"
-            )
+    user = messages[0].from_user
+    sender_name = f"@{user.username}" if user.username else user.first_name or "User"
+    store.add_ticket_message(album.ticket_id, sender_name, log_text, album.timestamp)
+    record_stats(album.timestamp, Counter(f"media:{kind.attr}" for kind in kinds))
 
-        elif update.message.video:
-            log_text = "[Video]"
-            full_caption = prefix + (safe_caption if safe_caption else log_text)
-            await context.bot.send_video(
-                chat_id=user_id,
-                video=update.message.video.file_id,
-                caption=full_caption,
-                parse_mode="HTML"
-            )
+# ================= GROUP REPLY =================
+async def group_reply(update: Update, context):
+    if not update.message.reply_to_message:
+        return
 
-        elif update.message.document:
-            log_text = "[Document]"
-            full_caption = prefix + (safe_caption if safe_caption else log_text)
-            await context.bot.send_document(
-                chat_id=user_id,
-                document=update.message.document.file_id,
-                caption=full_caption,
-                parse_mode="HTML"
-            )
+    reply_id = update.message.reply_to_message.message_id
+    ticket_id = store.group_message_ticket(reply_id)
+    if not ticket_id:
+        return
 
-        elif update.message.audio:
-            log_text = "[Audio]"
-            full_caption = prefix + (safe_caption if safe_caption else log_text)
-            await context.bot.send_audio(
-                chat_id=user_id,
-                audio=update.message.audio.file_id,
-                caption=full_caption,
+    user_id = store.ticket_user(ticket_id)
+    async with user_locks(user_id):
+        # Checked under the owner's lock, like /close, so a reply is never queued after the close
+        if store.ticket_status(ticket_id) == TicketStatus.CLOSED:
+            await update.message.reply_text(
+                f"⚠️ Ticket {code(ticket_id)} is already closed. Cannot send reply.",
                 parse_mode="HTML"
             )
+            return
 
-        elif update.message.sticker:
-            log_text = "[Sticker]"
-            await context.bot.send_sticker(
-                chat_id=user_id,
-                sticker=update.message.sticker.file_id
-            )
-            if safe_caption:
-                await context.bot.send_message(
-                    chat_id=user_id,
-                    text=prefix + safe_caption,
-                    parse_mode="HTML"
-                )
-            else:
-                await context.bot.send_message(
-                    chat_id=user_id,
-                    text=prefix + log_text,
-                    parse_mode="HTML"
-                )
+        outbound.submit(
+            ticket_id,
+            partial(forward_to_user, context.bot, update.message, ticket_id, user_id, int(time.time())),
+            partial(report_reply_failure, update.message),
+        )
 
-        elif update.message.animation:
-            log_text = "[Animation/GIF]"
-            full_caption = prefix + (safe_caption if safe_caption else log_text)
-            await context.bot.send_animation(
-                chat_id=user_id,
-                animation=update.message.animation.file_id,
-                caption=full_caption,
-                parse_mode="HTML"
-            )
+async def forward_to_user(bot, message, ticket_id, user_id, timestamp):
+    """Deliver one staff reply to the ticket owner (runs on the outbound queue)."""
+    prefix = f"🎫 Ticket ID: {code(ticket_id)}\n\n"
+    kind = resolve_media(message)
+    safe_caption = html.escape(message.caption) if message.caption else ""
 
-        elif update.message.video_note:
-            log_text = "[Video Note]"
-            await context.bot.send_video_note(
-                chat_id=user_id,
-                video_note=update.message.video_note.file_id
-            )
-            if safe_caption:
-                await context.bot.send_message(
-                    chat_id=user_id,
-                    text=prefix + safe_caption,
-                    parse_mode="HTML"
-                )
-            else:
-                await context.bot.send_message(
-                    chat_id=user_id,
-                    text=prefix + log_text,
-                    parse_mode="HTML"
-                )
+    if message.text:
+        log_text = html.escape(message.text)
+        sent = await bot.send_message(
+            chat_id=user_id,
+            text=prefix + log_text,
+            parse_mode="HTML"
+        )
+        set_thread_anchor(ticket_id, user_id, sent.message_id)
+
+    elif kind:
+        log_text = kind.label
+        sent, header_sent = await copy_media(
+            bot, user_id, message, kind,
+            prefix + (safe_caption if safe_caption else log_text),
+            anchor=thread_anchor(ticket_id, user_id)
+        )
+        if header_sent or kind.caption:
+            set_thread_anchor(ticket_id, user_id, (header_sent or sent).message_id)
 
-        else:
-            log_text = "[Unsupported message type]"
-            await context.bot.send_message(
-                chat_id=user_id,
-                text=prefix + "Unsupported message type.",
-                parse_mode="HTML"
-            )
-    except Exception as e:
-        await update.message.reply_text(
-            f"❌ Failed to send reply to user: {e}",
+    else:
+        log_text = "[Unsupported message type]"
+        await bot.send_message(
+            chat_id=user_id,
+            text=prefix + "Unsupported message type.",
             parse_mode="HTML"
         )
-        return
 
-    ticket_messages[ticket_id].append(("BlockVeil Support", log_text, timestamp))
+    store.add_ticket_message(ticket_id, "BlockVeil Support", log_text, timestamp)
+    sla.responded(ticket_id, timestamp)
+
+async def report_reply_failure(message, error):
+    await message.reply_text(
+        f"❌ Failed to send reply to user: {html.escape(str(error))}",
+        parse_mode="HTML"
+    )
 
 # ================= /close =================
 async def close_ticket(update: Update, context):
@@ -458,36 +1834,46 @@ async def close_ticket(update: Update, context):
     if context.args:
         ticket_id = context.args[0]
     elif update.message.reply_to_message:
-        ticket_id = group_message_map.get(update.message.reply_to_message.message_id)
+        ticket_id = store.group_message_ticket(update.message.reply_to_message.message_id)
 
-    if not ticket_id or ticket_id not in ticket_status:
+    status = store.ticket_status(ticket_id) if ticket_id else None
+    if not status:
         await update.message.reply_text(
             "❌ Ticket not found.\nUse /close BV-XXXXX or reply with /close",
             parse_mode="HTML"
         )
         return
 
-    if ticket_status[ticket_id] == "Closed":
-        await update.message.reply_text("⚠️ Ticket already closed.", parse_mode="HTML")
-        return
+    user_id = store.ticket_user(ticket_id)
+    async with user_locks(user_id):
+        # Re-read under the owner's lock: a concurrent /close may have won
+        if store.ticket_status(ticket_id) == TicketStatus.CLOSED:
+            await update.message.reply_text("⚠️ Ticket already closed.", parse_mode="HTML")
+            return
+        store.set_ticket_status(ticket_id, TicketStatus.CLOSED)
+        ticket_threads.pop(ticket_id, None)
+    sla.closed(ticket_id, int(time.time()))
+
+    # Queued behind any replies still on their way, so the user sees them first
+    outbound.submit(
+        ticket_id,
+        partial(notify_closed, context.bot, update.message, ticket_id, user_id),
+        partial(report_close_failure, update.message),
+    )
 
-    user_id = ticket_user[ticket_id]
-    ticket_status[ticket_id] = "Closed"
-    user_active_ticket.pop(user_id, None)
+async def notify_closed(bot, message, ticket_id, user_id):
+    await bot.send_message(
+        chat_id=user_id,
+        text=f"🎫 Ticket ID: {code(ticket_id)}\nStatus: Closed",
+        parse_mode="HTML"
+    )
+    await message.reply_text(f"✅ Ticket {code(ticket_id)} closed.", parse_mode="HTML")
 
-    try:
-        await context.bot.send_message(
-            chat_id=user_id,
-            text=f"🎫 Ticket ID: {code(ticket_id)}\nStatus: Closed",
-            parse_mode="HTML"
-        )
-    except Exception as e:
-        await update.message.reply_text(
-            f"⚠️ Ticket closed but failed to notify user: {e}",
-            parse_mode="HTML"
-        )
-    else:
-        await update.message.reply_text(f"✅ Ticket {code(ticket_id)} closed.", parse_mode="HTML")
+async def report_close_failure(message, error):
+    await message.reply_text(
+        f"⚠️ Ticket closed but failed to notify user: {html.escape(str(error))}",
+        parse_mode="HTML"
+    )
 
 # ================= /requestclose =================
 async def request_close(update: Update, context):
@@ -501,6 +1887,10 @@ async def request_close(update: Update, context):
     user = update.message.from_user
     register_user(user)  # Update user info
 
+    if not check_rate_limit(user.id, "requestclose"):
+        await update.message.reply_text("⏱️ Too many requests. Please wait a moment.", parse_mode="HTML")
+        return
+
     if not context.args:
         await update.message.reply_text(
             "❌ Please provide a ticket ID.\nUsage: /requestclose BV-XXXXX",
@@ -509,13 +1899,14 @@ async def request_close(update: Update, context):
         return
 
     ticket_id = context.args[0]
-    if ticket_id not in ticket_status:
+    status = store.ticket_status(ticket_id)
+    if not status:
         await update.message.reply_text(f"❌ Ticket {code(ticket_id)} not found.", parse_mode="HTML")
         return
-    if ticket_user.get(ticket_id) != user.id:
+    if store.ticket_user(ticket_id) != user.id:
         await update.message.reply_text("❌ This ticket does not belong to you.", parse_mode="HTML")
         return
-    if ticket_status[ticket_id] == "Closed":
+    if status == TicketStatus.CLOSED:
         await update.message.reply_text(f"⚠️ Ticket {code(ticket_id)} is already closed.", parse_mode="HTML")
         return
 
@@ -536,6 +1927,356 @@ async def request_close(update: Update, context):
         parse_mode="HTML"
     )
 
+# ================= SLA TRACKING =================
+def format_duration(seconds):
+    """Compact duration such as 45s, 12m, 3h 20m or 2d 4h."""
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds}s"
+    minutes, hours, days = seconds // 60, seconds // 3600, seconds // 86400
+    if minutes < 60:
+        return f"{minutes}m"
+    if hours < 24:
+        return f"{hours}h {minutes % 60}m" if minutes % 60 else f"{hours}h"
+    return f"{days}d {hours % 24}h" if hours % 24 else f"{days}d"
+
+
+class SlaState:
+    """SLA bookkeeping for one open ticket (times are epoch seconds)."""
+
+    __slots__ = ("ticket_id", "created_at", "last_activity", "responded", "parked")
+
+    def __init__(self, ticket_id, created_at, last_activity, responded):
+        self.ticket_id = ticket_id
+        self.created_at = created_at
+        self.last_activity = last_activity
+        self.responded = responded  # a staff reply reached the user
+        self.parked = False  # response deadline passed with no entry left in the heap
+
+
+class SlaTracker:
+    """Deadlines of open tickets in a min-heap, so a check never scans every ticket.
+
+    Each tracked ticket has at most one heap entry per deadline kind. New
+    messages only move `last_activity`; when the idle entry comes due and
+    the ticket turns out to be active, the entry is pushed back with the
+    real deadline. A response deadline that passes while the ticket is
+    still Pending is parked instead of alerted: the user's first message
+    re-arms it, one response target later. Entries of tickets that were
+    closed (or closed and reopened) since are dropped when they reach the top.
+    """
+
+    def __init__(self, idle_timeout, response_target, resolution_target):
+        self.idle_timeout = idle_timeout
+        self.response_target = response_target
+        self.resolution_target = resolution_target
+        self.heap = []  # (due, seq, kind, SlaState)
+        self.seq = itertools.count()  # tie-breaker, so states are never compared
+        self.tickets = {}  # open ticket_id -> SlaState
+
+    def _push(self, due, kind, state):
+        heapq.heappush(self.heap, (due, next(self.seq), kind, state))
+
+    def track(self, ticket_id, created_at, last_activity, responded, now):
+        """Start watching an open ticket. Breach deadlines already in the past are not
+        alerted again (after a restart or a reopen)."""
+        state = self.tickets[ticket_id] = SlaState(ticket_id, created_at, last_activity, responded)
+        if self.idle_timeout:
+            self._push(last_activity + self.idle_timeout, "idle", state)
+        if self.response_target and not responded:
+            if created_at + self.response_target > now:
+                self._push(created_at + self.response_target, "response", state)
+            else:
+                state.parked = True
+        if self.resolution_target and created_at + self.resolution_target > now:
+            self._push(created_at + self.resolution_target, "resolution", state)
+
+    def load(self, open_tickets, now):
+        for ticket_id, created_at, last_activity, first_response in open_tickets:
+            self.track(ticket_id, created_at, last_activity, first_response is not None, now)
+
+    def opened(self, ticket_id, created_at):
+        self.track(ticket_id, created_at, created_at, False, created_at)
+
+    def activity(self, ticket_id, timestamp):
+        state = self.tickets.get(ticket_id)
+        if state is not None and timestamp > state.last_activity:
+            state.last_activity = timestamp
+        return state
+
+    def asked(self, ticket_id, timestamp):
+        """The user's first message on a Pending ticket: re-arm a parked response deadline."""
+        state = self.tickets.get(ticket_id)
+        if state is not None and state.parked and not state.responded:
+            state.parked = False
+            self._push(timestamp + self.response_target, "response", state)
+
+    def responded(self, ticket_id, timestamp):
+        """A staff reply was delivered; the first one sets the ticket's first-response time."""
+        counts = {"replies": 1}
+        state = self.activity(ticket_id, timestamp)
+        if state is not None and not state.responded:
+            state.responded = True
+            seconds = max(0, timestamp - state.created_at)
+            store.record_first_response(ticket_id, seconds)
+            sla_latency.observe("first_response", seconds)
+            counts[first_response_metric(seconds)] = 1
+        record_stats(timestamp, counts)
+
+    def closed(self, ticket_id, timestamp):
+        self.tickets.pop(ticket_id, None)
+        seconds = max(0, timestamp - store.ticket_created_at(ticket_id, timestamp))
+        store.record_resolution(ticket_id, seconds)
+        sla_latency.observe("resolution", seconds)
+        record_stats(timestamp, {"closed": 1})
+
+    def reopened(self, ticket_id, timestamp):
+        first_response = store.ticket_sla(ticket_id)[0]
+        self.track(ticket_id, store.ticket_created_at(ticket_id), timestamp, first_response is not None, timestamp)
+
+    def due(self, now):
+        """Pop the deadlines that have passed; returns [(kind, SlaState)] still to act on."""
+        actions = []
+        heap = self.heap
+        while heap and heap[0][0] <= now:
+            _, _, kind, state = heapq.heappop(heap)
+            if self.tickets.get(state.ticket_id) is not state:
+                continue  # closed since, or reopened with a new entry
+            if kind == "idle":
+                due = state.last_activity + self.idle_timeout
+                if due > now:
+                    self._push(due, kind, state)
+                    continue
+            elif kind == "response":
+                if state.responded:
+                    continue
+                if store.ticket_status(state.ticket_id) == TicketStatus.PENDING:
+                    state.parked = True  # the user has not written anything to reply to yet
+                    continue
+            actions.append((kind, state))
+        return actions
+
+
+sla = SlaTracker(TICKET_IDLE_TIMEOUT, SLA_FIRST_RESPONSE, SLA_RESOLUTION)
+
+async def check_sla(context):
+    """Repeating job: auto-close idle tickets and post breach alerts."""
+    now = int(time.time())
+    for kind, state in sla.due(now):
+        ticket_id = state.ticket_id
+        if kind == "idle":
+            await auto_close_ticket(context.bot, ticket_id, now - state.last_activity)
+            continue
+        target = SLA_FIRST_RESPONSE if kind == "response" else SLA_RESOLUTION
+        problem = "has no staff reply" if kind == "response" else "is still open"
+        text = (
+            f"⏰ <b>SLA Breach</b>\n\n"
+            f"Ticket {code(ticket_id)} {problem} {format_duration(now - state.created_at)} after it was opened "
+            f"(target: {format_duration(target)})."
+        )
+        outbound.submit(
+            ticket_id,
+            partial(notify_sla_breach, context.bot, text),
+            partial(report_sla_failure, ticket_id),
+        )
+
+async def auto_close_ticket(bot, ticket_id, idle):
+    user_id = store.ticket_user(ticket_id)
+    async with user_locks(user_id):
+        if store.ticket_status(ticket_id) == TicketStatus.CLOSED:
+            return
+        store.set_ticket_status(ticket_id, TicketStatus.CLOSED)
+        ticket_threads.pop(ticket_id, None)
+    now = int(time.time())
+    sla.closed(ticket_id, now)
+    record_stats(now, {"auto_closed": 1})
+    outbound.submit(
+        ticket_id,
+        partial(notify_auto_closed, bot, ticket_id, user_id, idle),
+        partial(report_sla_failure, ticket_id),
+    )
+
+async def notify_sla_breach(bot, text):
+    await bot.send_message(chat_id=GROUP_ID, text=text, parse_mode="HTML")
+
+async def notify_auto_closed(bot, ticket_id, user_id, idle):
+    await bot.send_message(
+        chat_id=GROUP_ID,
+        text=f"🕒 Ticket {code(ticket_id)} was closed automatically after {format_duration(idle)} without activity.",
+        parse_mode="HTML"
+    )
+    await bot.send_message(
+        chat_id=user_id,
+        text=f"🎫 Ticket ID: {code(ticket_id)}\nStatus: Closed\n\n"
+             "This ticket was closed automatically because there was no activity on it.\n"
+             "If you still need help, please create a new ticket.",
+        parse_mode="HTML"
+    )
+
+async def report_sla_failure(ticket_id, error):
+    print(f"SLA notice for {ticket_id} failed: {error}")
+
+# ================= BROADCAST ENGINE =================
+class TokenBucket:
+    """Async token bucket: `rate` tokens per second, bursts up to `capacity`."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now > self.updated:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate + max(0, self.updated - now))
+
+    def pause(self, seconds):
+        """Drain the bucket and hold it empty for `seconds` (used on RetryAfter)."""
+        self.tokens = 0
+        self.updated = max(self.updated, time.monotonic() + seconds)
+
+
+class BroadcastLimiter:
+    """Global bucket shared by every send plus one bucket per chat."""
+
+    def __init__(self, global_rate, per_chat_rate):
+        self.global_bucket = TokenBucket(global_rate)
+        self.per_chat_rate = per_chat_rate
+        self.chat_buckets = {}
+
+    async def acquire(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.per_chat_rate, 1)
+        await bucket.acquire()
+        await self.global_bucket.acquire()
+
+    def release(self, chat_id):
+        """Forget a chat's bucket once its delivery is finished (keeps memory flat)."""
+        self.chat_buckets.pop(chat_id, None)
+
+
+class BroadcastStats:
+    def __init__(self, total):
+        self.total = total
+        self.sent = 0
+        self.failed = 0
+        self.blocked = 0
+        self.started = time.monotonic()
+
+    @property
+    def done(self):
+        return self.sent + self.failed + self.blocked
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def rate(self):
+        elapsed = self.elapsed
+        return self.done / elapsed if elapsed > 0 else 0.0
+
+    def render(self, finished=False):
+        title = "📊 Broadcast Complete:" if finished else "📢 Broadcasting..."
+        return (
+            f"{title}\n"
+            f"✅ Sent: {self.sent}\n"
+            f"❌ Failed: {self.failed}\n"
+            f"🚫 Blocked: {self.blocked}\n"
+            f"👥 Total: {self.total}\n"
+            f"⚡ {self.rate:.1f} msg/s — {self.elapsed:.0f}s elapsed"
+        )
+
+
+broadcast_running = False
+
+
+async def _broadcast_worker(bot, queue, text, limiter, stats):
+    while True:
+        try:
+            user_id = queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return
+        for attempt in range(BROADCAST_MAX_RETRIES + 1):
+            await limiter.acquire(user_id)
+            try:
+                await bot.send_message(chat_id=user_id, text=text, parse_mode="HTML")
+            except RetryAfter as e:
+                # Flood control applies to the whole bot, so pause every worker
+                limiter.global_bucket.pause(e.retry_after)
+                if attempt == BROADCAST_MAX_RETRIES:
+                    stats.failed += 1
+                continue
+            except Forbidden:
+                stats.blocked += 1
+                store.block_user(user_id)
+                break
+            except BadRequest as e:
+                stats.failed += 1
+                print(f"Failed to send to {user_id}: {e}")
+                break
+            except NetworkError as e:
+                if attempt == BROADCAST_MAX_RETRIES:
+                    stats.failed += 1
+                    print(f"Failed to send to {user_id}: {e}")
+                else:
+                    await asyncio.sleep(2 ** attempt)
+                continue
+            except Exception as e:
+                stats.failed += 1
+                print(f"Failed to send to {user_id}: {e}")
+                break
+            else:
+                stats.sent += 1
+                break
+        limiter.release(user_id)
+
+
+async def _broadcast_progress(status_message, stats):
+    while True:
+        await asyncio.sleep(BROADCAST_PROGRESS_INTERVAL)
+        try:
+            await status_message.edit_text(stats.render(), parse_mode="HTML")
+        except Exception:
+            pass  # progress is best effort (e.g. "message is not modified")
+
+
+async def run_broadcast(bot, user_ids, text, status_message):
+    """Deliver `text` to every user through a bounded, rate-limited worker pool."""
+    global broadcast_running
+    queue = asyncio.Queue()
+    for user_id in user_ids:
+        queue.put_nowait(user_id)
+
+    stats = BroadcastStats(queue.qsize())
+    limiter = BroadcastLimiter(BROADCAST_GLOBAL_RATE, BROADCAST_PER_CHAT_RATE)
+    progress = asyncio.create_task(_broadcast_progress(status_message, stats))
+    try:
+        workers = [
+            asyncio.create_task(_broadcast_worker(bot, queue, text, limiter, stats))
+            for _ in range(max(1, min(BROADCAST_WORKERS, stats.total)))
+        ]
+        await asyncio.gather(*workers)
+    finally:
+        progress.cancel()
+        broadcast_running = False
+
+    try:
+        await status_message.edit_text(stats.render(finished=True), parse_mode="HTML")
+    except Exception:
+        await status_message.reply_text(stats.render(finished=True), parse_mode="HTML")
+    return stats
+
 # ================= /send (text only) =================
 async def send_direct(update: Update, context):
     if update.effective_chat.id != GROUP_ID:
@@ -556,26 +2297,30 @@ async def send_direct(update: Update, context):
     message = html.escape(" ".join(context.args[1:]))
 
     if target == "@all":
-        sent_count = 0
-        failed_count = 0
-        unique_users = set(user_latest_username.keys())
-        total_users = len(unique_users)
-        await update.message.reply_text(f"📢 Broadcasting to {total_users} users...", parse_mode="HTML")
-        for user_id in unique_users:
-            try:
-                await context.bot.send_message(
-                    chat_id=user_id,
-                    text=f"📢 Announcement from BlockVeil Support:\n\n{message}",
-                    parse_mode="HTML"
+        global broadcast_running
+        if broadcast_running:
+            await update.message.reply_text("⚠️ A broadcast is already in progress.", parse_mode="HTML")
+            return
+        broadcast_running = True  # claim it before the first await
+        try:
+            unique_users = store.broadcast_user_ids()
+            total_users = len(unique_users)
+            status_message = await update.message.reply_text(
+                f"📢 Broadcasting to {total_users} users...", parse_mode="HTML"
+            )
+            # Runs in the background so this handler (and other updates) are not held up;
+            # run_broadcast releases the claim when it is done
+            context.application.create_task(
+                run_broadcast(
+                    context.bot,
+                    unique_users,
+                    f"📢 Announcement from BlockVeil Support:\n\n{message}",
+                    status_message,
                 )
-                sent_count += 1
-            except Exception as e:
-                failed_count += 1
-                print(f"Failed to send to {user_id}: {e}")
-        await update.message.reply_text(
-            f"📊 Broadcast Complete:\n✅ Sent: {sent_count}\n❌ Failed: {failed_count}\n👥 Total: {total_users}",
-            parse_mode="HTML"
-        )
+            )
+        except Exception:
+            broadcast_running = False
+            raise
         return
 
     user_id = None
@@ -584,13 +2329,14 @@ async def send_direct(update: Update, context):
 
     if target.startswith("BV-"):
         ticket_id = target
-        if ticket_id not in ticket_status:
+        status = store.ticket_status(ticket_id)
+        if not status:
             await update.message.reply_text("❌ Ticket not found.", parse_mode="HTML")
             return
-        if ticket_status[ticket_id] == "Closed":
+        if status == TicketStatus.CLOSED:
             await update.message.reply_text("⚠️ Ticket is closed.", parse_mode="HTML")
             return
-        user_id = ticket_user[ticket_id]
+        user_id = store.ticket_user(ticket_id)
         final_message = f"🎫 Ticket ID: {code(ticket_id)}\n\n{message}"
 
     elif target.startswith("@"):
@@ -599,11 +2345,7 @@ async def send_direct(update: Update, context):
         if not username:
             await update.message.reply_text("❌ Username cannot be empty.", parse_mode="HTML")
             return
-        username_lower = username.lower()
-        for uid, uname in user_latest_username.items():
-            if uname.lower() == username_lower:
-                user_id = uid
-                break
+        user_id = store.find_user_id(username)
         if not user_id:
             await update.message.reply_text("❌ User not found.", parse_mode="HTML")
             return
@@ -629,8 +2371,9 @@ async def send_direct(update: Update, context):
         )
         # Log the message if it was sent to a ticket
         if ticket_id:
-            timestamp = get_bst_now()
-            ticket_messages[ticket_id].append(("BlockVeil Support", message, timestamp))
+            timestamp = int(time.time())
+            store.add_ticket_message(ticket_id, "BlockVeil Support", message, timestamp)
+            sla.responded(ticket_id, timestamp)
         await update.message.reply_text("✅ Message sent successfully.", parse_mode="HTML")
     except Exception as e:
         await update.message.reply_text(f"❌ Failed to send: {e}", parse_mode="HTML")
@@ -644,26 +2387,27 @@ async def open_ticket(update: Update, context):
         return
 
     ticket_id = context.args[0]
-    if ticket_id not in ticket_status:
+    status = store.ticket_status(ticket_id)
+    if not status:
         await update.message.reply_text("❌ Ticket not found.", parse_mode="HTML")
         return
 
-    if ticket_status[ticket_id] != "Closed":
+    if status != TicketStatus.CLOSED:
         await update.message.reply_text("⚠️ Ticket already open.", parse_mode="HTML")
         return
 
-    user_id = ticket_user[ticket_id]
+    user_id = store.ticket_user(ticket_id)
 
     # Check if user already has an active ticket
-    if user_id in user_active_ticket:
+    if store.user_active_ticket(user_id):
         await update.message.reply_text(
             "❌ This user already has an active ticket, so reopening this ticket at the moment is not possible.",
             parse_mode="HTML"
         )
         return
 
-    ticket_status[ticket_id] = "Processing"
-    user_active_ticket[user_id] = ticket_id
+    store.set_ticket_status(ticket_id, TicketStatus.PROCESSING)
+    sla.reopened(ticket_id, int(time.time()))
 
     try:
         await context.bot.send_message(
@@ -688,38 +2432,135 @@ async def status_ticket(update: Update, context):
         )
         return
 
+    if update.effective_chat.type == "private" and not check_rate_limit(update.effective_user.id, "status"):
+        await update.message.reply_text("⏱️ Too many requests. Please wait a moment.", parse_mode="HTML")
+        return
+
     ticket_id = context.args[0]
-    if ticket_id not in ticket_status:
+    status = store.ticket_status(ticket_id)
+    if not status:
         await update.message.reply_text(f"❌ Ticket {code(ticket_id)} not found.", parse_mode="HTML")
         return
 
     if update.effective_chat.type == "private":
         user_id = update.effective_user.id
         register_user(update.effective_user)  # Update user info
-        if ticket_user.get(ticket_id) != user_id:
+        if store.ticket_user(ticket_id) != user_id:
             await update.message.reply_text(
                 "❌ This ticket does not belong to you. Please use your correct Ticket ID.",
                 parse_mode="HTML"
             )
             return
 
-    text = f"🎫 Ticket ID: {code(ticket_id)}\nStatus: {ticket_status[ticket_id]}"
-    if ticket_id in ticket_created_at:
-        text += f"\nCreated at: {ticket_created_at[ticket_id]} (BST)"
+    text = f"🎫 Ticket ID: {code(ticket_id)}\nStatus: {status}"
+    created = store.ticket_created_at(ticket_id)
+    if created:
+        text += f"\nCreated at: {format_bst(created)} (BST)"
     if update.effective_chat.id == GROUP_ID:
-        uid = ticket_user[ticket_id]
-        current_username = user_latest_username.get(uid, ticket_username.get(ticket_id, "N/A"))
+        uid = store.ticket_user(ticket_id)
+        current_username = store.user_latest_username(uid, store.ticket_username(ticket_id, "N/A"))
         text += f"\nUser: @{current_username}"
+        first_response, resolution = store.ticket_sla(ticket_id)
+        if first_response is not None:
+            text += f"\nFirst response: {format_duration(first_response)}"
+        if resolution is not None and status == TicketStatus.CLOSED:
+            text += f"\nResolved in: {format_duration(resolution)}"
 
     await update.message.reply_text(text, parse_mode="HTML")
 
+# ================= USER DASHBOARDS =================
+def _profile_line(i, ticket_id, status, created_at):
+    return f"{i}. {code(ticket_id)} — {status}\n   Created: {format_bst(created_at)}\n"
+
+def _staff_line(i, ticket_id, status, created_at):
+    return f"{i}. {code(ticket_id)} - {status} (Created: {format_bst(created_at)} BST)"
+
+DASHBOARD_STYLES = {"profile": _profile_line, "staff": _staff_line}
+
+
+class DashboardCache:
+    """LRU of rendered ticket lines per (style, user).
+
+    An entry is rebuilt only when store.user_version() moved on, i.e. the
+    user opened a ticket or one of their tickets changed status.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()  # (style, user_id) -> (version, lines)
+
+    def lines(self, style, user_id):
+        key = (style, user_id)
+        version = store.user_version(user_id)
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] == version:
+            self.entries.move_to_end(key)
+            return entry[1]
+        render = DASHBOARD_STYLES[style]
+        lines = [render(i, *row) for i, row in enumerate(store.user_ticket_summaries(user_id), 1)]
+        self.entries[key] = (version, lines)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+        return lines
+
+
+dashboards = DashboardCache(DASHBOARD_CACHE_SIZE)
+
+def dashboard_page(lines, page, callback_prefix):
+    """Return (lines on the page, "Page x/y" or "", prev/next keyboard or None)."""
+    pages = max(1, (len(lines) + DASHBOARD_PAGE_SIZE - 1) // DASHBOARD_PAGE_SIZE)
+    page = max(0, min(page, pages - 1))
+    start = page * DASHBOARD_PAGE_SIZE
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"{callback_prefix}:{page - 1}"))
+    if page < pages - 1:
+        buttons.append(InlineKeyboardButton("Next ➡️", callback_data=f"{callback_prefix}:{page + 1}"))
+    note = f"Page {page + 1}/{pages} · {len(lines)} tickets" if pages > 1 else ""
+    return lines[start:start + DASHBOARD_PAGE_SIZE], note, InlineKeyboardMarkup([buttons]) if buttons else None
+
+async def edit_dashboard(query, text, keyboard):
+    try:
+        await query.edit_message_text(text, reply_markup=keyboard, parse_mode="HTML")
+    except BadRequest as e:
+        # Tapping a button twice re-renders the same page
+        if "not modified" not in str(e):
+            raise
+
 # ================= /profile =================
+def render_profile(user, page):
+    lines = dashboards.lines("profile", user.id)
+    parts = [
+        "👤 <b>My Dashboard</b>\n\n",
+        f"Name: {html.escape(user.first_name or '')}\n",
+        f"Username: @{html.escape(user.username or 'N/A')}\n",
+        f"UID: <code>{user.id}</code>\n\n",
+        f"📊 Total Tickets Created: {len(lines)}\n\n",
+    ]
+    keyboard = None
+    if lines:
+        page_lines, note, keyboard = dashboard_page(lines, page, "profile")
+        parts.append("\n".join(page_lines) + "\n")
+        if note:
+            parts.append(note + "\n\n")
+    else:
+        parts.append("No tickets created yet.\n\n")
+    parts.append(
+        "⚠️ Please do not share your sensitive information with this bot and never share your Ticket ID with anyone. "
+        "Only provide it directly to our official support bot."
+    )
+    return "".join(parts), keyboard
+
 async def profile(update: Update, context):
-    # Works for both command and callback
-    if update.callback_query:
-        await update.callback_query.answer()
-        user = update.callback_query.from_user
-        chat_id = update.callback_query.message.chat_id
+    # Works for the command, the "My Profile" button and the page buttons ("profile:<page>")
+    query = update.callback_query
+    if query:
+        user = query.from_user
+        if not check_rate_limit(user.id, "profile"):
+            await query.answer("⏱️ Too many requests. Please wait a moment.", show_alert=True)
+            return
+        await query.answer()
     else:
         if update.effective_chat.type != "private":
             await update.message.reply_text(
@@ -728,36 +2569,19 @@ async def profile(update: Update, context):
             )
             return
         user = update.effective_user
-        chat_id = update.message.chat_id
+        if not check_rate_limit(user.id, "profile"):
+            await update.message.reply_text("⏱️ Too many requests. Please wait a moment.", parse_mode="HTML")
+            return
 
     register_user(user)  # Update user info
 
-    user_id = user.id
-    first_name = html.escape(user.first_name or "")
-    username = user.username or "N/A"
-
-    tickets = user_tickets.get(user_id, [])
-    total_tickets = len(tickets)
-
-    response = f"👤 <b>My Dashboard</b>\n\n"
-    response += f"Name: {first_name}\n"
-    response += f"Username: @{html.escape(username)}\n"
-    response += f"UID: <code>{user_id}</code>\n\n"
-    response += f"📊 Total Tickets Created: {total_tickets}\n"
-
-    if tickets:
-        response += "\n"
-        for i, ticket_id in enumerate(tickets, 1):
-            status = ticket_status.get(ticket_id, "Unknown")
-            created = ticket_created_at.get(ticket_id, "Unknown")
-            response += f"{i}. {code(ticket_id)} — {status}\n"
-            response += f"   Created: {created}\n\n"
-    else:
-        response += "\nNo tickets created yet.\n\n"
-
-    response += "⚠️ Please do not share your sensitive information with this bot and never share your Ticket ID with anyone. Only provide it directly to our official support bot."
-
-    await context.bot.send_message(chat_id=chat_id, text=response, parse_mode="HTML")
+    if query and query.data.startswith("profile:"):
+        text, keyboard = render_profile(user, int(query.data.split(":")[1]))
+        await edit_dashboard(query, text, keyboard)
+        return
+    text, keyboard = render_profile(user, 0)
+    chat_id = query.message.chat_id if query else update.message.chat_id
+    await context.bot.send_message(chat_id=chat_id, text=text, reply_markup=keyboard, parse_mode="HTML")
 
 # ================= /list =================
 async def list_tickets(update: Update, context):
@@ -774,43 +2598,177 @@ async def list_tickets(update: Update, context):
         )
         return
 
-    data = []
-    for tid, st in ticket_status.items():
-        if (mode == "open" and st != "Closed") or (mode == "close" and st == "Closed"):
-            uid = ticket_user[tid]
-            current_username = user_latest_username.get(uid, ticket_username.get(tid, "N/A"))
-            data.append((tid, current_username))
-
-    if not data:
-        await update.message.reply_text("No tickets found.", parse_mode="HTML")
+    text, keyboard = render_ticket_list(mode, 0)
+    await update.message.reply_text(text, reply_markup=keyboard, parse_mode="HTML")
+
+def render_ticket_list(mode, page):
+    """Build one page of /list output and its prev/next buttons."""
+    closed = mode == "close"
+    total = store.count_tickets(closed)
+    if not total:
+        return "No tickets found.", None
+
+    pages = (total + LIST_PAGE_SIZE - 1) // LIST_PAGE_SIZE
+    page = max(0, min(page, pages - 1))
+    offset = page * LIST_PAGE_SIZE
+    lines = ["📂 Open Tickets\n" if mode == "open" else "📁 Closed Tickets\n"]
+    for i, (tid, uid, created_username) in enumerate(store.tickets_page(closed, offset, LIST_PAGE_SIZE), offset + 1):
+        current_username = store.user_latest_username(uid, created_username or "N/A")
+        lines.append(f"{i}. {code(tid)} – @{current_username}")
+    if pages > 1:
+        lines.append(f"\nPage {page + 1}/{pages} · {total} tickets")
+
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"list:{mode}:{page - 1}"))
+    if page < pages - 1:
+        buttons.append(InlineKeyboardButton("Next ➡️", callback_data=f"list:{mode}:{page + 1}"))
+    return "\n".join(lines), InlineKeyboardMarkup([buttons]) if buttons else None
+
+async def list_page(update: Update, context):
+    query = update.callback_query
+    await query.answer()
+    if query.message.chat_id != GROUP_ID:
         return
-
-    text = "📂 Open Tickets\n\n" if mode == "open" else "📁 Closed Tickets\n\n"
-    for i, (tid, uname) in enumerate(data, 1):
-        text += f"{i}. {code(tid)} – @{uname}\n"
-
-    await update.message.reply_text(text, parse_mode="HTML")
+    _, mode, page = query.data.split(":")
+    text, keyboard = render_ticket_list(mode, int(page))
+    await edit_dashboard(query, text, keyboard)
 
 # ================= /export =================
+EXPORT_FORMATS = {"txt": "txt", "text": "txt", "jsonl": "jsonl", "json": "jsonl", "csv": "csv"}
+
+def _csv_line(values):
+    buf = StringIO()
+    csv.writer(buf).writerow(values)
+    return buf.getvalue()
+
+def transcript_lines(ticket_id, fmt):
+    """Yield one ticket's log line by line in the requested format."""
+    if fmt == "txt":
+        yield "BlockVeil Support Messages\n\n"
+    elif fmt == "csv":
+        yield _csv_line(("ticket_id", "timestamp", "sender", "message"))
+    for sender, message, timestamp in store.iter_ticket_messages(ticket_id):
+        original_message = html.unescape(message)
+        bst = format_bst(timestamp)
+        if fmt == "txt":
+            yield f"[{bst}] {sender} : {original_message}\n"
+        elif fmt == "jsonl":
+            yield json.dumps(
+                {"ticket_id": ticket_id, "timestamp": bst, "epoch": timestamp, "sender": sender, "message": original_message},
+                ensure_ascii=False,
+            ) + "\n"
+        else:
+            yield _csv_line((ticket_id, bst, sender, original_message))
+
+def write_transcript(fh, ticket_id, fmt):
+    """Stream a transcript into a binary file object in EXPORT_CHUNK_SIZE writes."""
+    chunk = []
+    size = 0
+    for line in transcript_lines(ticket_id, fmt):
+        data = line.encode()
+        chunk.append(data)
+        size += len(data)
+        if size >= EXPORT_CHUNK_SIZE:
+            fh.write(b"".join(chunk))
+            chunk.clear()
+            size = 0
+    fh.write(b"".join(chunk))
+
+# The builders run on a worker thread, off the event loop. Files are written
+# through spooled temp files, but PTB uploads from memory, so the finished
+# file is returned as bytes and one export still needs RAM for its
+# (compressed) size. Bytes also avoid PTB naming a file object after its
+# path, which a spooled file still in memory does not have.
+def build_ticket_export(ticket_id, fmt):
+    """Return (content, filename) for one ticket, gzipped above EXPORT_GZIP_THRESHOLD."""
+    raw = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE)
+    write_transcript(raw, ticket_id, fmt)
+    filename = f"{ticket_id}.{fmt}"
+    if raw.tell() > EXPORT_GZIP_THRESHOLD:
+        raw.seek(0)
+        packed = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE)
+        with gzip.GzipFile(filename=filename, mode="wb", fileobj=packed) as gz:
+            shutil.copyfileobj(raw, gz, EXPORT_CHUNK_SIZE)
+        raw.close()
+        raw, filename = packed, filename + ".gz"
+    with raw:
+        raw.seek(0)
+        return raw.read(), filename
+
+def build_archive_export(ticket_ids, fmt):
+    """Return a zip holding one transcript per ticket, written one entry at a time."""
+    with tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE) as archive:
+        with zipfile.ZipFile(archive, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+            for ticket_id in ticket_ids:
+                with zf.open(f"{ticket_id}.{fmt}", "w") as entry:
+                    write_transcript(entry, ticket_id, fmt)
+        archive.seek(0)
+        return archive.read()
+
+def _parse_export_date(value):
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").strftime("%Y-%m-%d")
+    except ValueError:
+        return None
+
 async def export_ticket(update: Update, context):
     if update.effective_chat.id != GROUP_ID or not context.args:
         return
 
-    ticket_id = context.args[0]
-    if ticket_id not in ticket_messages:
-        await update.message.reply_text("❌ Ticket not found.", parse_mode="HTML")
+    args = list(context.args)
+    fmt = "txt"
+    if len(args) > 1 and args[-1].lower() in EXPORT_FORMATS:
+        fmt = EXPORT_FORMATS[args.pop().lower()]
+    target = args[0]
+
+    if target.startswith("BV-"):
+        ticket_id = target
+        if not store.ticket_status(ticket_id):
+            await update.message.reply_text("❌ Ticket not found.", parse_mode="HTML")
+            return
+        store.flush()  # the export thread reads what is queued so far
+        document, filename = await asyncio.to_thread(build_ticket_export, ticket_id, fmt)
+        await context.bot.send_document(GROUP_ID, document=InputFile(document, filename=filename))
         return
 
-    buf = BytesIO()
-    buf.write("BlockVeil Support Messages\n\n".encode())
-    for sender, message, timestamp in ticket_messages[ticket_id]:
-        import html as html_lib
-        original_message = html_lib.unescape(message)
-        line = f"[{timestamp}] {sender} : {original_message}\n"
-        buf.write(line.encode())
-    buf.seek(0)
-    buf.name = f"{ticket_id}.txt"
-    await context.bot.send_document(GROUP_ID, document=buf)
+    start = _parse_export_date(target)
+    if start:
+        end = _parse_export_date(args[1]) if len(args) > 1 else start
+        if not end:
+            await update.message.reply_text("❌ Invalid date. Use YYYY-MM-DD.", parse_mode="HTML")
+            return
+        ticket_ids = store.tickets_created_between(parse_bst(f"{start} 00:00:00"), parse_bst(f"{end} 23:59:59"))
+        archive_name = f"tickets_{start}_{end}.zip"
+    else:
+        if target.startswith("@"):
+            user_id = store.find_user_id(target[1:]) or store.find_alias_user_id(target[1:])
+        else:
+            try:
+                user_id = int(target)
+            except ValueError:
+                await update.message.reply_text(
+                    "Usage:\n"
+                    "/export BV-XXXXX [txt|jsonl|csv]\n"
+                    "/export @username [format]\n"
+                    "/export user_id [format]\n"
+                    "/export YYYY-MM-DD [YYYY-MM-DD] [format]",
+                    parse_mode="HTML"
+                )
+                return
+        if not user_id:
+            await update.message.reply_text("❌ User not found.", parse_mode="HTML")
+            return
+        ticket_ids = store.user_tickets(user_id)
+        archive_name = f"tickets_{user_id}.zip"
+
+    if not ticket_ids:
+        await update.message.reply_text("❌ No tickets found.", parse_mode="HTML")
+        return
+
+    store.flush()
+    archive = await asyncio.to_thread(build_archive_export, ticket_ids, fmt)
+    await context.bot.send_document(GROUP_ID, document=InputFile(archive, filename=archive_name))
 
 # ================= /history =================
 async def ticket_history(update: Update, context):
@@ -822,18 +2780,11 @@ async def ticket_history(update: Update, context):
 
     if target.startswith("@"):
         username = target[1:]
-        username_lower = username.lower()
-        # Search in all known users (user_latest_username)
-        for uid, uname in user_latest_username.items():
-            if uname.lower() == username_lower:
-                user_id = uid
-                break
+        # Search in all known users first
+        user_id = store.find_user_id(username)
         if not user_id:
             # Fallback to ticket usernames (old)
-            for tid, uname in ticket_username.items():
-                if uname.lower() == username_lower:
-                    user_id = ticket_user[tid]
-                    break
+            user_id = store.find_alias_user_id(username)
     else:
         try:
             user_id = int(target)
@@ -846,24 +2797,80 @@ async def ticket_history(update: Update, context):
         return
 
     # Check if user has any tickets
-    if user_id not in user_tickets:
-        # User exists in user_latest_username? (if found from ticket_username, they would have tickets)
-        if user_id in user_latest_username:
+    user_ticket_list = store.user_tickets(user_id)
+    if not user_ticket_list:
+        # Known user? (if found from a ticket username, they would have tickets)
+        if store.user_latest_username(user_id) is not None:
             await update.message.reply_text("❌ User has no tickets.", parse_mode="HTML")
         else:
-            # This case should not happen if we found from ticket_username, but just in case
+            # This case should not happen if we found from a ticket username, but just in case
             await update.message.reply_text("❌ User not found.", parse_mode="HTML")
         return
 
-    text = f"📋 Ticket History for {target}\n\n"
-    for i, tid in enumerate(user_tickets[user_id], 1):
-        status = ticket_status.get(tid, "Unknown")
-        created = ticket_created_at.get(tid, "")
-        text += f"{i}. {code(tid)} - {status}"
-        if created:
-            text += f" (Created: {created} BST)"
-        text += "\n"
-    await update.message.reply_text(text, parse_mode="HTML")
+    text, keyboard = render_history(user_id, target, 0)
+    await update.message.reply_text(text, reply_markup=keyboard, parse_mode="HTML")
+
+def render_history(user_id, target, page):
+    page_lines, note, keyboard = dashboard_page(dashboards.lines("staff", user_id), page, f"history:{user_id}")
+    text = f"📋 Ticket History for {html.escape(target)}\n\n" + "\n".join(page_lines) + "\n"
+    if note:
+        text += f"\n{note}"
+    return text, keyboard
+
+# ================= /search =================
+SEARCH_SESSION_LIMIT = 1000
+search_sessions = OrderedDict()  # results message_id -> search terms, for the page buttons
+
+async def search(update: Update, context):
+    if update.effective_chat.id != GROUP_ID:
+        return
+    terms = search_terms(" ".join(context.args))
+    if not terms:
+        await update.message.reply_text("Usage: /search word [word ...]", parse_mode="HTML")
+        return
+
+    text, keyboard = render_search(terms, 0)
+    sent = await update.message.reply_text(text, reply_markup=keyboard, parse_mode="HTML")
+    if keyboard:
+        search_sessions[sent.message_id] = terms
+        if len(search_sessions) > SEARCH_SESSION_LIMIT:
+            search_sessions.popitem(last=False)
+
+def render_search(terms, page):
+    """Build one page of /search results (tickets whose log has every term)."""
+    offset = page * SEARCH_PAGE_SIZE
+    total, results = store.search_tickets(terms, offset, SEARCH_PAGE_SIZE)
+    query = html.escape(" ".join(terms))
+    if not total:
+        return f"🔎 No tickets mention: {query}", None
+
+    pages = (total + SEARCH_PAGE_SIZE - 1) // SEARCH_PAGE_SIZE
+    lines = [f"🔎 <b>{total} tickets</b> mention: {query}\n"]
+    for i, (tid, _score) in enumerate(results, offset + 1):
+        uid = store.ticket_user(tid)
+        current_username = store.user_latest_username(uid, store.ticket_username(tid, "N/A"))
+        lines.append(f"{i}. {code(tid)} – @{html.escape(current_username)} – {store.ticket_status(tid)}")
+    if pages > 1:
+        lines.append(f"\nPage {page + 1}/{pages}")
+
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"search:{page - 1}"))
+    if page < pages - 1:
+        buttons.append(InlineKeyboardButton("Next ➡️", callback_data=f"search:{page + 1}"))
+    return "\n".join(lines), InlineKeyboardMarkup([buttons]) if buttons else None
+
+async def search_page(update: Update, context):
+    query = update.callback_query
+    await query.answer()
+    if query.message.chat_id != GROUP_ID:
+        return
+    terms = search_sessions.get(query.message.message_id)
+    if terms is None:
+        await edit_dashboard(query, "⌛ This search has expired. Please run /search again.", None)
+        return
+    text, keyboard = render_search(terms, int(query.data.split(":")[1]))
+    await edit_dashboard(query, text, keyboard)
 
 # ================= /user =================
 async def user_list(update: Update, context):
@@ -872,8 +2879,8 @@ async def user_list(update: Update, context):
 
     buf = BytesIO()
     count = 1
-    # List all known users from user_latest_username (everyone who interacted)
-    for user_id, username in user_latest_username.items():
+    # List all known users (everyone who interacted)
+    for user_id, username in store.users():
         buf.write(f"{count} - @{username} - {user_id}\n".encode())
         count += 1
 
@@ -896,29 +2903,22 @@ async def which_user(update: Update, context):
 
     if target.startswith("@"):
         username_target = target[1:]
-        username_lower = username_target.lower()
         # Search in all known users first
-        for uid, uname in user_latest_username.items():
-            if uname.lower() == username_lower:
-                user_id = uid
-                username = uname
-                break
+        user_id = store.find_user_id(username_target)
         if not user_id:
             # Fallback to ticket usernames
-            for tid, uname in ticket_username.items():
-                if uname.lower() == username_lower:
-                    user_id = ticket_user[tid]
-                    username = uname
-                    break
+            user_id = store.find_alias_user_id(username_target)
+        if user_id:
+            username = store.user_latest_username(user_id, username_target)
     elif target.startswith("BV-"):
         ticket_id = target
-        if ticket_id in ticket_user:
-            user_id = ticket_user[ticket_id]
-            username = user_latest_username.get(user_id, ticket_username.get(ticket_id, "N/A"))
+        user_id = store.ticket_user(ticket_id)
+        if user_id:
+            username = store.user_latest_username(user_id, store.ticket_username(ticket_id, "N/A"))
     else:
         try:
             user_id = int(target)
-            username = user_latest_username.get(user_id, "")
+            username = store.user_latest_username(user_id, "")
         except:
             pass
 
@@ -926,27 +2926,135 @@ async def which_user(update: Update, context):
         await update.message.reply_text("❌ User not found.", parse_mode="HTML")
         return
 
-    user_ticket_list = user_tickets.get(user_id, [])
-    if not user_ticket_list:
+    text, keyboard = render_which(user_id, username, 0)
+    await update.message.reply_text(text, reply_markup=keyboard, parse_mode="HTML")
+
+def render_which(user_id, username, page):
+    lines = dashboards.lines("staff", user_id)
+    text = (
+        f"👤 <b>User Information</b>\n\n"
+        f"• User ID : {user_id}\n"
+        f"• Username : @{html.escape(username) if username else 'N/A'}\n\n"
+    )
+    if not lines:
         # Still show user info even if no tickets
-        response = f"👤 <b>User Information</b>\n\n"
-        response += f"• User ID : {user_id}\n"
-        response += f"• Username : @{html.escape(username) if username else 'N/A'}\n\n"
-        response += "📊 No tickets created yet."
+        return text + "📊 No tickets created yet.", None
+    page_lines, note, keyboard = dashboard_page(lines, page, f"which:{user_id}")
+    text += f"📊 <b>Created total {len(lines)} tickets.</b>\n\n" + "\n".join(page_lines) + "\n"
+    if note:
+        text += f"\n{note}"
+    return text, keyboard
+
+async def staff_dashboard_page(update: Update, context):
+    """Page buttons under /which and /history ("which:<user_id>:<page>")."""
+    query = update.callback_query
+    await query.answer()
+    if query.message.chat_id != GROUP_ID:
+        return
+    style, user_id, page = query.data.split(":")
+    user_id = int(user_id)
+    username = store.user_latest_username(user_id)
+    if style == "which":
+        text, keyboard = render_which(user_id, username, int(page))
     else:
-        response = f"👤 <b>User Information</b>\n\n"
-        response += f"• User ID : {user_id}\n"
-        response += f"• Username : @{html.escape(username) if username else 'N/A'}\n\n"
-        response += f"📊 <b>Created total {len(user_ticket_list)} tickets.</b>\n\n"
-        for i, ticket_id in enumerate(user_ticket_list, 1):
-            status = ticket_status.get(ticket_id, "Unknown")
-            created = ticket_created_at.get(ticket_id, "")
-            response += f"{i}. {code(ticket_id)} - {status}"
-            if created:
-                response += f" (Created: {created} BST)"
-            response += "\n"
-
-    await update.message.reply_text(response, parse_mode="HTML")
+        text, keyboard = render_history(user_id, f"@{username}" if username else str(user_id), int(page))
+    await edit_dashboard(query, text, keyboard)
+
+# ================= /stats =================
+# Counters are rolled up per hour on the write path, so a report reads at
+# most one bucket per hour of its period, however long the history is.
+FIRST_RESPONSE_BINS = 16  # log-scale latency bins per factor of e (each about 6% wide)
+STATS_MAX_HOURS = 366 * 24  # longest period besides "all"
+
+def record_stats(timestamp, counts):
+    """Add to the counters of the hour `timestamp` falls in and to the all-time totals."""
+    counts = dict(counts)
+    messages = sum(value for metric, value in counts.items() if metric.startswith("media:"))
+    if messages:
+        counts[f"hour:{(timestamp + BST_OFFSET) // 3600 % 24}"] = messages
+    store.add_stats(timestamp // 3600, counts)
+    store.add_stats(STATS_TOTALS, counts)
+
+def first_response_metric(seconds):
+    return f"frt:{int(math.log1p(seconds) * FIRST_RESPONSE_BINS)}"
+
+def first_response_percentile(counts, q):
+    """Approximate first-response time (seconds) at quantile `q`, or None without data."""
+    bins = sorted((int(metric[4:]), value) for metric, value in counts.items() if metric.startswith("frt:"))
+    total = sum(value for _, value in bins)
+    seen = 0
+    for index, value in bins:
+        seen += value
+        if seen >= q * total:
+            return math.expm1((index + 0.5) / FIRST_RESPONSE_BINS)
+    return None
+
+def parse_stats_period(text, now):
+    """Return (label, first bucket, last bucket) for "today", "all", "<n>h" or "<n>d"; None if invalid."""
+    text = text.lower()
+    hour = now // 3600
+    if text == "all":
+        return "all time", STATS_TOTALS, STATS_TOTALS
+    if text == "today":
+        midnight = now - (now + BST_OFFSET) % 86400
+        return "today (BST)", midnight // 3600, hour
+    match = re.fullmatch(r"(\d+)([hd])", text)
+    if not match:
+        return None
+    hours = int(match[1]) * (24 if match[2] == "d" else 1)
+    if not 0 < hours <= STATS_MAX_HOURS:
+        return None
+    return f"last {text}", hour - hours + 1, hour
+
+def media_name(attr):
+    if attr == "text":
+        return "Text"
+    kind = MEDIA_BY_ATTR.get(attr)
+    return kind.label.strip("[]") if kind else "Unsupported"
+
+def render_stats(label, counts):
+    lines = [
+        f"📊 <b>Support Stats</b> — {label}",
+        "",
+        f"Tickets opened: {counts['opened']}",
+        f"Tickets closed: {counts['closed']} ({counts['auto_closed']} automatically)",
+        f"Staff replies: {counts['replies']}",
+    ]
+    median = first_response_percentile(counts, 0.5)
+    if median is not None:
+        p95 = first_response_percentile(counts, 0.95)
+        lines.append(f"First response: median {format_duration(median)}, p95 {format_duration(p95)}")
+    else:
+        lines.append("First response: no data")
+
+    media = sorted(
+        ((metric[6:], value) for metric, value in counts.items() if metric.startswith("media:") and value),
+        key=lambda item: (-item[1], item[0]),
+    )
+    lines += ["", f"Messages from users: {sum(value for _, value in media)}"]
+    lines.extend(f"• {media_name(attr)}: {value}" for attr, value in media)
+
+    hours = sorted(
+        ((int(metric[5:]), value) for metric, value in counts.items() if metric.startswith("hour:") and value),
+        key=lambda item: (-item[1], item[0]),
+    )[:3]
+    if hours:
+        lines += ["", "Busiest hours (BST):"]
+        lines.extend(f"• {h:02d}:00–{(h + 1) % 24:02d}:00: {value} messages" for h, value in hours)
+    return "\n".join(lines)
+
+async def ticket_stats(update: Update, context):
+    if update.effective_chat.id != GROUP_ID:
+        return
+    period = parse_stats_period(context.args[0] if context.args else "7d", int(time.time()))
+    if period is None:
+        await update.message.reply_text(
+            "❌ Invalid period.\nUsage: /stats [today|24h|7d|30d|all]",
+            parse_mode="HTML"
+        )
+        return
+    label, first, last = period
+    await update.message.reply_text(render_stats(label, store.stats_between(first, last)), parse_mode="HTML")
 
 # ================= MEDIA SEND COMMANDS (reply-based) =================
 async def send_media(update: Update, context, media_type):
@@ -962,33 +3070,10 @@ async def send_media(update: Update, context, media_type):
         return
 
     replied = update.message.reply_to_message
-    has_media = False
-    file_id = None
+    kind = MEDIA_BY_ATTR[media_type]
     media_caption = replied.caption or ""
 
-    if media_type == "photo" and replied.photo:
-        file_id = replied.photo[-1].file_id
-        has_media = True
-    elif media_type == "document" and replied.document:
-        file_id = replied.document.file_id
-        has_media = True
-    elif media_type == "audio" and replied.audio:
-        file_id = replied.audio.file_id
-        has_media = True
-    elif media_type == "voice" and replied.voice:
-        file_id = replied.voice.file_id
-        has_media = True
-    elif media_type == "video" and replied.video:
-        file_id = replied.video.file_id
-        has_media = True
-    elif media_type == "animation" and replied.animation:
-        file_id = replied.animation.file_id
-        has_media = True
-    elif media_type == "sticker" and replied.sticker:
-        file_id = replied.sticker.file_id
-        has_media = True
-
-    if not has_media:
+    if not getattr(replied, kind.attr):
         await update.message.reply_text(
             f"❌ The replied message does not contain a {media_type}.",
             parse_mode="HTML"
@@ -1015,24 +3100,21 @@ async def send_media(update: Update, context, media_type):
 
     if target.startswith("BV-"):
         ticket_id = target
-        if ticket_id not in ticket_status:
+        status = store.ticket_status(ticket_id)
+        if not status:
             await update.message.reply_text("❌ Ticket not found.", parse_mode="HTML")
             return
-        if ticket_status[ticket_id] == "Closed":
+        if status == TicketStatus.CLOSED:
             await update.message.reply_text("⚠️ Ticket is closed.", parse_mode="HTML")
             return
-        user_id = ticket_user[ticket_id]
+        user_id = store.ticket_user(ticket_id)
         prefix = f"🎫 Ticket ID: {code(ticket_id)}\n"
     elif target.startswith("@"):
         username = target[1:]
         if not username:
             await update.message.reply_text("❌ Username cannot be empty.", parse_mode="HTML")
             return
-        username_lower = username.lower()
-        for uid, uname in user_latest_username.items():
-            if uname.lower() == username_lower:
-                user_id = uid
-                break
+        user_id = store.find_user_id(username)
         if not user_id:
             await update.message.reply_text("❌ User not found.", parse_mode="HTML")
             return
@@ -1055,37 +3137,23 @@ async def send_media(update: Update, context, media_type):
         log_text = custom_caption  # store without prefix
     else:
         final_caption = prefix + (media_caption if media_caption else "")
-        log_text = media_caption if media_caption else f"[{media_type.capitalize()}]"
+        log_text = media_caption if media_caption else kind.label
 
     # Send media
     try:
-        if media_type == "photo":
-            await context.bot.send_photo(chat_id=user_id, photo=file_id, caption=final_caption, parse_mode="HTML")
-        elif media_type == "document":
-            await context.bot.send_document(chat_id=user_id, document=file_id, caption=final_caption, parse_mode="HTML")
-        elif media_type == "audio":
-            await context.bot.send_audio(chat_id=user_id, audio=file_id, caption=final_caption, parse_mode="HTML")
-        elif media_type == "voice":
-            await context.bot.send_voice(chat_id=user_id, voice=file_id, caption=final_caption, parse_mode="HTML")
-        elif media_type == "video":
-            await context.bot.send_video(chat_id=user_id, video=file_id, caption=final_caption, parse_mode="HTML")
-        elif media_type == "animation":
-            await context.bot.send_animation(chat_id=user_id, animation=file_id, caption=final_caption, parse_mode="HTML")
-        elif media_type == "sticker":
-            await context.bot.send_sticker(chat_id=user_id, sticker=file_id)
-            if final_caption:
-                await context.bot.send_message(chat_id=user_id, text=final_caption, parse_mode="HTML")
-                log_text = final_caption  # for sticker, caption is separate message
-            else:
-                log_text = "[Sticker]"
+        anchor = thread_anchor(ticket_id, user_id) if ticket_id else None
+        sent, header_sent = await copy_media(context.bot, user_id, replied, kind, final_caption, anchor)
     except Exception as e:
         await update.message.reply_text(f"❌ Failed to send: {e}", parse_mode="HTML")
         return
 
     # Log the message if it was sent to a ticket
     if ticket_id:
-        timestamp = get_bst_now()
-        ticket_messages[ticket_id].append(("BlockVeil Support", log_text, timestamp))
+        if header_sent or kind.caption:
+            set_thread_anchor(ticket_id, user_id, (header_sent or sent).message_id)
+        timestamp = int(time.time())
+        store.add_ticket_message(ticket_id, "BlockVeil Support", log_text, timestamp)
+        sla.responded(ticket_id, timestamp)
 
     await update.message.reply_text("✅ Media sent successfully.", parse_mode="HTML")
 
@@ -1111,35 +3179,686 @@ async def send_animation(update: Update, context):
 async def send_sticker(update: Update, context):
     await send_media(update, context, "sticker")
 
+# ================= API CALL METRICS =================
+class ApiCallStats:
+    """Bot API calls by method, the number of updates that caused them, and
+    how long calls waited for a pooled connection."""
+
+    def __init__(self):
+        self.calls = Counter()
+        self.updates = 0
+        self.pool_waits = 0
+        self.pool_wait_total = 0.0
+        self.pool_wait_max = 0.0
+        self.pool_timeouts = 0
+
+    def per_update(self):
+        return sum(self.calls.values()) / self.updates if self.updates else 0.0
+
+    def record_pool_wait(self, seconds):
+        pool_wait_latency.observe("api", seconds)
+        self.pool_waits += 1
+        self.pool_wait_total += seconds
+        self.pool_wait_max = max(self.pool_wait_max, seconds)
+
+    def render(self):
+        average = self.pool_wait_total / self.pool_waits if self.pool_waits else 0.0
+        lines = [
+            "📡 Bot API Calls",
+            f"Updates handled: {self.updates}",
+            f"Calls per update: {self.per_update():.2f}",
+            f"Pool wait: avg {average * 1000:.1f} ms, max {self.pool_wait_max * 1000:.1f} ms",
+            f"Pool timeouts: {self.pool_timeouts}",
+        ]
+        for method, count in self.calls.most_common():
+            lines.append(f"• {method}: {count}")
+        return "\n".join(lines)
+
+api_stats = ApiCallStats()
+
+async def _trace_pool_wait(request):
+    """httpx request hook: time from sending until the pool hands over a connection.
+
+    httpcore reports its first trace event (connect, or request headers on a
+    reused connection) once the request owns a connection.
+    """
+    queued = time.perf_counter()
+    waiting = True
+
+    async def trace(event, info):
+        nonlocal waiting
+        if waiting:
+            waiting = False
+            api_stats.record_pool_wait(time.perf_counter() - queued)
+
+    request.extensions["trace"] = trace
+
+class MeteredRequest(HTTPXRequest):
+    """HTTPXRequest that counts every Bot API call by method name and times
+    pool waits. Also sets keep-alive limits, which HTTPXRequest does not expose."""
+
+    def __init__(self, keepalive_connections=None, keepalive_expiry=5.0, **kwargs):
+        self.keepalive_connections = keepalive_connections
+        self.keepalive_expiry = keepalive_expiry
+        super().__init__(**kwargs)
+
+    def _build_client(self):
+        limits = self._client_kwargs["limits"]
+        self._client_kwargs["limits"] = httpx.Limits(
+            max_connections=limits.max_connections,
+            max_keepalive_connections=self.keepalive_connections or limits.max_connections,
+            keepalive_expiry=self.keepalive_expiry,
+        )
+        self._client_kwargs["event_hooks"] = {"request": [_trace_pool_wait]}
+        return super()._build_client()
+
+    async def do_request(self, url, method, *args, **kwargs):
+        api_method = url.rsplit("/", 1)[-1]
+        api_stats.calls[api_method] += 1
+        started = time.perf_counter()
+        try:
+            return await super().do_request(url, method, *args, **kwargs)
+        except TimedOut as e:
+            if isinstance(e.__cause__, httpx.PoolTimeout):
+                api_stats.pool_timeouts += 1
+            raise
+        finally:
+            api_latency.observe(api_method, time.perf_counter() - started)
+
+async def count_update(update: Update, context):
+    api_stats.updates += 1
+
+async def api_call_stats(update: Update, context):
+    if update.effective_chat.id != GROUP_ID:
+        return
+    await update.message.reply_text(api_stats.render(), parse_mode="HTML")
+
+# ================= METRICS =================
+# Prometheus text exposition, served on METRICS_LISTEN:METRICS_PORT/metrics.
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SLA_BUCKETS = (60, 300, 900, 1800, 3600, 4 * 3600, 8 * 3600, 86400, 3 * 86400, 7 * 86400)
+
+class Histogram:
+    """Latency histogram with one series per label value."""
+
+    def __init__(self, name, help_text, label, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = buckets
+        self.series = {}  # label value -> [per-bucket counts (last is +Inf), sum]
+
+    def observe(self, label_value, seconds):
+        series = self.series.get(label_value)
+        if series is None:
+            series = self.series[label_value] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, seconds)] += 1
+        series[1] += seconds
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for value, (counts, total) in sorted(self.series.items()):
+            labels = f'{self.label}="{value}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            cumulative += counts[-1]
+            lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {cumulative}")
+        return lines
+
+handler_latency = Histogram("blockveil_handler_seconds", "Handler run time.", "handler")
+api_latency = Histogram("blockveil_bot_api_seconds", "Bot API call latency.", "method")
+pool_wait_latency = Histogram("blockveil_bot_api_pool_wait_seconds", "Wait for a pooled connection.", "pool")
+sla_latency = Histogram("blockveil_ticket_sla_seconds", "Ticket time to first staff reply and to close.", "stage", SLA_BUCKETS)
+handler_errors = Counter()  # handler -> exceptions raised
+rate_limit_rejections = Counter()  # scope -> rejected requests
+
+def _counter_lines(name, help_text, label, values):
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+    lines.extend(f'{name}{{{label}="{key}"}} {value}' for key, value in sorted(values.items()))
+    return lines
+
+def _gauge_lines(name, help_text, value, labels=""):
+    return [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name}{labels} {value}"]
+
+def render_metrics():
+    lines = []
+    for histogram in (handler_latency, api_latency, pool_wait_latency, sla_latency):
+        lines.extend(histogram.render())
+    lines.extend(_counter_lines("blockveil_handler_errors_total", "Exceptions raised by handlers.", "handler", handler_errors))
+    lines.extend(_counter_lines("blockveil_bot_api_calls_total", "Bot API calls.", "method", api_stats.calls))
+    lines.extend(_counter_lines("blockveil_rate_limit_rejections_total", "Requests refused by the rate limiter.", "scope", rate_limit_rejections))
+    lines += [
+        "# HELP blockveil_updates_total Updates received.",
+        "# TYPE blockveil_updates_total counter",
+        f"blockveil_updates_total {api_stats.updates}",
+        "# HELP blockveil_bot_api_pool_timeouts_total Calls that found no free connection in time.",
+        "# TYPE blockveil_bot_api_pool_timeouts_total counter",
+        f"blockveil_bot_api_pool_timeouts_total {api_stats.pool_timeouts}",
+    ]
+    lines.extend(_gauge_lines("blockveil_open_tickets", "Pending and processing tickets.", store.count_tickets(closed=False)))
+    lines.extend(_gauge_lines("blockveil_outbound_pending", "Sends waiting in the outbound queues.", outbound.pending()))
+    sizes = dict(
+        store.sizes(),
+        rate_limiter=sum(len(entries) for entries in rate_limiter.tat.values()),
+        pending_albums=len(pending_albums),
+        thread_anchors=len(ticket_threads),
+        user_locks=len(user_locks.locks),
+        dashboards=len(dashboards.entries),
+        search_sessions=len(search_sessions),
+        sla_deadlines=len(sla.heap),
+    )
+    lines += ["# HELP blockveil_entries In-memory structure sizes.", "# TYPE blockveil_entries gauge"]
+    lines.extend(f'blockveil_entries{{structure="{name}"}} {size}' for name, size in sorted(sizes.items()))
+    return "\n".join(lines) + "\n"
+
+def timed_handler(name, callback):
+    """Wrap a handler callback to record its latency and errors."""
+    @wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            handler_errors[name] += 1
+            raise
+        finally:
+            handler_latency.observe(name, time.perf_counter() - started)
+    return wrapper
+
+def instrument_handlers(app):
+    for handlers in app.handlers.values():
+        for handler in handlers:
+            handler.callback = timed_handler(handler.callback.__name__, handler.callback)
+
+metrics_runner = None
+
+async def start_metrics_server():
+    global metrics_runner
+    if not METRICS_PORT:
+        return
+    from aiohttp import web
+
+    async def metrics(request):
+        return web.Response(
+            text=render_metrics(),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        )
+
+    server = web.Application()
+    server.router.add_get("/metrics", metrics)
+    runner = web.AppRunner(server, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, METRICS_LISTEN, METRICS_PORT).start()
+    except OSError as e:
+        print(f"Metrics server not started: {e}")
+        await runner.cleanup()
+        return
+    metrics_runner = runner
+
+async def stop_metrics_server():
+    global metrics_runner
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+        metrics_runner = None
+
+# ================= BACKGROUND JOBS =================
+async def cleanup_rate_limits(context):
+    rate_limiter.cleanup()
+
+# ================= STORAGE LIFECYCLE =================
+async def flush_storage(context):
+    store.flush()
+    if shard_link is not None:
+        await shard_link.release_acks()
+
+async def close_storage(application):
+    store.close()
+
+# ================= WEBHOOK SERVER =================
+async def serve_webhook(app):
+    """Receive updates on an aiohttp webhook server instead of long polling.
+
+    Runs the same startup/shutdown sequence as run_polling(). On SIGTERM or
+    SIGINT the server stops accepting requests, then the application drains
+    queued updates and in-flight handlers before shutting down.
+    """
+    from aiohttp import web
+
+    secret = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+
+    async def receive_update(request):
+        if request.headers.get("X-Telegram-Bot-Api-Secret-Token") != secret:
+            return web.Response(status=403)
+        try:
+            update = Update.de_json(await request.json(), app.bot)
+        except Exception:
+            return web.Response(status=400)
+        await app.update_queue.put(update)
+        return web.Response()
+
+    async def health(request):
+        return web.json_response({
+            "status": "ok" if app.running else "stopping",
+            "queued_updates": app.update_queue.qsize(),
+        })
+
+    server = web.Application(client_max_size=WEBHOOK_MAX_BODY)
+    server.router.add_post(WEBHOOK_PATH, receive_update)
+    server.router.add_get("/healthz", health)
+    runner = web.AppRunner(server, keepalive_timeout=WEBHOOK_KEEPALIVE, access_log=None)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    await app.start()
+    try:
+        await runner.setup()
+        await web.TCPSite(runner, WEBHOOK_LISTEN, WEBHOOK_PORT).start()
+        await app.bot.set_webhook(
+            url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=secret,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=Update.ALL_TYPES,
+        )
+        await stop.wait()
+    finally:
+        await runner.cleanup()  # stop accepting, finish in-flight requests
+        if app.running:
+            await app.stop()  # drain update_queue and running handlers
+        if app.post_stop:
+            await app.post_stop(app)
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+
+# ================= SHARDING =================
+# With SHARD_WORKERS > 0, the process holding SHARD_LOCK_PATH is the leader.
+# It long-polls getUpdates and passes every update, as a JSON line over
+# SHARD_SOCKET, to one of SHARD_WORKERS worker processes. Each worker is this
+# file started with SHARD_INDEX set. Everything about one user goes to
+# shard_of(user_id): private messages, taps, and staff replies and commands
+# for their tickets. So per-user ordering, locks, outbound queues and caches
+# stay inside one process. The SQLite database is the state they share.
+# Support group commands without a user target go to worker 0.
+GLOBAL_GROUP_COMMANDS = {"list", "search", "user", "apistats", "stats"}
+
+
+class ShardLink:
+    """A worker's connection to the leader: updates in, acks and group message routes out."""
+
+    def __init__(self, index, path):
+        self.index = index
+        self.path = path
+        self.writer = None
+        self.handled = []  # update IDs handled since the last storage commit
+
+    async def run(self, app):
+        """Feed updates from the leader to the application until the leader hangs up."""
+        reader, self.writer = await asyncio.open_unix_connection(self.path, limit=WEBHOOK_MAX_BODY)
+        self.writer.write(f"hello {self.index}\n".encode())
+        while line := await reader.readline():
+            await app.update_queue.put(Update.de_json(json.loads(line), app.bot))
+
+    def _send(self, line):
+        if self.writer is not None and not self.writer.is_closing():
+            self.writer.write(line.encode())
+
+    def ack(self, update_id):
+        """Acknowledged with the next storage commit (see release_acks)."""
+        self.handled.append(update_id)
+
+    async def release_acks(self):
+        """Commit pending writes, then acknowledge the updates that made them."""
+        if not self.handled:
+            return
+        handled, self.handled = self.handled, []
+        store.flush()
+        await asyncio.to_thread(store.wait_for_writes)
+        for update_id in handled:
+            self._send(f"ack {update_id}\n")
+
+    async def close(self):
+        """Acknowledge the rest (storage is closed, so committed) and hang up."""
+        for update_id in self.handled:
+            self._send(f"ack {update_id}\n")
+        self.handled = []
+        if self.writer is not None and not self.writer.is_closing():
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    def route(self, message_id):
+        self._send(f"route {message_id}\n")
+
+
+shard_link = None  # set in worker processes
+
+async def watch_update(update: Update, context):
+    # Runs first; the list collects the outbound sends this update queues
+    outbound_watch.set([])
+
+async def ack_update(update: Update, context):
+    # Runs after every other handler group. The acknowledgement waits for the
+    # update's sends, so a worker that dies with them queued gets it redelivered.
+    sends = outbound_watch.get()
+    if not sends:
+        shard_link.ack(update.update_id)
+        return
+
+    async def ack_when_sent():
+        await asyncio.gather(*sends)
+        shard_link.ack(update.update_id)
+
+    context.application.create_task(ack_when_sent())
+
+
+class ShardSupervisor:
+    """Leader side: keeps the worker processes running and routes updates to them.
+
+    Updates stay in `unacked` until their worker reports them handled, their
+    sends delivered and their writes committed. When a
+    worker dies it is restarted, and the new process first receives whatever
+    its predecessor had not acknowledged, in the original order. Delivery is
+    at least once: an update that was handled just before the crash, but not
+    acknowledged, is handled again.
+    """
+
+    def __init__(self, workers, socket_path):
+        self.workers = workers
+        self.socket_path = socket_path
+        self.links = [None] * workers  # StreamWriter of each connected worker
+        self.unacked = [OrderedDict() for _ in range(workers)]  # update_id -> encoded update
+        self.routes = OrderedDict()  # LRU of support group message_id -> worker, reported by workers
+        self.processes = [None] * workers
+        self.stopping = False
+
+    # ----- routing -----
+    def shard_for(self, data):
+        query = data.get("callback_query")
+        if query:
+            chat = (query.get("message") or {}).get("chat", {})
+            if chat.get("id") != GROUP_ID:
+                return shard_of(query["from"]["id"])
+            # Page buttons under /which and /history carry the user ID
+            kind, _, rest = (query.get("data") or "").partition(":")
+            if kind in ("which", "history"):
+                return shard_of(int(rest.split(":")[0]))
+            return 0
+        message = data.get("message") or data.get("edited_message")
+        if not message:
+            return 0
+        if message["chat"]["type"] == "private":
+            return shard_of(message["chat"]["id"])
+        return self._group_shard(message)
+
+    def _group_shard(self, message):
+        """Worker of the user whose ticket a support group message is about, else worker 0."""
+        text = message.get("text") or ""
+        if text.startswith("/"):
+            command, *args = text.split()
+            if command[1:].split("@")[0].lower() in GLOBAL_GROUP_COMMANDS:
+                return 0
+            user_id = self._target_user(args[0]) if args else None
+            if user_id is not None:
+                return shard_of(user_id)
+        reply = message.get("reply_to_message")
+        if reply:
+            shard = self.routes.get(reply["message_id"])
+            if shard is not None:
+                return shard
+            # Older messages, or ones mapped before this leader started
+            ticket_id = store.group_message_ticket(reply["message_id"])
+            if ticket_id:
+                return shard_of(store.ticket_user(ticket_id))
+        return 0
+
+    def _target_user(self, target):
+        if target.startswith("@"):
+            return store.find_user_id(target[1:]) or store.find_alias_user_id(target[1:])
+        if target.startswith("BV-"):
+            return store.ticket_user(target)
+        return int(target) if target.isdigit() else None
+
+    async def dispatch(self, data):
+        shard = self.shard_for(data)
+        line = json.dumps(data, separators=(",", ":")).encode() + b"\n"
+        self.unacked[shard][data["update_id"]] = line
+        link = self.links[shard]
+        if link is not None:  # otherwise it is sent when the worker (re)connects
+            link.write(line)
+            await link.drain()
+
+    # ----- workers -----
+    async def serve_worker(self, reader, writer):
+        hello = await reader.readline()
+        if not hello.startswith(b"hello "):
+            writer.close()
+            return
+        index = int(hello.split()[1])
+        self.links[index] = writer
+        for line in self.unacked[index].values():
+            writer.write(line)
+        try:
+            while line := await reader.readline():
+                kind, value = line.split()
+                if kind == b"ack":
+                    self.unacked[index].pop(int(value), None)
+                else:
+                    self.routes[int(value)] = index
+                    if len(self.routes) > GROUP_MESSAGE_CACHE_SIZE:
+                        self.routes.popitem(last=False)
+        except ConnectionError:
+            pass
+        finally:
+            if self.links[index] is writer:
+                self.links[index] = None
+            writer.close()
+
+    async def supervise(self, index):
+        env = dict(os.environ, SHARD_INDEX=str(index), SHARD_SOCKET=self.socket_path)
+        while not self.stopping:
+            process = await asyncio.create_subprocess_exec(sys.executable, os.path.abspath(__file__), env=env)
+            self.processes[index] = process
+            code = await process.wait()
+            if not self.stopping:
+                print(f"Shard worker {index} exited with code {code}; restarting it")
+                await asyncio.sleep(SHARD_RESTART_DELAY)
+
+    async def stop(self):
+        """Stop the workers; each drains its queued updates before exiting."""
+        self.stopping = True
+        running = [p for p in self.processes if p is not None and p.returncode is None]
+        for process in running:
+            process.terminate()
+        await asyncio.gather(*(process.wait() for process in running))
+
+
+async def poll_updates(supervisor):
+    """Long-poll getUpdates and hand each update to its worker."""
+    url = (BOT_API_URL or "https://api.telegram.org/bot") + TOKEN
+    timeout = httpx.Timeout(BOT_API_READ_TIMEOUT + SHARD_POLL_TIMEOUT, connect=BOT_API_CONNECT_TIMEOUT)
+    offset = None
+    async with httpx.AsyncClient(timeout=timeout) as client:
+        try:
+            await client.post(f"{url}/deleteWebhook")  # getUpdates is refused while a webhook is set
+        except httpx.HTTPError as e:
+            print(f"deleteWebhook failed: {e}")
+        while True:
+            params = {"timeout": SHARD_POLL_TIMEOUT}
+            if offset is not None:
+                params["offset"] = offset
+            try:
+                response = await client.post(f"{url}/getUpdates", data=params)
+                updates = response.json()["result"]
+            except (httpx.HTTPError, ValueError, KeyError) as e:
+                print(f"getUpdates failed: {e}")
+                await asyncio.sleep(1)
+                continue
+            for data in updates:
+                await supervisor.dispatch(data)
+                offset = data["update_id"] + 1
+
+async def serve_sharded():
+    """Run as the leader of a sharded deployment, or wait as its standby."""
+    lock = open(SHARD_LOCK_PATH, "a")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        print("Another process is the leader; standing by")
+        await asyncio.to_thread(fcntl.flock, lock, fcntl.LOCK_EX)
+    print(f"Leading {SHARD_WORKERS} shard workers")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    supervisor = ShardSupervisor(SHARD_WORKERS, os.path.abspath(SHARD_SOCKET))
+    if os.path.exists(SHARD_SOCKET):
+        os.unlink(SHARD_SOCKET)  # left by a previous leader; we hold the lock now
+    server = await asyncio.start_unix_server(supervisor.serve_worker, SHARD_SOCKET, limit=WEBHOOK_MAX_BODY)
+    tasks = [asyncio.create_task(supervisor.supervise(i)) for i in range(SHARD_WORKERS)]
+    tasks.append(asyncio.create_task(poll_updates(supervisor)))
+    try:
+        await stop.wait()
+    finally:
+        tasks[-1].cancel()  # stop polling first
+        await supervisor.stop()
+        for task in tasks:
+            task.cancel()
+        server.close()
+        store.close()
+        lock.close()
+
+async def serve_shard_worker(app):
+    """Run as worker SHARD_INDEX: take updates from the leader instead of Telegram."""
+    global shard_link
+    shard_link = ShardLink(int(SHARD_INDEX), SHARD_SOCKET)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    await app.start()
+    feed = asyncio.create_task(shard_link.run(app))
+    stopped = asyncio.create_task(stop.wait())
+    try:
+        await asyncio.wait((feed, stopped), return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        feed.cancel()
+        stopped.cancel()
+        if app.running:
+            await app.stop()  # drain update_queue and running handlers
+        if app.post_stop:
+            await app.post_stop(app)
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+        await shard_link.close()
+
 # ================= INIT =================
-app = ApplicationBuilder().token(TOKEN).build()
-
-app.add_handler(CommandHandler("start", start))
-app.add_handler(CommandHandler("close", close_ticket))
-app.add_handler(CommandHandler("open", open_ticket))
-app.add_handler(CommandHandler("send", send_direct))
-app.add_handler(CommandHandler("status", status_ticket))
-app.add_handler(CommandHandler("profile", profile))
-app.add_handler(CommandHandler("list", list_tickets))
-app.add_handler(CommandHandler("export", export_ticket))
-app.add_handler(CommandHandler("history", ticket_history))
-app.add_handler(CommandHandler("user", user_list))
-app.add_handler(CommandHandler("which", which_user))
-app.add_handler(CommandHandler("requestclose", request_close))
-
-# Media send commands
-app.add_handler(CommandHandler("send_photo", send_photo))
-app.add_handler(CommandHandler("send_document", send_document))
-app.add_handler(CommandHandler("send_audio", send_audio))
-app.add_handler(CommandHandler("send_voice", send_voice))
-app.add_handler(CommandHandler("send_video", send_video))
-app.add_handler(CommandHandler("send_animation", send_animation))
-app.add_handler(CommandHandler("send_sticker", send_sticker))
-
-app.add_handler(CallbackQueryHandler(create_ticket, pattern="create_ticket"))
-app.add_handler(CallbackQueryHandler(profile, pattern="profile"))
-
-app.add_handler(MessageHandler(filters.ChatType.PRIVATE & ~filters.COMMAND, user_message))
-app.add_handler(MessageHandler(filters.ChatType.GROUPS & ~filters.COMMAND, group_reply))
-
-app.run_polling()
+def build_app():
+    builder = (
+        ApplicationBuilder()
+        .token(TOKEN)
+        .concurrent_updates(UPDATE_CONCURRENCY)
+        .request(MeteredRequest(
+            connection_pool_size=BOT_API_POOL_SIZE,
+            keepalive_connections=BOT_API_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=BOT_API_KEEPALIVE_EXPIRY,
+            http_version=BOT_API_HTTP_VERSION,
+            connect_timeout=BOT_API_CONNECT_TIMEOUT,
+            read_timeout=BOT_API_READ_TIMEOUT,
+            write_timeout=BOT_API_WRITE_TIMEOUT,
+            pool_timeout=BOT_API_POOL_TIMEOUT,
+        ))
+        # Long polling keeps its single connection out of the pool above;
+        # the poll timeout is added to read_timeout on each getUpdates.
+        .get_updates_request(HTTPXRequest(
+            connection_pool_size=1,
+            http_version=BOT_API_HTTP_VERSION,
+            connect_timeout=BOT_API_CONNECT_TIMEOUT,
+            read_timeout=BOT_API_READ_TIMEOUT,
+            pool_timeout=BOT_API_POOL_TIMEOUT,
+        ))
+        .post_init(on_start)
+        .post_stop(on_stop)
+        .post_shutdown(close_storage)
+    )
+    if BOT_API_URL:
+        builder.base_url(BOT_API_URL)
+    app = builder.build()
+
+    # Group -1 runs before the handlers below without blocking them.
+    app.add_handler(TypeHandler(Update, count_update), group=-1)
+    app.add_handler(CommandHandler("start", start))
+    app.add_handler(CommandHandler("close", close_ticket))
+    app.add_handler(CommandHandler("open", open_ticket))
+    app.add_handler(CommandHandler("send", send_direct))
+    app.add_handler(CommandHandler("status", status_ticket))
+    app.add_handler(CommandHandler("profile", profile))
+    app.add_handler(CommandHandler("list", list_tickets))
+    app.add_handler(CommandHandler("export", export_ticket))
+    app.add_handler(CommandHandler("history", ticket_history))
+    app.add_handler(CommandHandler("search", search))
+    app.add_handler(CommandHandler("user", user_list))
+    app.add_handler(CommandHandler("which", which_user))
+    app.add_handler(CommandHandler("requestclose", request_close))
+    app.add_handler(CommandHandler("apistats", api_call_stats))
+    app.add_handler(CommandHandler("stats", ticket_stats))
+
+    # Media send commands
+    app.add_handler(CommandHandler("send_photo", send_photo))
+    app.add_handler(CommandHandler("send_document", send_document))
+    app.add_handler(CommandHandler("send_audio", send_audio))
+    app.add_handler(CommandHandler("send_voice", send_voice))
+    app.add_handler(CommandHandler("send_video", send_video))
+    app.add_handler(CommandHandler("send_animation", send_animation))
+    app.add_handler(CommandHandler("send_sticker", send_sticker))
+
+    app.add_handler(CallbackQueryHandler(create_ticket, pattern="create_ticket"))
+    app.add_handler(CallbackQueryHandler(profile, pattern="profile"))
+    app.add_handler(CallbackQueryHandler(list_page, pattern="^list:"))
+    app.add_handler(CallbackQueryHandler(staff_dashboard_page, pattern="^(which|history):"))
+    app.add_handler(CallbackQueryHandler(search_page, pattern="^search:"))
+
+    app.add_handler(MessageHandler(filters.ChatType.PRIVATE & ~filters.COMMAND, user_message))
+    app.add_handler(MessageHandler(filters.ChatType.GROUPS & ~filters.COMMAND, group_reply))
+
+    if SHARD_INDEX is not None:
+        app.add_handler(TypeHandler(Update, watch_update), group=-2)
+        app.add_handler(TypeHandler(Update, ack_update), group=1)
+
+    instrument_handlers(app)
+
+    app.job_queue.run_repeating(flush_storage, interval=STORAGE_FLUSH_INTERVAL)
+    app.job_queue.run_repeating(cleanup_rate_limits, interval=RATE_LIMIT_CLEANUP_INTERVAL)
+    sla.load(store.open_ticket_activity(), int(time.time()))
+    app.job_queue.run_repeating(check_sla, interval=SLA_CHECK_INTERVAL)
+    return app
+
+if __name__ == "__main__":
+    if SHARD_INDEX is not None:
+        asyncio.run(serve_shard_worker(build_app()))
+    elif SHARD_WORKERS:
+        asyncio.run(serve_sharded())
+    elif WEBHOOK_URL:
+        asyncio.run(serve_webhook(build_app()))
+    else:
+        build_app().run_polling()
@@ -0,0 +1,107 @@
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("BOT_TOKEN", "0:test")
+os.environ.setdefault("GROUP_ID", "0")
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+
+import main  # noqa: E402
+
+
+class JobQueue:
+    def __init__(self):
+        self.jobs = []
+
+    def run_once(self, callback, when, data=None):
+        self.jobs.append((callback, when, data))
+
+
+class AlbumBot:
+    def __init__(self):
+        self.media_groups = []
+
+    async def send_media_group(self, chat_id, media):
+        self.media_groups.append((chat_id, media))
+        return [SimpleNamespace(message_id=500 + i) for i in range(len(media))]
+
+
+@pytest.fixture
+def env(monkeypatch):
+    store = main.MemoryStorage()
+    store.create_ticket("BV-0000000001", 42, "alice", 0)
+    submitted = []
+    monkeypatch.setattr(main, "store", store)
+    monkeypatch.setattr(main, "outbound", SimpleNamespace(submit=lambda *job: submitted.append(job)))
+    monkeypatch.setattr(main, "pending_albums", {})
+    monkeypatch.setattr(main, "ticket_threads", {})
+    monkeypatch.setattr(main, "ALBUM_WINDOW", 0)
+    context = SimpleNamespace(job_queue=JobQueue(), bot=AlbumBot())
+    return SimpleNamespace(store=store, submitted=submitted, context=context)
+
+
+def item(message_id, attr="photo", caption=None):
+    fields = {kind.attr: None for kind in main.MEDIA_KINDS}
+    fields[attr] = [SimpleNamespace(file_id=f"file-{message_id}")] if attr == "photo" \
+        else SimpleNamespace(file_id=f"file-{message_id}")
+    return SimpleNamespace(
+        message_id=message_id, media_group_id="G1", caption=caption,
+        from_user=SimpleNamespace(username="alice", first_name="Alice"), **fields,
+    )
+
+
+def flush(env):
+    for callback, _, data in env.context.job_queue.jobs:
+        env.context.job = SimpleNamespace(data=data)
+        asyncio.run(callback(env.context))
+
+
+def test_album_items_are_sent_as_one_media_group(env):
+    first = item(11, caption="first <b>")
+    assert main.start_album(env.context, first, main.resolve_media(first), "BV-0000000001", "HEADER\n")
+    assert main.add_to_album(item(13, "video"))
+    assert main.add_to_album(item(12, "photo", caption="second"))
+    flush(env)
+
+    [(ticket_id, send, _)] = env.submitted
+    assert ticket_id == "BV-0000000001" and not main.pending_albums
+    asyncio.run(send())
+    [(chat_id, media)] = env.context.bot.media_groups
+    assert chat_id == main.GROUP_ID
+    assert [m.media for m in media] == ["file-11", "file-12", "file-13"]  # in message order
+    assert media[0].caption == "HEADER\nfirst &lt;b&gt;"
+    assert media[1].caption == "second" and media[2].caption is None
+    assert isinstance(media[2], main.InputMediaVideo)
+    assert env.store.group_message_ticket(501) == "BV-0000000001"
+    assert [m.text for m in env.store.ticket_messages("BV-0000000001")] == ["first &lt;b&gt;\nsecond"]
+
+
+def test_caption_less_album_gets_a_placeholder(env):
+    first = item(11)
+    main.start_album(env.context, first, main.resolve_media(first), "BV-0000000001", "HEADER\n")
+    main.add_to_album(item(12))
+    flush(env)
+    asyncio.run(env.submitted[0][1]())
+    assert env.context.bot.media_groups[0][1][0].caption == "HEADER\n[Album: 2 items]"
+    assert [m.text for m in env.store.ticket_messages("BV-0000000001")] == ["[Album: 2 items]"]
+
+
+def test_refused_album_drops_its_items(env):
+    first = item(11)
+    assert main.start_album(env.context, first, main.resolve_media(first))  # no ticket: refused
+    assert main.add_to_album(item(12))
+    flush(env)
+    assert env.submitted == [] and not main.pending_albums
+
+
+def test_non_album_media_is_not_collected(env):
+    sticker = item(11, "sticker")
+    assert not main.start_album(env.context, sticker, main.resolve_media(sticker), "BV-0000000001")
+    single = item(12)
+    single.media_group_id = None
+    assert not main.start_album(env.context, single, main.resolve_media(single), "BV-0000000001")
+    assert not main.add_to_album(item(13))
@@ -0,0 +1,117 @@
+import asyncio
+import csv
+import gzip
+import io
+import json
+import os
+import sys
+import zipfile
+from types import SimpleNamespace
+
+import pytest
+import telegram
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("BOT_TOKEN", "0:test")
+os.environ.setdefault("GROUP_ID", "0")
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+
+import main  # noqa: E402
+
+
+class StubBot(telegram.Bot):
+    """Runs PTB's real request building, then records the call instead of sending it."""
+
+    def __init__(self):
+        super().__init__("0:test")
+        with self._unfrozen():
+            self.posts = []
+
+    async def _do_post(self, endpoint, data, **kwargs):
+        self.posts.append((endpoint, data))
+        return {"message_id": 1, "date": 0, "chat": {"id": main.GROUP_ID, "type": "supergroup"}}
+
+
+def run_export(*args):
+    bot = StubBot()
+    replies = []
+
+    async def reply_text(text, **kwargs):
+        replies.append(text)
+
+    update = SimpleNamespace(
+        effective_chat=SimpleNamespace(id=main.GROUP_ID),
+        message=SimpleNamespace(reply_text=reply_text),
+    )
+    asyncio.run(main.export_ticket(update, SimpleNamespace(bot=bot, args=list(args))))
+    assert not replies
+    [(endpoint, data)] = bot.posts
+    assert endpoint == "sendDocument"
+    return data["document"].filename, data["document"].input_file_content
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path, monkeypatch):
+    if request.param == "memory":
+        store = main.MemoryStorage()
+    else:
+        store = main.SQLiteStorage(str(tmp_path / "bot.db"))
+    monkeypatch.setattr(main, "store", store)
+    created = main.parse_bst("2024-05-01 10:00:00")
+    store.register_user(42, "alice")
+    store.create_ticket("BV-0000000001", 42, "alice", created)
+    store.add_ticket_message("BV-0000000001", "User", "hello wallet", created + 1)
+    store.add_ticket_message("BV-0000000001", "Support", "try again", created + 2)
+    yield store
+    store.close()
+
+
+def test_export_one_ticket(store):
+    filename, content = run_export("BV-0000000001")
+    assert filename == "BV-0000000001.txt"
+    assert b"hello wallet" in content and b"try again" in content
+
+
+def test_export_one_ticket_gzipped(store, monkeypatch):
+    monkeypatch.setattr(main, "EXPORT_GZIP_THRESHOLD", 0)
+    filename, content = run_export("BV-0000000001", "jsonl")
+    assert filename == "BV-0000000001.jsonl.gz"
+    assert b'"hello wallet"' in gzip.decompress(content)
+
+
+@pytest.mark.parametrize("args", [("@alice",), ("42", "csv"), ("2024-05-01",), ("2024-04-30", "2024-05-02")])
+def test_export_archive(store, args):
+    filename, content = run_export(*args)
+    assert filename.startswith("tickets_") and filename.endswith(".zip")
+    with zipfile.ZipFile(io.BytesIO(content)) as zf:
+        [name] = zf.namelist()
+        assert name.startswith("BV-0000000001.")
+        assert b"hello wallet" in zf.read(name)
+
+
+def test_builders_write_every_format(store):
+    store.add_ticket_message("BV-0000000001", "User", "a, &quot;quoted&quot; line", 1714536000)
+    store.flush()
+    content, filename = main.build_ticket_export("BV-0000000001", "txt")
+    assert filename == "BV-0000000001.txt"
+    assert content.decode().splitlines()[2] == "[2024-05-01 10:00:01] User : hello wallet"
+
+    content, _ = main.build_ticket_export("BV-0000000001", "jsonl")
+    rows = [json.loads(line) for line in content.decode().splitlines()]
+    assert [row["message"] for row in rows] == ["hello wallet", "try again", 'a, "quoted" line']
+    assert rows[0]["epoch"] == main.parse_bst("2024-05-01 10:00:01")
+
+    content, _ = main.build_ticket_export("BV-0000000001", "csv")
+    rows = list(csv.reader(io.StringIO(content.decode())))
+    assert rows[0] == ["ticket_id", "timestamp", "sender", "message"]
+    assert rows[3] == ["BV-0000000001", main.format_bst(1714536000), "User", 'a, "quoted" line']
+
+
+def test_archive_holds_one_entry_per_ticket(store, monkeypatch):
+    monkeypatch.setattr(main, "EXPORT_SPOOL_SIZE", 16)  # spill the archive to disk
+    store.create_ticket("BV-0000000002", 42, "alice", main.parse_bst("2024-05-02 10:00:00"))
+    store.add_ticket_message("BV-0000000002", "User", "second ticket", main.parse_bst("2024-05-02 10:00:01"))
+    store.flush()
+    with zipfile.ZipFile(io.BytesIO(main.build_archive_export(["BV-0000000001", "BV-0000000002"], "jsonl"))) as zf:
+        assert zf.namelist() == ["BV-0000000001.jsonl", "BV-0000000002.jsonl"]
+        assert b"second ticket" in zf.read("BV-0000000002.jsonl")
@@ -0,0 +1,51 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("BOT_TOKEN", "0:test")
+os.environ.setdefault("GROUP_ID", "0")
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+
+import main  # noqa: E402
+
+
+def test_evicted_mappings_round_trip_through_the_spill(tmp_path):
+    store = main.MemoryStorage(group_cache_size=3, spill_path=str(tmp_path / "spill.db"))
+    try:
+        for message_id in range(10):
+            store.map_group_message(message_id, f"BV-{message_id}")
+        assert len(store.group_messages) == 3
+        for message_id in range(10):
+            assert store.group_message_ticket(message_id) == f"BV-{message_id}"
+        assert len(store.group_messages) == 3
+        store.map_group_message(0, "BV-new")  # a remapped message wins over its spilled entry
+        for message_id in range(1, 10):
+            store.group_message_ticket(message_id)
+        assert store.group_message_ticket(0) == "BV-new"
+        assert store.group_message_ticket(99) is None
+    finally:
+        store.close()
+
+
+def test_spill_starts_empty(tmp_path):
+    path = str(tmp_path / "spill.db")
+    store = main.MemoryStorage(group_cache_size=1, spill_path=path)
+    store.map_group_message(1, "BV-1")
+    store.map_group_message(2, "BV-2")
+    store.close()
+    store = main.MemoryStorage(group_cache_size=1, spill_path=path)
+    try:
+        store.map_group_message(3, "BV-3")
+        store.map_group_message(4, "BV-4")
+        assert store.group_message_ticket(1) is None
+        assert store.group_message_ticket(3) == "BV-3"
+    finally:
+        store.close()
+
+
+def test_without_a_spill_evicted_mappings_are_forgotten():
+    store = main.MemoryStorage(group_cache_size=2)
+    for message_id in range(3):
+        store.map_group_message(message_id, f"BV-{message_id}")
+    assert store.group_message_ticket(0) is None
+    assert store.group_message_ticket(2) == "BV-2"
@@ -0,0 +1,85 @@
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+
+from telegram.error import BadRequest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("BOT_TOKEN", "0:test")
+os.environ.setdefault("GROUP_ID", "0")
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+
+import main  # noqa: E402
+
+
+class RecordingBot:
+    """Records Bot API calls; copy_message fails with BadRequest when `copy_fails` is set."""
+
+    def __init__(self, copy_fails=False):
+        self.calls = []
+        self.copy_fails = copy_fails
+        self.next_id = 100
+
+    def __getattr__(self, method):
+        async def call(**kwargs):
+            self.calls.append((method, kwargs))
+            if method == "copy_message" and self.copy_fails:
+                raise BadRequest("Message to copy not found")
+            self.next_id += 1
+            return SimpleNamespace(message_id=self.next_id)
+        return call
+
+
+def media_message(attr):
+    if attr == "photo":
+        attachment = [SimpleNamespace(file_id="small"), SimpleNamespace(file_id="large")]
+    else:
+        attachment = SimpleNamespace(file_id=f"{attr}-id")
+    fields = {kind.attr: None for kind in main.MEDIA_KINDS}
+    fields[attr] = attachment
+    return SimpleNamespace(chat_id=7, message_id=55, **fields)
+
+
+def copy(bot, attr, caption, anchor=None):
+    message = media_message(attr)
+    return asyncio.run(main.copy_media(bot, 9, message, main.resolve_media(message), caption, anchor))
+
+
+def test_resolve_media_prefers_animation_over_its_document():
+    message = media_message("animation")
+    message.document = SimpleNamespace(file_id="doc")
+    assert main.resolve_media(message).attr == "animation"
+    assert main.resolve_media(SimpleNamespace(**{kind.attr: None for kind in main.MEDIA_KINDS})) is None
+
+
+def test_captioned_media_is_one_copy():
+    bot = RecordingBot()
+    sent, header = copy(bot, "photo", "<b>header</b>")
+    assert header is None
+    assert bot.calls == [("copy_message", {
+        "chat_id": 9, "from_chat_id": 7, "message_id": 55, "caption": "<b>header</b>", "parse_mode": "HTML",
+    })]
+
+
+def test_sticker_replies_to_the_thread_anchor_in_one_call():
+    bot = RecordingBot()
+    sent, header = copy(bot, "sticker", "header", anchor=42)
+    assert header is None
+    assert bot.calls == [("copy_message", {
+        "chat_id": 9, "from_chat_id": 7, "message_id": 55,
+        "reply_to_message_id": 42, "allow_sending_without_reply": True,
+    })]
+
+
+def test_sticker_without_anchor_sends_the_header_first():
+    bot = RecordingBot()
+    sent, header = copy(bot, "video_note", "header")
+    assert [method for method, _ in bot.calls] == ["send_message", "copy_message"]
+    assert bot.calls[1][1]["reply_to_message_id"] == header.message_id
+
+
+def test_failed_copy_falls_back_to_the_file_id():
+    bot = RecordingBot(copy_fails=True)
+    copy(bot, "photo", "header")
+    assert bot.calls[1] == ("send_photo", {"chat_id": 9, "photo": "large", "caption": "header", "parse_mode": "HTML"})
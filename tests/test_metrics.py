@@ -0,0 +1,66 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("BOT_TOKEN", "0:test")
+os.environ.setdefault("GROUP_ID", "0")
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+
+import main  # noqa: E402
+
+
+def test_histogram_renders_cumulative_buckets():
+    histogram = main.Histogram("test_seconds", "Test latency.", "op", buckets=(0.1, 1))
+    for seconds in (0.05, 0.1, 0.5, 3):
+        histogram.observe("read", seconds)
+    histogram.observe("write", 0.2)
+    assert histogram.render() == [
+        "# HELP test_seconds Test latency.",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{op="read",le="0.1"} 2',
+        'test_seconds_bucket{op="read",le="1"} 3',
+        'test_seconds_bucket{op="read",le="+Inf"} 4',
+        'test_seconds_sum{op="read"} 3.65',
+        'test_seconds_count{op="read"} 4',
+        'test_seconds_bucket{op="write",le="0.1"} 0',
+        'test_seconds_bucket{op="write",le="1"} 1',
+        'test_seconds_bucket{op="write",le="+Inf"} 1',
+        'test_seconds_sum{op="write"} 0.2',
+        'test_seconds_count{op="write"} 1',
+    ]
+
+
+def test_timed_handler_records_latency_and_errors(monkeypatch):
+    histogram = main.Histogram("h", "", "handler")
+    monkeypatch.setattr(main, "handler_latency", histogram)
+    monkeypatch.setattr(main, "handler_errors", main.Counter())
+
+    async def ok(update, context):
+        return "done"
+
+    async def broken(update, context):
+        raise RuntimeError
+
+    assert asyncio.run(main.timed_handler("ok", ok)(None, None)) == "done"
+    with pytest.raises(RuntimeError):
+        asyncio.run(main.timed_handler("broken", broken)(None, None))
+    assert sorted(histogram.series) == ["broken", "ok"]
+    assert main.handler_errors == {"broken": 1}
+
+
+def test_render_metrics_exposes_every_family(monkeypatch):
+    store = main.MemoryStorage()
+    store.create_ticket("BV-0000000001", 42, "alice", 0)
+    monkeypatch.setattr(main, "store", store)
+    monkeypatch.setattr(main, "rate_limit_rejections", main.Counter({"private": 3}))
+    text = main.render_metrics()
+    assert text.endswith("\n")
+    assert "blockveil_open_tickets 1\n" in text
+    assert 'blockveil_rate_limit_rejections_total{scope="private"} 3\n' in text
+    assert 'blockveil_entries{structure="tickets"} 1\n' in text
+    for name in ("blockveil_handler_seconds", "blockveil_bot_api_seconds", "blockveil_ticket_sla_seconds",
+                 "blockveil_updates_total", "blockveil_outbound_pending"):
+        assert f"# TYPE {name} " in text
@@ -0,0 +1,67 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("BOT_TOKEN", "0:test")
+os.environ.setdefault("GROUP_ID", "0")
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+
+import main  # noqa: E402
+
+
+def test_overrides_apply_on_top_of_the_defaults():
+    limits = main.parse_rate_limits(" private=5/30 , profile=0, custom=4 ")
+    assert limits["private"] == (5, 30.0)
+    assert "profile" not in limits
+    assert limits["custom"] == (4, 60.0)
+    assert limits["status"] == main.DEFAULT_RATE_LIMITS["status"]
+
+
+@pytest.mark.parametrize("item", ["private=abc", "private=5/x", "private=", "private=5/0"])
+def test_malformed_items_keep_the_default(item, capsys):
+    limits = main.parse_rate_limits(f"{item},status=1/10")
+    assert limits["private"] == main.DEFAULT_RATE_LIMITS["private"]
+    assert limits["status"] == (1, 10.0)
+    assert "Ignoring RATE_LIMITS item" in capsys.readouterr().out
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(main.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_burst_then_one_request_per_interval(clock):
+    limiter = main.RateLimiter({"private": (2, 60)})
+    assert limiter.allow("private", 1) and limiter.allow("private", 1)
+    assert not limiter.allow("private", 1)
+    assert limiter.allow("private", 2)  # users are limited separately
+    clock[0] += 29
+    assert not limiter.allow("private", 1)
+    clock[0] += 1
+    assert limiter.allow("private", 1)
+    assert not limiter.allow("private", 1)
+
+
+def test_refused_requests_do_not_count(clock):
+    limiter = main.RateLimiter({"private": (1, 10)})
+    assert limiter.allow("private", 1)
+    for _ in range(5):
+        clock[0] += 1
+        assert not limiter.allow("private", 1)
+    clock[0] += 5
+    assert limiter.allow("private", 1)
+
+
+def test_unlimited_scopes_and_cleanup(clock):
+    limiter = main.RateLimiter({"private": (2, 60)})
+    assert all(limiter.allow("other", 1) for _ in range(100))
+    limiter.allow("private", 1)
+    limiter.cleanup()
+    assert 1 in limiter.tat["private"]
+    clock[0] += 30
+    limiter.cleanup()
+    assert limiter.tat["private"] == {}
@@ -0,0 +1,94 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("BOT_TOKEN", "0:test")
+os.environ.setdefault("GROUP_ID", "0")
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+
+import main  # noqa: E402
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = main.MemoryStorage()
+    monkeypatch.setattr(main, "store", store)
+    return store
+
+
+def open_ticket(store, tracker, ticket_id, created_at, user_id=1):
+    store.create_ticket(ticket_id, user_id, "alice", created_at)
+    tracker.opened(ticket_id, created_at)
+
+
+def kinds(actions):
+    return [(kind, state.ticket_id) for kind, state in actions]
+
+
+def test_deadlines_come_due_in_order(store):
+    tracker = main.SlaTracker(idle_timeout=1000, response_target=100, resolution_target=500)
+    open_ticket(store, tracker, "A", 0)
+    open_ticket(store, tracker, "B", 50, user_id=2)
+    for ticket_id in "AB":
+        store.set_ticket_status(ticket_id, main.TicketStatus.PROCESSING)
+    assert tracker.due(99) == []
+    assert kinds(tracker.due(150)) == [("response", "A"), ("response", "B")]
+    assert kinds(tracker.due(550)) == [("resolution", "A"), ("resolution", "B")]
+    assert kinds(tracker.due(1050)) == [("idle", "A"), ("idle", "B")]
+    assert tracker.heap == []
+
+
+def test_activity_pushes_the_idle_deadline_back(store):
+    tracker = main.SlaTracker(idle_timeout=100, response_target=0, resolution_target=0)
+    open_ticket(store, tracker, "A", 0)
+    tracker.activity("A", 80)
+    assert tracker.due(100) == []
+    assert [due for due, _, _, _ in tracker.heap] == [180]
+    assert kinds(tracker.due(180)) == [("idle", "A")]
+
+
+def test_replied_and_closed_tickets_are_not_alerted(store):
+    tracker = main.SlaTracker(idle_timeout=0, response_target=100, resolution_target=200)
+    open_ticket(store, tracker, "A", 0)
+    open_ticket(store, tracker, "B", 0, user_id=2)
+    store.set_ticket_status("A", main.TicketStatus.PROCESSING)
+    tracker.responded("A", 30)
+    assert store.ticket_sla("A") == (30, None)
+    tracker.closed("B", 40)
+    assert store.ticket_sla("B") == (None, 40)
+    assert kinds(tracker.due(300)) == [("resolution", "A")]
+
+
+def test_response_deadline_waits_for_the_users_first_message(store):
+    tracker = main.SlaTracker(idle_timeout=0, response_target=100, resolution_target=0)
+    open_ticket(store, tracker, "A", 0)
+    assert tracker.due(150) == []  # still Pending: nothing to reply to yet
+    assert tracker.tickets["A"].parked
+
+    store.set_ticket_status("A", main.TicketStatus.PROCESSING)
+    tracker.asked("A", 200)
+    assert tracker.due(299) == []
+    assert kinds(tracker.due(300)) == [("response", "A")]
+
+
+def test_restart_does_not_alert_past_deadlines_again(store):
+    tracker = main.SlaTracker(idle_timeout=100, response_target=100, resolution_target=100)
+    store.create_ticket("A", 1, "alice", 0)
+    store.set_ticket_status("A", main.TicketStatus.PROCESSING)
+    tracker.load([("A", 0, 450, None)], now=500)
+    assert [(due, kind) for due, _, kind, _ in tracker.heap] == [(550, "idle")]
+    assert tracker.due(549) == []
+    assert kinds(tracker.due(550)) == [("idle", "A")]
+
+
+def test_reopen_replaces_the_old_entries(store):
+    tracker = main.SlaTracker(idle_timeout=0, response_target=0, resolution_target=100)
+    open_ticket(store, tracker, "A", 0)
+    tracker.closed("A", 10)
+    store.set_ticket_status("A", main.TicketStatus.CLOSED)
+    store.set_ticket_status("A", main.TicketStatus.PROCESSING)
+    tracker.reopened("A", 20)
+    assert len(tracker.heap) == 2
+    assert kinds(tracker.due(150)) == [("resolution", "A")]  # the stale entry is dropped
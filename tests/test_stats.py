@@ -0,0 +1,76 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("BOT_TOKEN", "0:test")
+os.environ.setdefault("GROUP_ID", "0")
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+
+import main  # noqa: E402
+
+HOUR = 3600
+START = main.parse_bst("2024-05-01 09:00:00")  # an hour boundary in BST and UTC
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path, monkeypatch):
+    store = main.MemoryStorage() if request.param == "memory" else main.SQLiteStorage(str(tmp_path / "bot.db"))
+    monkeypatch.setattr(main, "store", store)
+    yield store
+    store.close()
+
+
+def read(store, first, last):
+    store.flush()
+    store.wait_for_writes()
+    return store.stats_between(first, last)
+
+
+def test_counters_roll_up_per_hour_and_in_total(store):
+    main.record_stats(START, {"opened": 1, "media:text": 2})
+    main.record_stats(START + 10, {"opened": 1, "media:photo": 1})
+    main.record_stats(START + 2 * HOUR, {"closed": 1, "media:text": 1})
+
+    hour = START // HOUR
+    first = read(store, hour, hour)
+    assert first["opened"] == 2 and first["media:text"] == 2 and first["media:photo"] == 1
+    assert first["hour:9"] == 3  # messages by hour of day (BST)
+    assert read(store, hour + 1, hour + 1) == {}
+    assert read(store, hour, hour + 2)["media:text"] == 3
+    totals = read(store, main.STATS_TOTALS, main.STATS_TOTALS)
+    assert totals["opened"] == 2 and totals["closed"] == 1 and totals["hour:11"] == 1
+
+
+def test_first_response_percentiles():
+    counts = {}
+    for seconds in (60, 60, 60, 3600):
+        metric = main.first_response_metric(seconds)
+        counts[metric] = counts.get(metric, 0) + 1
+    assert main.first_response_percentile(counts, 0.5) == pytest.approx(60, rel=0.04)
+    assert main.first_response_percentile(counts, 0.95) == pytest.approx(3600, rel=0.04)
+    assert main.first_response_percentile({}, 0.5) is None
+
+
+def test_parse_stats_period():
+    now = START + 30 * 60
+    hour = now // HOUR
+    assert main.parse_stats_period("all", now) == ("all time", main.STATS_TOTALS, main.STATS_TOTALS)
+    assert main.parse_stats_period("24h", now) == ("last 24h", hour - 23, hour)
+    assert main.parse_stats_period("7D", now) == ("last 7d", hour - 7 * 24 + 1, hour)
+    assert main.parse_stats_period("today", now) == ("today (BST)", hour - 9, hour)
+    for text in ("0h", "400d", "week", "-1d"):
+        assert main.parse_stats_period(text, now) is None
+
+
+def test_render_stats():
+    text = main.render_stats("last 7d", main.Counter({
+        "opened": 3, "closed": 2, "auto_closed": 1, "replies": 4,
+        "media:text": 5, "media:photo": 2, "hour:9": 7, main.first_response_metric(120): 1,
+    }))
+    assert "Tickets closed: 2 (1 automatically)" in text
+    assert "Messages from users: 7" in text
+    assert "• Text: 5" in text and "• Photo: 2" in text
+    assert "• 09:00–10:00: 7 messages" in text
+    assert "First response: median" in text
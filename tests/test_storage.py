@@ -0,0 +1,62 @@
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("BOT_TOKEN", "0:test")
+os.environ.setdefault("GROUP_ID", "0")
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+
+import main  # noqa: E402
+
+
+def test_search_finds_messages_logged_after_restart(tmp_path):
+    path = str(tmp_path / "bot.db")
+    store = main.SQLiteStorage(path)
+    store.create_ticket("BV-0000000001", 42, "alice", 1700000000)
+    store.add_ticket_message("BV-0000000001", "User", "hello wallet", 1700000001)
+    store.close()
+
+    # After a restart the ticket's log is not loaded until someone reads it
+    store = main.SQLiteStorage(path)
+    try:
+        assert store.get_ticket("BV-0000000001").messages is None
+        store.add_ticket_message("BV-0000000001", "User", "bitcoin refund", 1700000002)
+        store.flush()
+        store.wait_for_writes()  # search reads what the writer has committed
+        assert store.search_tickets(["bitcoin"], 0, 10)[1][0][0] == "BV-0000000001"
+        assert store.search_tickets(["wallet", "refund"], 0, 10)[0] == 1
+    finally:
+        store.close()
+
+
+def test_reads_see_uncommitted_writes_without_flushing(tmp_path, monkeypatch):
+    store = main.SQLiteStorage(str(tmp_path / "bot.db"))
+    release = threading.Event()
+    commit = store.writer._commit
+    monkeypatch.setattr(store.writer, "_commit", lambda db, batch: (release.wait(), commit(db, batch)))
+    try:
+        store.create_ticket("BV-0000000001", 42, "alice", 1700000000)
+        store.add_ticket_message("BV-0000000001", "User", "hello", 1700000001)
+        store.set_ticket_status("BV-0000000001", main.TicketStatus.CLOSED)
+        store.record_resolution("BV-0000000001", 60)
+        store.flush()  # handed to the writer, which cannot commit yet
+        store.add_ticket_message("BV-0000000001", "Support", "late reply", 1700000002)
+
+        assert store.ticket_status("BV-0000000001") == main.TicketStatus.CLOSED
+        assert [m.text for m in store.ticket_messages("BV-0000000001")] == ["hello", "late reply"]
+        assert store.ticket_sla("BV-0000000001") == (None, 60)
+        assert store.user_ticket_summaries(42) == [("BV-0000000001", main.TicketStatus.CLOSED, 1700000000)]
+        assert store.tickets_created_between(1700000000, 1700000000) == ["BV-0000000001"]
+        assert store.pending  # reads leave the batch alone
+
+        release.set()
+        store.flush()
+        store.wait_for_writes()
+        store.flush()
+        assert "BV-0000000001" not in store.tickets  # evicted once the close is on disk
+        assert [m.text for m in store.ticket_messages("BV-0000000001")] == ["hello", "late reply"]
+        assert store.ticket_sla("BV-0000000001") == (None, 60)
+    finally:
+        release.set()
+        store.close()
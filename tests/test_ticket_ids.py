@@ -0,0 +1,65 @@
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("BOT_TOKEN", "0:test")
+os.environ.setdefault("GROUP_ID", "0")
+os.environ.setdefault("STORAGE_BACKEND", "memory")
+
+import main  # noqa: E402
+
+ID_FORMAT = re.compile(r"BV-[0-9A-HJKMNP-TV-Z]{10}")
+
+
+def test_ids_are_unique_and_well_formed(monkeypatch):
+    monkeypatch.setattr(main, "store", main.MemoryStorage())
+    generator = main.TicketIdGenerator(block=64)
+    ids = generator.generate(5000) + [generator.generate()[0] for _ in range(500)]
+    assert len(set(ids)) == len(ids)
+    assert all(ID_FORMAT.fullmatch(tid) for tid in ids)
+    assert main.store.ticket_counter == 5000 + 8 * 64  # one reservation for the batch, then whole blocks
+
+
+def test_permutation_is_a_bijection_on_a_sample(monkeypatch):
+    monkeypatch.setattr(main, "store", main.MemoryStorage())
+    generator = main.TicketIdGenerator(block=1)
+    generator.generate()
+    numbers = list(range(1 << 16)) + [(1 << 50) - 1 - n for n in range(1 << 10)]
+    permuted = [generator._permute(n) for n in numbers]
+    assert len(set(permuted)) == len(numbers)
+    assert all(0 <= n < 1 << 50 for n in permuted)
+
+
+def test_processes_sharing_a_database_never_collide(tmp_path, monkeypatch):
+    path = str(tmp_path / "bot.db")
+    stores = [main.SQLiteStorage(path), main.SQLiteStorage(path)]
+    try:
+        generators = [main.TicketIdGenerator(block=16) for _ in stores]
+        ids = []
+        for _ in range(20):
+            for store, generator in zip(stores, generators):
+                monkeypatch.setattr(main, "store", store)
+                ids += generator.generate(7)
+        assert len(set(ids)) == len(ids) == 280
+        assert stores[0].ticket_id_key() == stores[1].ticket_id_key()
+    finally:
+        for store in stores:
+            store.close()
+
+
+def test_key_and_counter_survive_a_restart(tmp_path, monkeypatch):
+    path = str(tmp_path / "bot.db")
+    store = main.SQLiteStorage(path)
+    monkeypatch.setattr(main, "store", store)
+    before = main.TicketIdGenerator(block=8).generate(8)
+    store.close()
+
+    store = main.SQLiteStorage(path)
+    monkeypatch.setattr(main, "store", store)
+    try:
+        after = main.TicketIdGenerator(block=8).generate(8)
+        assert not set(before) & set(after)
+        assert store.reserve_ticket_numbers(1) == 16
+    finally:
+        store.close()